@@ -1,27 +1,61 @@
+import multiprocessing
 from flask import Flask
 from .config import Config
-from .init_db import sqlite
+from .init_db import sqlite, configure_engines, install_pragmas
 
-def create_app():
+def create_app(config=None, background=True):
+    """config 覆盖默认配置；background=False 时不启动对账、任务调度等后台线程（任务子进程用）"""
     app = Flask(__name__)
     app.config.from_object(Config)
     app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB
+    if config:
+        app.config.update(config)
+    configure_engines(app)
     sqlite.init_app(app)
 
     # ⚠️ 只在 app_context 下导入一次模型
     with app.app_context():
+        install_pragmas(app)
         from . import models  # 导入模型，保证 create_all 可以识别
         sqlite.create_all()
+        from .migrate import upgrade_schema, import_legacy_files
+        upgrade_schema()
+        import_legacy_files()
+
+    from . import metrics
+    metrics.init_app(app)
+    if app.config.get('PROFILE_ENABLED'):
+        from . import profiling
+        profiling.init_app(app)
+
+    # multiprocessing 子进程（任务进程池）不再启动后台线程
+    if background and not app.testing and multiprocessing.parent_process() is None:
+        from .usage import start_reconciler
+        from .jobs import start_dispatcher
+        start_reconciler(app)
+        start_dispatcher(app)
 
     # 注册蓝图
     from .routes.auth import auth_bp
     from .routes.file_ops import files_bp
     from .routes.folder_ops import folder_bp
     from .routes.admin import admin_bp
+    from .routes.upload_ops import upload_bp
+    from .routes.job_ops import jobs_bp
+    from .routes.metrics_ops import metrics_bp
+    from .routes.sync_ops import sync_bp
+    from .routes.batch_ops import batch_bp
+    from .routes.change_ops import changes_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(files_bp)
     app.register_blueprint(folder_bp)
     app.register_blueprint(admin_bp)
+    app.register_blueprint(upload_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(sync_bp)
+    app.register_blueprint(batch_bp)
+    app.register_blueprint(changes_bp)
 
     return app
@@ -0,0 +1,358 @@
+"""ASGI 入口：大文件传输走异步路由，其余请求交给原来的 Flask 应用
+
+    uvicorn app.asgi:app --workers 4
+
+需要安装 starlette（自带 anyio）和 python-multipart；a2wsgi 可选，用于挂载 Flask。
+/download、/download_folder、/upload 在事件循环里收发数据，慢速客户端只占一个协程，
+数据库访问和打包压缩放到线程池里短暂执行；服务器支持 zerocopysend 扩展时用 sendfile 发送本地文件。
+"""
+import os
+import hashlib
+from urllib.parse import quote
+import anyio
+from anyio import to_thread
+from flask import render_template
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from . import create_app
+from .blobstore import QuotaExceeded, HASH_BLOCK
+from .init_db import sqlite
+from .models import File, parent_of
+from .serving import offload_header, plan_blob
+from .storage import READ_BLOCK, get_storage
+from .usage import remaining_quota
+from .utils import content_disposition, normalize_rel_path, stream_zip
+from . import blobstore, compression, jobs, metrics, vfs
+
+flask_app = create_app()
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+def in_app(fn, *args):
+    """在线程池里带着 Flask 应用上下文执行同步代码（数据库会话随上下文结束归还）"""
+    def run():
+        with flask_app.app_context():
+            return fn(*args)
+    return to_thread.run_sync(run)
+
+def session_user(request):
+    """从 Flask 的签名 cookie 里取出登录用户 ID"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        data = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+def alert(msg, status=200):
+    return HTMLResponse(f"<script>alert('{msg}');window.history.back();</script>", status)
+
+def to_environ(request):
+    """plan_blob 只关心方法、条件请求头和 Accept-Encoding，拼出对应的 WSGI environ"""
+    environ = {'REQUEST_METHOD': request.method}
+    for name in ('range', 'if-range', 'if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since',
+                 'accept-encoding'):
+        if name in request.headers:
+            environ['HTTP_' + name.upper().replace('-', '_')] = request.headers[name]
+    return environ
+
+
+class BlobResponse:
+    """按 plan_blob 的结果发送文件内容，本地文件不经过线程池"""
+
+    def __init__(self, plan, storage):
+        self.status, self.headers, self.key, self.parts, self.tail, self.codec = plan
+        self.storage = storage
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in self.headers.items()],
+        })
+        if self.parts is None or scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        path = None if self.codec else self.storage.local_path(self.key)
+        zerocopy = path and 'http.response.zerocopysend' in scope.get('extensions', {})
+        reader = compression.BlobReader(self.storage, self.key, self.codec)
+        try:
+            await self._send_parts(path, zerocopy, reader, send)
+        finally:
+            reader.close()
+        await send({'type': 'http.response.body', 'body': self.tail, 'more_body': False})
+
+    async def _send_parts(self, path, zerocopy, reader, send):
+        for head, start, end in self.parts:
+            if head:
+                await send({'type': 'http.response.body', 'body': head, 'more_body': True})
+            if self.codec:
+                # 边解压边发送，解压在线程池里进行
+                blocks = reader.read(start, end)
+                while True:
+                    block = await to_thread.run_sync(next, blocks, None)
+                    if block is None:
+                        break
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+            elif zerocopy:
+                with open(path, 'rb') as fp:
+                    await send({'type': 'http.response.zerocopysend', 'file': fp,
+                                'offset': start, 'count': end - start, 'more_body': True})
+            elif path:
+                async with await anyio.open_file(path, 'rb') as fp:
+                    await fp.seek(start)
+                    await self._pump(fp.read, end - start, send)
+            else:
+                fp = await to_thread.run_sync(self.storage.open, self.key, start, end)
+                try:
+                    await self._pump(lambda n: to_thread.run_sync(fp.read, n), end - start, send)
+                finally:
+                    fp.close()
+
+    @staticmethod
+    async def _pump(read, remaining, send):
+        while remaining > 0:
+            block = await read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+
+
+# ------------------ 下载 ------------------
+def _plan_download(user_id, file_id, environ):
+    f = sqlite.session.get(File, file_id)
+    if not f or f.user_id != user_id or not f.blob_hash:
+        return None, None
+    storage = get_storage()
+    offload = offload_header(storage, blobstore.blob_key(f.blob_hash), flask_app.config)
+    plan = plan_blob(f, environ, storage, offload)
+    metrics.record_download(plan[0], plan[1], f.size)
+    return plan, storage
+
+async def download(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return RedirectResponse('/login', 302)
+    plan, storage = await in_app(_plan_download, user_id, request.path_params['file_id'], to_environ(request))
+    if plan is None or plan[0] == 404:
+        return Response('Not Found', 404)
+    return BlobResponse(plan, storage)
+
+
+def _start_folder_download(user_id, folder_path, url):
+    """与 files.download_folder 相同的判断，返回 (状态, 内容)：
+    ('missing', None) 文件夹不存在，('job', 等待页面 HTML) 大文件夹已转为后台打包，('stream', storage) 直接打包
+    """
+    with flask_app.test_request_context(url):  # 等待页面要用 url_for 生成链接
+        folder = None
+        if folder_path:
+            folder = vfs.get_entry(user_id, folder_path)
+            if not folder or not folder.is_folder:
+                return 'missing', None
+        job_id = jobs.zip_job_for(user_id, folder_path, folder)
+        if job_id:
+            return 'job', render_template('job_wait.html', job_id=job_id, folder_path=folder_path,
+                                          parent_of=parent_of)
+        return 'stream', get_storage()
+
+def _iter_folder(user_id, folder_path):
+    """分页读取 vfs.iter_blobs，不把整棵树一次读进内存
+
+    StreamingResponse 在线程池里逐个调用 next()，每页的查询在一次调用里带着应用上下文完成。
+    """
+    after = None
+    while True:
+        with flask_app.app_context():
+            page = list(vfs.iter_blobs(user_id, folder_path, after, vfs.ZIP_PAGE))
+        yield from page
+        if len(page) < vfs.ZIP_PAGE:
+            return
+        after = vfs.join_path(folder_path, page[-1][1])
+
+async def download_folder(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return RedirectResponse('/login', 302)
+    folder_path = request.query_params.get('folder_path', '').strip('/')
+    state, value = await to_thread.run_sync(_start_folder_download, user_id, folder_path, str(request.url))
+    if state == 'missing':
+        return alert('文件夹不存在！')
+    if state == 'job':
+        return HTMLResponse(value)
+    zip_name = (folder_path.split('/')[-1] or "root") + ".zip"
+    # 同步生成器由 StreamingResponse 逐块放到线程池里执行
+    entries = _iter_folder(user_id, folder_path)
+    return StreamingResponse(metrics.count_zip(stream_zip(entries, value)), media_type='application/zip', headers={
+        'Content-Disposition': content_disposition(zip_name),
+        'X-Accel-Buffering': 'no',
+    })
+
+
+# ------------------ 上传 ------------------
+class BodyTooLarge(Exception):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+
+def limit_body(request, limit, exc):
+    """同一请求的新 Request 对象，读到的请求体超过 limit 字节时抛出 exc
+
+    分块传输的请求没有 Content-Length，只能边接收边计数，不能等表单解析完整个请求体再检查。
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise exc(received)
+        return message
+    return Request(request.scope, receive)
+
+def _upload_budget(user_id, folder_path, names):
+    """本次上传最多能写入的字节数：剩余配额加上将被覆盖的同名文件大小，不限配额时为 None"""
+    remaining = remaining_quota(user_id)
+    if remaining is None:
+        return None
+    paths = [p for p in (normalize_rel_path(vfs.join_path(folder_path, n)) for n in names) if p]
+    existing = vfs.get_entries(user_id, paths)
+    return max(remaining, 0) + sum(e.size or 0 for e in existing.values() if not e.is_folder)
+
+async def _stage(upload, staged_path, limit=None):
+    """异步写入暂存区，哈希计算放到线程池里（hashlib 处理大块数据时会释放 GIL）
+
+    与 blobstore.stage_stream 一样，写入超过 limit 字节时立即中断并抛出 QuotaExceeded（暂存文件由调用方删除）。
+    """
+    digest = hashlib.sha256()
+    size = 0
+    async with await anyio.open_file(staged_path, 'wb') as fp:
+        while True:
+            block = await upload.read(HASH_BLOCK)
+            if not block:
+                break
+            size += len(block)
+            if limit is not None and size > limit:
+                raise QuotaExceeded(size)
+            await to_thread.run_sync(digest.update, block)
+            await fp.write(block)
+    return digest.hexdigest(), size
+
+def _save_uploads(user_id, folder_path, staged):
+    """与 files.upload 相同的登记逻辑：跳过同名文件夹，检查配额，整批入库后一次提交"""
+    targets = []
+    for path, blob_hash, size, name in staged:
+        db_filename = normalize_rel_path(vfs.join_path(folder_path, name))
+        if db_filename:
+            targets.append((path, blob_hash, size, db_filename))
+        else:
+            os.remove(path)
+    existing = vfs.get_entries(user_id, [t[3] for t in targets])
+    keep = []
+    for item in targets:
+        entry = existing.get(item[3])
+        if entry and entry.is_folder:
+            os.remove(item[0])
+        else:
+            keep.append(item)
+
+    remaining = remaining_quota(user_id)
+    if remaining is not None:
+        freed = sum(e.size or 0 for e in existing.values() if not e.is_folder)
+        if sum(size for _, _, size, _ in keep) - freed > remaining:
+            for path, *_ in keep:
+                os.remove(path)
+            raise QuotaExceeded()
+
+    blobstore.ingest_many([(path, blob_hash, size) for path, blob_hash, size, _ in keep])
+    saved = vfs.put_files(user_id, [(name, blob_hash, size) for _, blob_hash, size, name in keep])
+    sqlite.session.commit()
+    return len(saved)
+
+async def upload(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return RedirectResponse('/login', 302)
+    wants_json = request.headers.get('accept', '').startswith('application/json')
+
+    def quota_error():
+        return JSONResponse({'error': '空间不足'}, 413) if wants_json else alert('空间不足，上传已取消', 413)
+
+    # 读取请求体之前先按 Content-Length 检查大小和配额；没有 Content-Length 时在接收过程中计数，
+    # 超限立即中断，不会先把整个请求体缓存到临时文件
+    remaining = await in_app(remaining_quota, user_id)
+    max_length = flask_app.config.get('MAX_CONTENT_LENGTH')
+    quota_limit = None if remaining is None else max(remaining, 0) + MULTIPART_OVERHEAD
+    length = request.headers.get('content-length')
+    if length and length.isdigit():
+        if max_length is not None and int(length) > max_length:
+            return Response('Request Entity Too Large', 413)
+        if quota_limit is not None and int(length) > quota_limit:
+            return quota_error()
+    if max_length is not None:
+        request = limit_body(request, max_length, BodyTooLarge)
+    if quota_limit is not None:
+        request = limit_body(request, quota_limit, QuotaExceeded)
+
+    max_parts = flask_app.config.get('MAX_FORM_PARTS', 1000)
+    try:
+        form = await request.form(max_files=max_parts, max_fields=max_parts)
+    except BodyTooLarge:
+        return Response('Request Entity Too Large', 413)
+    except QuotaExceeded:
+        return quota_error()
+    folder_path = str(form.get('current_path', '')).strip('/')
+    staged = []
+    try:
+        uploads = [item for item in form.getlist('files') if isinstance(item, UploadFile) and item.filename]
+        # 暂存时按配额累计计数，超出立即停止，与 files.upload 的 stage_stream 一致
+        budget = await in_app(_upload_budget, user_id, folder_path, [item.filename for item in uploads])
+        for item in uploads:
+            path = await in_app(blobstore.staging_path)
+            try:
+                blob_hash, size = await _stage(item, path, budget)
+            except BaseException:
+                os.remove(path)
+                raise
+            staged.append((path, blob_hash, size, item.filename))
+            if budget is not None:
+                budget -= size
+    except QuotaExceeded:
+        for path, *_ in staged:
+            os.remove(path)
+        return quota_error()
+    except BaseException:
+        for path, *_ in staged:
+            os.remove(path)
+        raise
+    finally:
+        await form.close()
+
+    try:
+        count = await in_app(_save_uploads, user_id, folder_path, staged)
+    except QuotaExceeded:
+        return quota_error()
+    if wants_json:
+        return JSONResponse({'uploaded': count})
+    return RedirectResponse('/' + quote(folder_path), 302)
+
+
+app = Starlette(routes=[
+    Route('/download/{file_id:int}', download),
+    Route('/download_folder', download_folder),
+    Route('/upload', upload, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
@@ -0,0 +1,227 @@
+import os
+import hashlib
+import uuid
+from collections import Counter
+from flask import current_app
+from sqlalchemy import delete, insert, text, update
+from .init_db import sqlite, begin_write
+from .models import Blob
+from .storage import get_storage
+from . import compression
+
+# 内容寻址存储：文件内容按 sha256 以 ab/cd/<hash> 为 key 存放在存储后端
+# （默认 uploads/.blobs 下），用户看到的路径只是 File 行里的元数据，多个 File 可以引用同一个 blob。
+# 上传先写入本地暂存区，算出哈希后再放入存储后端；开启落盘压缩时新内容可能以 gzip 存放，
+# 读取内容一律经过 compression.open_blob / read_blob，按 Blob.codec 解码。
+HASH_BLOCK = 1024 * 1024
+IN_BATCH = 500  # IN (...) 每批参数个数，低于 SQLite 变量上限
+
+
+class QuotaExceeded(Exception):
+    """写入会超出用户空间配额"""
+
+
+def upload_root():
+    return current_app.config['UPLOAD_ROOT']
+
+def blob_key(blob_hash):
+    """blob 在存储后端中的 key，两级目录避免单目录文件过多"""
+    return f'{blob_hash[:2]}/{blob_hash[2:4]}/{blob_hash}'
+
+def staging_path(name=None):
+    """暂存区路径，本地存储时与 blob 同一文件系统，入库时只需改名"""
+    folder = os.path.join(upload_root(), '.partial')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name or uuid.uuid4().hex + '.tmp')
+
+def hash_file(path):
+    """计算文件的 sha256 和大小"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as fp:
+        while True:
+            block = fp.read(HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+def stage_stream(stream, limit=None):
+    """把上传流写入暂存区，同时计算哈希，返回 (暂存路径, hash, size)
+
+    指定 limit 时写入超过该字节数立即中断并删除暂存文件，抛出 QuotaExceeded。
+    """
+    path = staging_path()
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as fp:
+        while True:
+            block = stream.read(HASH_BLOCK)
+            if not block:
+                break
+            size += len(block)
+            if limit is not None and size > limit:
+                break
+            digest.update(block)
+            fp.write(block)
+    if limit is not None and size > limit:
+        os.remove(path)
+        raise QuotaExceeded(size)
+    return path, digest.hexdigest(), size
+
+def find_blob(blob_hash, size=None):
+    """已存在且内容完整的 blob，用于秒传判断"""
+    blob = sqlite.session.get(Blob, blob_hash)
+    if not blob or (size is not None and blob.size != size):
+        return None
+    if get_storage().stat(blob_key(blob_hash)) is None:
+        return None
+    return blob
+
+def blob_codec(blob_hash):
+    """blob 的存储编码，None 表示原样存放"""
+    blob = sqlite.session.get(Blob, blob_hash)
+    return blob.codec if blob else None
+
+def compress_staged(staged_items):
+    """对尚未入库的内容就地压缩暂存文件，返回 {暂存路径: 编码}
+
+    压缩大文件要花时间，应在拿写锁之前调用；已存在的内容入库时会被丢弃，不必压缩。
+    """
+    if not current_app.config.get('COMPRESS_AT_REST'):
+        return {}
+    hashes = list({h for _, h, _ in staged_items})
+    known = set()
+    for i in range(0, len(hashes), IN_BATCH):
+        known.update(h for h, in sqlite.session.query(Blob.hash).filter(Blob.hash.in_(hashes[i:i + IN_BATCH])))
+    encoded = {}
+    for path, h, size in staged_items:
+        if h in known:
+            continue
+        known.add(h)  # 同一批里重复的内容只有第一份会放入存储
+        if compression.should_compress(path, size):
+            compression.compress_file(path)
+            encoded[path] = compression.GZIP
+    return encoded
+
+def add_ref(blob_hash, count=1):
+    """引用计数加一，blob 不存在时返回 False（不提交）"""
+    result = sqlite.session.execute(
+        text("UPDATE blob SET refcount = refcount + :n WHERE hash = :h"),
+        {'n': count, 'h': blob_hash}
+    )
+    return result.rowcount > 0
+
+def ingest(staged, blob_hash, size, encoded=None):
+    """暂存文件入库并增加一次引用；内容已存在时直接丢弃暂存文件（不提交）
+
+    encoded 为事先调用 compress_staged() 的结果，省略时在这里判断是否压缩。
+    """
+    if encoded is None:
+        encoded = compress_staged([(staged, blob_hash, size)])
+    codec = encoded.get(staged)
+    storage = get_storage()
+    key = blob_key(blob_hash)
+    if add_ref(blob_hash):
+        if storage.stat(key) is not None:
+            os.remove(staged)
+        else:
+            # 元数据还在但内容丢了，用这次上传的内容补上
+            storage.put(key, staged)
+            sqlite.session.execute(update(Blob).where(Blob.hash == blob_hash).values(codec=codec))
+        return blob_hash
+    storage.put(key, staged)
+    sqlite.session.add(Blob(hash=blob_hash, size=size, refcount=1, codec=codec))
+    sqlite.session.flush()
+    return blob_hash
+
+def ingest_many(staged_items, encoded=None):
+    """批量入库 [(暂存路径, hash, size)]，每项增加一次引用（不提交）
+
+    先对全部哈希执行一次批量 UPDATE 拿到写锁，再一次查出哪些 blob 已存在，
+    期间不会有并发的 release 把它们回收掉。encoded 同 ingest()。
+    """
+    counts = Counter(h for _, h, _ in staged_items)
+    if not counts:
+        return
+    if encoded is None:
+        encoded = compress_staged(staged_items)
+    sqlite.session.execute(
+        text("UPDATE blob SET refcount = refcount + :n WHERE hash = :h"),
+        [{'n': n, 'h': h} for h, n in counts.items()]
+    )
+    hashes = list(counts)
+    known = set()
+    for i in range(0, len(hashes), IN_BATCH):
+        known.update(h for h, in sqlite.session.query(Blob.hash).filter(Blob.hash.in_(hashes[i:i + IN_BATCH])))
+
+    storage = get_storage()
+    created = {}
+    repaired = {}
+    for staged, h, size in staged_items:
+        if h in created or h in repaired or (h in known and storage.stat(blob_key(h)) is not None):
+            os.remove(staged)
+            continue
+        storage.put(blob_key(h), staged)
+        if h in known:
+            repaired[h] = encoded.get(staged)
+        else:
+            created[h] = (size, encoded.get(staged))
+    if created:
+        sqlite.session.execute(insert(Blob), [{'hash': h, 'size': size, 'refcount': counts[h], 'codec': codec}
+                                              for h, (size, codec) in created.items()])
+    for h, codec in repaired.items():
+        sqlite.session.execute(update(Blob).where(Blob.hash == h).values(codec=codec))
+
+def ingest_stream(stream, limit=None):
+    """上传流直接入库，返回 (hash, size)（不提交）"""
+    staged, blob_hash, size = stage_stream(stream, limit)
+    ingest(staged, blob_hash, size)
+    return blob_hash, size
+
+def release(blob_hashes, purge=True):
+    """减少引用并回收无人引用的 blob，返回被回收的哈希（不提交）
+
+    删除 blob 行和删除存储中的内容都在当前写事务内完成：并发的 ingest 必须等本事务
+    提交后才能拿到写锁，届时会发现 blob 行已不存在并重新放入文件。
+    purge=False 时只删除 blob 行，内容留给之后的 purge() 分批删除。
+    """
+    counts = Counter(h for h in blob_hashes if h)
+    if not counts:
+        return []
+    sqlite.session.execute(
+        text("UPDATE blob SET refcount = refcount - :n WHERE hash = :h"),
+        [{'n': n, 'h': h} for h, n in counts.items()]
+    )
+    gone = []
+    hashes = list(counts)
+    for i in range(0, len(hashes), IN_BATCH):
+        batch = [h for h, in sqlite.session.query(Blob.hash)
+                 .filter(Blob.hash.in_(hashes[i:i + IN_BATCH]), Blob.refcount <= 0)]
+        if batch:
+            sqlite.session.execute(delete(Blob).where(Blob.hash.in_(batch)))
+            gone += batch
+    if purge:
+        for h in gone:
+            get_storage().delete(blob_key(h))
+    return gone
+
+def purge(blob_hashes):
+    """删除已经没有 blob 行的内容，返回删除的个数（不提交）
+
+    先确认 blob 行仍不存在：并发上传可能已经重新登记了同一内容。检查和删除都在
+    写事务内进行，期间不会有新的 ingest。
+    """
+    begin_write()
+    hashes = list(set(blob_hashes))
+    alive = set()
+    for i in range(0, len(hashes), IN_BATCH):
+        alive.update(h for h, in sqlite.session.query(Blob.hash).filter(Blob.hash.in_(hashes[i:i + IN_BATCH])))
+    storage = get_storage()
+    removed = 0
+    for h in hashes:
+        if h not in alive:
+            storage.delete(blob_key(h))
+            removed += 1
+    return removed
@@ -0,0 +1,130 @@
+import os
+import gzip
+import zlib
+from flask import current_app
+from werkzeug.http import parse_accept_header
+from .storage import READ_BLOCK
+
+# 落盘压缩（COMPRESS_AT_REST，默认关闭）：新内容入库前先判断是否值得压缩——
+# 文件头是常见压缩格式（zip、图片、音视频等）的直接跳过，否则从头、中、尾各取一段
+# 用同样的级别试压，压缩率够高才整体压成 gzip 再放入存储，Blob.codec 记下编码方式。
+# Blob.size 和 File.size 始终是原始大小，配额、列表和 Range 都按原始内容计算。
+# 用 gzip 而不是其他编码，是为了客户端支持时可以原样发送（Content-Encoding: gzip）。
+GZIP = 'gzip'
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+SAMPLE_SIZE = 64 * 1024
+COMPRESSED_MAGIC = (
+    b'\x1f\x8b', b'PK\x03\x04', b'7z\xbc\xaf\x27\x1c', b'Rar!', b'\xfd7zXZ', b'BZh', b'\x28\xb5\x2f\xfd',
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'OggS', b'fLaC', b'ID3', b'\x1a\x45\xdf\xa3',
+)
+
+
+def _sample(fp, size):
+    """头、中、尾三段，小文件直接取全部"""
+    if size <= SAMPLE_SIZE * 3:
+        return [fp.read()]
+    blocks = []
+    for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+        fp.seek(offset)
+        blocks.append(fp.read(SAMPLE_SIZE))
+    return blocks
+
+def should_compress(path, size):
+    """按文件头和采样压缩率判断暂存文件是否值得压缩"""
+    config = current_app.config
+    if size < config.get('COMPRESS_MIN_SIZE', 4096):
+        return False
+    with open(path, 'rb') as fp:
+        head = fp.read(16)
+        if head.startswith(COMPRESSED_MAGIC) or head[4:8] == b'ftyp':  # mp4/mov/heic
+            return False
+        fp.seek(0)
+        blocks = _sample(fp, size)
+    level = config.get('COMPRESS_LEVEL', 1)
+    raw = sum(len(b) for b in blocks)
+    packed = sum(len(zlib.compress(b, level)) for b in blocks)
+    return packed <= raw * config.get('COMPRESS_MAX_RATIO', 0.8)
+
+def compress_file(path):
+    """把文件就地压成 gzip，返回压缩后的大小"""
+    level = current_app.config.get('COMPRESS_LEVEL', 1)
+    packer = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    temp = path + '.gz'
+    try:
+        with open(path, 'rb') as src, open(temp, 'wb') as dst:
+            while True:
+                block = src.read(READ_BLOCK * 4)
+                if not block:
+                    break
+                dst.write(packer.compress(block))
+            dst.write(packer.flush())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return os.path.getsize(path)
+
+def accepts_gzip(environ):
+    """客户端能否直接接收 gzip 编码的响应"""
+    return parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))['gzip'] > 0
+
+
+# ------------------ 读取 ------------------
+class _GzipBlob(gzip.GzipFile):
+    """关闭时连同存储后端的文件对象一起关闭（GzipFile 不会关闭传入的 fileobj）"""
+
+    def __init__(self, fp):
+        super().__init__(fileobj=fp, mode='rb')
+        self._raw = fp
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._raw.close()
+
+def open_blob(storage, key, codec):
+    """以只读文件对象打开解码后的内容，只能顺序读取"""
+    fp = storage.open(key)
+    return _GzipBlob(fp) if codec == GZIP else fp
+
+
+class BlobReader:
+    """按原始内容的偏移读取区间；压缩内容要从头解压，区间递增时（如应用补丁）接着上次的位置读"""
+
+    def __init__(self, storage, key, codec):
+        self.storage = storage
+        self.key = key
+        self.codec = codec
+        self._fp = None
+
+    def read(self, start=0, end=None):
+        if not self.codec:
+            yield from self.storage.read(self.key, start, end)
+            return
+        if self._fp is None or start < self._fp.tell():
+            self.close()
+            self._fp = open_blob(self.storage, self.key, self.codec)
+        self._fp.seek(start)  # 向后跳只是解压后丢弃
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            block = self._fp.read(READ_BLOCK if remaining is None else min(READ_BLOCK, remaining))
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+def read_blob(storage, key, codec, start=0, end=None):
+    """按块读取原始内容 [start, end) 区间的生成器"""
+    reader = BlobReader(storage, key, codec)
+    try:
+        yield from reader.read(start, end)
+    finally:
+        reader.close()
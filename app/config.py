@@ -7,3 +7,85 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'SQLite.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB
+    # SQLite：每个连接建立时设置的 PRAGMA；读连接池大小；等待写连接的超时（秒）
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',        # WAL 下 NORMAL 不会损坏数据库，只可能丢最后几个事务
+        'cache_size': -16000,           # 负数单位为 KB，即每个连接 16MB 页缓存
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 30000,          # 毫秒，多进程争抢写锁时等待而不是立即报 database is locked
+        'temp_store': 'MEMORY',
+    }
+    SQLITE_READ_POOL = 8
+    SQLITE_WRITE_TIMEOUT = 30
+    MAX_FORM_PARTS = 20000  # 一次表单最多的字段/文件数，文件夹上传可能包含上万个文件
+    BATCH_MAX_ITEMS = 10000  # 批量操作（多选删除/移动/重命名/下载）一次最多的条目数
+    # 所有上传内容的根目录（.blobs 存文件内容，.partial 为上传暂存区）
+    UPLOAD_ROOT = os.path.normpath(os.path.join(BASE_DIR, '..', 'uploads'))
+    # 文件内容的存储后端：'local' 存在 UPLOAD_ROOT/.blobs；'s3' 存到 S3 兼容存储（需要 boto3）
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', 'blobs/')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # MinIO 等自建服务的地址，AWS 留空
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')      # 留空时使用 boto3 默认的凭证链
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
+    S3_MULTIPART_CHUNK = 64 * 1024 * 1024
+    S3_PRESIGN_TTL = 300            # 预签名下载地址有效期（秒）
+    S3_REDIRECT_DOWNLOADS = True    # 下载直接重定向到预签名地址，不经过应用转发
+    # 下载交给前端代理发送：None 由应用自己发送；'x-accel' 用于 nginx，需要配置
+    #     location /_blobs/ { internal; alias /path/to/uploads/.blobs/; }
+    # 'x-sendfile' 用于 Apache mod_xsendfile / lighttpd。仅对本地存储生效。
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD') or None
+    DOWNLOAD_OFFLOAD_PREFIX = '/_blobs/'
+    # 分片上传：单片默认 8MB，上限 64MB；未完成的会话保留 24 小时
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+    UPLOAD_CHUNK_MAX = 64 * 1024 * 1024
+    UPLOAD_SESSION_TTL = 24 * 3600
+    # 用量计数定期与磁盘对账的间隔（秒），0 表示关闭
+    USAGE_RECONCILE_INTERVAL = 6 * 3600
+    # 落盘压缩（默认关闭）：新上传的内容不是已压缩格式、且采样压缩率不高于 COMPRESS_MAX_RATIO 时
+    # 以 gzip 存放，下载时按客户端是否接受 gzip 原样发送或边解压边发送；已有内容不受影响
+    COMPRESS_AT_REST = os.environ.get('COMPRESS_AT_REST', '') in ('1', 'true')
+    COMPRESS_LEVEL = 1              # zlib 压缩级别，1 最快
+    COMPRESS_MIN_SIZE = 4096        # 小于该字节数的文件不压缩
+    COMPRESS_MAX_RATIO = 0.8        # 采样压缩后与原始大小之比的上限
+    # 增量同步：签名的默认块大小和允许范围；块签名缓存目录的大小上限
+    SYNC_BLOCK_SIZE = 64 * 1024
+    SYNC_BLOCK_MIN = 1024
+    SYNC_BLOCK_MAX = 1024 * 1024
+    SYNC_SIGNATURE_CACHE_MAX = 256 * 1024 * 1024
+    # 变更日志（同步客户端按游标增量拉取）：保留时间，超过后游标失效需要重新全量同步；
+    # 长轮询最长等待时间，以及发现其他进程写入的查询间隔（秒）
+    CHANGES_RETENTION = 30 * 24 * 3600
+    CHANGES_PAGE_SIZE = 500
+    CHANGES_PAGE_MAX = 5000
+    CHANGES_WAIT_MAX = 60
+    CHANGES_POLL_INTERVAL = 1
+    # 后台任务：同时运行的任务数（所有进程合计），0 表示在请求里同步执行
+    JOB_WORKERS = 2
+    JOB_POLL_INTERVAL = 2           # 调度线程轮询队列的间隔（秒），本进程提交的任务会立即唤醒
+    JOB_STALE_AFTER = 600           # 运行中的任务超过该秒数没有进度和心跳，视为执行进程已退出，重新排队
+    JOB_RESULT_TTL = 24 * 3600      # 结束的任务及打包结果保留时间（秒）
+    JOB_PURGE_BATCH = 500           # 删除任务每批清理的 blob 数
+    JOB_PROGRESS_BYTES = 64 * 1024 * 1024  # 打包任务每输出这么多字节更新一次进度
+    ZIP_JOB_MIN_SIZE = 512 * 1024 * 1024  # 超过该大小的文件夹下载改为后台打包
+    # 缩略图：图片需要安装 Pillow，PDF 需要 pdftoppm（poppler-utils），视频需要 ffmpeg
+    THUMB_SIZES = (128, 512)        # 可请求的边长档位（像素）
+    THUMB_WORKERS = 2               # 生成缩略图的进程数，0 表示在请求里直接生成
+    THUMB_TIMEOUT = 30              # 单张缩略图的生成时限（秒）
+    THUMB_CACHE_MAX = 512 * 1024 * 1024  # 缩略图缓存目录的大小上限
+    THUMB_MAX_AGE = 365 * 24 * 3600      # 浏览器缓存时间，地址里带内容哈希，内容变了地址也会变
+    # 运行指标：/metrics 为 Prometheus 格式；配置令牌后用 Authorization: Bearer <令牌> 抓取，
+    # 未配置时只有登录的管理员能访问
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    METRICS_INVENTORY_TTL = 30      # 文件数、用户数等库存数据的缓存时间（秒）
+    # 请求级性能分析（默认关闭）：Server-Timing 响应头、每请求一行日志，
+    # 超过 PROFILE_SLOW_MS 的请求把采样调用栈和 SQL 明细写到 PROFILE_DIR
+    PROFILE_ENABLED = os.environ.get('PROFILE', '') in ('1', 'true')
+    PROFILE_SLOW_MS = 500
+    PROFILE_SAMPLE_INTERVAL = 0.005  # 采样间隔（秒），0 表示不采样
+    PROFILE_REPEAT_WARN = 20         # 同一条 SQL 在一个请求里执行超过该次数时告警
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(BASE_DIR), 'profiles'))
+    # 每个用户默认的空间配额，None 表示不限制；可在后台为单个用户单独设置
+    DEFAULT_USER_QUOTA = 10 * 1024 * 1024 * 1024  # 10GB
@@ -0,0 +1,207 @@
+import os
+import zlib
+import struct
+import hashlib
+from flask import current_app
+from .diskcache import DiskCache
+from .storage import READ_BLOCK, get_storage
+from . import blobstore, compression
+
+# rsync 式增量同步：
+#   签名：把服务器上的版本按 block_size 切块，每块给出弱校验（Adler-32，可滚动计算）
+#         和强校验（blake2b 前 16 字节）。内容寻址，签名按 哈希 + 块大小 缓存在磁盘上。
+#   补丁：客户端在新文件上滚动匹配签名，得到“复制第 i 块起的 n 块”和“新数据”组成的指令流：
+#         b'C' + >II(起始块号, 块数)     从旧版本复制
+#         b'D' + >I(长度) + 数据          新数据
+#   服务器按指令从旧版本和请求体拼出新版本，写入暂存区并校验哈希，再像普通上传一样入库替换。
+STRONG_SIZE = 16
+SIG_RECORD = struct.Struct('>I16s')
+OP_COPY = b'C'
+OP_DATA = b'D'
+COPY = struct.Struct('>II')
+DATA = struct.Struct('>I')
+ADLER_MOD = 65521
+
+
+class PatchError(Exception):
+    """补丁格式错误或与旧版本不符"""
+
+
+def strong_hash(block):
+    return hashlib.blake2b(block, digest_size=STRONG_SIZE).digest()
+
+def block_size_for(requested):
+    config = current_app.config
+    size = requested or config.get('SYNC_BLOCK_SIZE', 64 * 1024)
+    return max(config.get('SYNC_BLOCK_MIN', 1024), min(size, config.get('SYNC_BLOCK_MAX', 1024 * 1024)))
+
+
+# ------------------ 签名 ------------------
+def get_cache():
+    cache = current_app.extensions.get('signature_cache')
+    if cache is None:
+        root = os.path.join(current_app.config['UPLOAD_ROOT'], '.signatures')
+        cache = current_app.extensions['signature_cache'] = \
+            DiskCache(root, current_app.config.get('SYNC_SIGNATURE_CACHE_MAX', 256 * 1024 * 1024))
+    return cache
+
+def _compute(blob_hash, block_size, out):
+    storage = get_storage()
+    with compression.open_blob(storage, blobstore.blob_key(blob_hash), blobstore.blob_codec(blob_hash)) as fp:
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            out.write(SIG_RECORD.pack(zlib.adler32(block), strong_hash(block)))
+
+def signature(blob_hash, block_size):
+    """[(弱校验, 强校验)]，第一次计算后缓存"""
+    cache = get_cache()
+    key = f'{blob_hash}_{block_size}.sig'
+    path = cache.get(key)
+    if path is None:
+        temp = cache.temp_path(key)
+        try:
+            with open(temp, 'wb') as out:
+                _compute(blob_hash, block_size, out)
+            path = cache.put(key, temp)
+        finally:
+            if os.path.exists(temp):
+                os.remove(temp)
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    return [SIG_RECORD.unpack_from(data, i) for i in range(0, len(data), SIG_RECORD.size)]
+
+
+# ------------------ 应用补丁 ------------------
+def _read_exact(stream, n):
+    data = b''
+    while len(data) < n:
+        block = stream.read(n - len(data))
+        if not block:
+            raise PatchError('补丁数据不完整')
+        data += block
+    return data
+
+def apply_patch(stream, base_hash, base_size, block_size, target_size):
+    """按指令流拼出新版本，返回 (暂存路径, hash, size, 复制字节数, 新数据字节数)"""
+    # 复制指令基本按块号递增，旧版本压缩存放时 BlobReader 接着上次的位置解压，不必每次从头开始
+    base = compression.BlobReader(get_storage(), blobstore.blob_key(base_hash), blobstore.blob_codec(base_hash))
+    blocks = (base_size + block_size - 1) // block_size
+    digest = hashlib.sha256()
+    written = copied = literal = 0
+    staged = blobstore.staging_path()
+    try:
+        with open(staged, 'wb') as out:
+            def emit(chunk):
+                nonlocal written
+                written += len(chunk)
+                if written > target_size:
+                    raise PatchError('结果超出声明的大小')
+                digest.update(chunk)
+                out.write(chunk)
+
+            while True:
+                op = stream.read(1)
+                if not op:
+                    break
+                if op == OP_COPY:
+                    first, count = COPY.unpack(_read_exact(stream, COPY.size))
+                    if count == 0 or first + count > blocks:
+                        raise PatchError('块号超出旧版本范围')
+                    start, end = first * block_size, min((first + count) * block_size, base_size)
+                    for chunk in base.read(start, end):
+                        emit(chunk)
+                    copied += end - start
+                elif op == OP_DATA:
+                    (length,) = DATA.unpack(_read_exact(stream, DATA.size))
+                    remaining = length
+                    while remaining:
+                        chunk = stream.read(min(READ_BLOCK, remaining))
+                        if not chunk:
+                            raise PatchError('补丁数据不完整')
+                        emit(chunk)
+                        remaining -= len(chunk)
+                    literal += length
+                else:
+                    raise PatchError('未知的补丁指令')
+        if written != target_size:
+            raise PatchError('结果与声明的大小不符')
+    except BaseException:
+        os.remove(staged)
+        raise
+    finally:
+        base.close()
+    return staged, digest.hexdigest(), written, copied, literal
+
+
+# ------------------ 客户端参考实现 ------------------
+def make_patch(sig, block_size, fp):
+    """按签名计算 fp 相对旧版本的补丁，逐段产出指令字节；纯 Python 滚动校验，适合工具和测试"""
+    table = {}
+    for index, (weak, strong) in enumerate(sig):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    data = fp.read()
+    pending = bytearray()
+    run = None  # 正在合并的连续复制 [起始块, 块数]
+
+    def flush_data():
+        if pending:
+            out = OP_DATA + DATA.pack(len(pending)) + bytes(pending)
+            pending.clear()
+            return out
+        return b''
+
+    def flush_run():
+        nonlocal run
+        if run:
+            out = OP_COPY + COPY.pack(*run)
+            run = None
+            return out
+        return b''
+
+    pos, n = 0, len(data)
+    a = b = None
+    while pos < n:
+        length = min(block_size, n - pos)
+        if length < block_size and a is not None:
+            # 剩余不足一块：只可能匹配旧版本较短的最后一块，试一次，不再逐字节滚动
+            a = None
+        if a is None:
+            weak = zlib.adler32(data[pos:pos + length])
+            a, b = weak & 0xffff, weak >> 16
+        match = table.get((b << 16) | a)
+        index = match.get(strong_hash(data[pos:pos + length])) if match else None
+        if index is None and length < block_size:
+            pending.extend(data[pos:])
+            break
+        if index is not None:
+            out = flush_data()
+            if run and run[0] + run[1] == index:
+                run[1] += 1
+            else:
+                out += flush_run()
+                run = [index, 1]
+            if out:
+                yield out
+            pos += length
+            a = None
+            continue
+        # 不匹配：当前字节作为新数据，窗口向后滚动一个字节
+        out = flush_run()
+        if out:
+            yield out
+        x_out = data[pos]
+        pending.append(x_out)
+        if pos + length < n:
+            x_in = data[pos + length]
+            a = (a - x_out + x_in) % ADLER_MOD
+            b = (b + a - 1 - length * x_out) % ADLER_MOD
+        else:
+            a = None
+        pos += 1
+        if len(pending) >= READ_BLOCK:
+            yield flush_data()
+    tail = flush_run() + flush_data()
+    if tail:
+        yield tail
@@ -0,0 +1,90 @@
+import os
+import time
+import uuid
+import threading
+
+# 有大小上限的磁盘缓存，存放可以随时重新生成的派生数据（缩略图、增量同步的块签名等）。
+# key 即文件名，按前两个字符分子目录。
+
+
+class DiskCache:
+    """按文件修改时间近似 LRU 的磁盘缓存：命中时刷新修改时间，超出上限时删除最久未用的文件
+
+    多个进程共用同一个目录；各进程只按自己写入的量估算总大小，
+    估算超限时重新扫描目录得到准确大小再淘汰。
+    """
+
+    TOUCH_INTERVAL = 60  # 刷新修改时间的最小间隔（秒），避免每次命中都写磁盘
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.used = None
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        now = time.time()
+        if now - st.st_mtime > self.TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                return None  # 刚好被其他进程淘汰
+        return path
+
+    def temp_path(self, key, suffix='.tmp'):
+        """写入用的临时文件，以 '.' 开头，不会被当作缓存内容"""
+        folder = os.path.join(self.root, key[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f'.{uuid.uuid4().hex}{suffix}')
+
+    def put(self, key, temp):
+        """把生成好的临时文件放入缓存，返回缓存路径"""
+        path = self.path(key)
+        size = os.path.getsize(temp)
+        os.replace(temp, path)
+        with self.lock:
+            if self.used is None:
+                self.used = self._scan()[1]
+            else:
+                self.used += size
+            if self.used > self.max_bytes:
+                self._evict()
+        return path
+
+    def _scan(self):
+        entries, total = [], 0
+        for folder in os.scandir(self.root) if os.path.isdir(self.root) else ():
+            if not folder.is_dir():
+                continue
+            for item in os.scandir(folder.path):
+                if item.name.startswith('.'):
+                    continue  # 其他请求正在写入的临时文件
+                try:
+                    st = item.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, item.path))
+                total += st.st_size
+        return entries, total
+
+    def _evict(self):
+        """删除最久未用的文件，直到降到上限的 90%，给后续写入留出余量"""
+        entries, total = self._scan()
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.used = total
@@ -1,3 +1,90 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.elements import TextClause
 
-sqlite = SQLAlchemy()
+# SQLite 连接分两组：
+#   默认引擎是唯一的写连接（连接池大小 1），写事务一律 BEGIN IMMEDIATE，
+#   进程内的写操作在连接池上排队，多进程之间靠 busy_timeout 等待写锁；
+#   'read' 引擎是只读连接池，WAL 模式下读不阻塞写，可以随 worker 数扩展。
+# 会话在第一次写入（flush 或执行 INSERT/UPDATE/DELETE 等语句）时切换到写连接，
+# 之后直到提交/回滚都留在写连接上，保证能读到本事务自己的修改。
+READ_BIND = 'read'
+
+
+def is_write(clause):
+    """语句是否需要写连接"""
+    if clause is None:
+        return False
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip().split(None, 1)[0].upper() not in ('SELECT', 'WITH', 'PRAGMA')
+    return bool(getattr(clause, 'is_dml', False) or getattr(clause, 'is_ddl', False))
+
+
+class RoutingSession(Session):
+    """只读查询走读连接池，写事务走唯一的写连接"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and READ_BIND in self._db.engines:
+            if self._flushing or is_write(clause):
+                self.info['writing'] = True
+            if not self.info.get('writing'):
+                return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+sqlite = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@event.listens_for(sqlite.session, 'after_commit')
+@event.listens_for(sqlite.session, 'after_rollback')
+def _leave_writer(session):
+    session.info.pop('writing', None)
+
+
+def begin_write():
+    """之后的语句都走写连接：读和写都在同一个 BEGIN IMMEDIATE 事务里，期间没有其他写入者
+
+    切换前在读连接上加载的对象来自旧快照，全部过期，之后访问时从写连接重新读取。
+    """
+    session = sqlite.session
+    if session.info.get('writing'):
+        return
+    session.info['writing'] = True
+    session.flush()  # 未写入的修改先落到写连接上，过期时不会丢失
+    session.expire_all()
+
+
+def configure_engines(app):
+    """在 init_app 之前调用：配置写连接和只读连接池"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if not uri.startswith('sqlite:///') or ':memory:' in uri:
+        return
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+        pool_size=1, max_overflow=0, pool_timeout=app.config.get('SQLITE_WRITE_TIMEOUT', 30))
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[READ_BIND] = {'url': uri, 'pool_size': app.config.get('SQLITE_READ_POOL', 8), 'max_overflow': 0}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+def install_pragmas(app):
+    """在 init_app 之后、第一次连接之前调用：每个新连接都设置 PRAGMA"""
+    if READ_BIND not in sqlite.engines:
+        return
+    pragmas = app.config.get('SQLITE_PRAGMAS', {})
+
+    def on_connect(dbapi_conn, record, readonly):
+        # 关掉 pysqlite 自带的隐式事务，事务边界交给下面的 begin 事件
+        dbapi_conn.isolation_level = None
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        if readonly:
+            cursor.execute('PRAGMA query_only=1')
+        cursor.close()
+
+    writer, reader = sqlite.engines[None], sqlite.engines[READ_BIND]
+    event.listen(writer, 'connect', lambda c, r: on_connect(c, r, False))
+    event.listen(reader, 'connect', lambda c, r: on_connect(c, r, True))
+    # 写事务一开始就拿写锁，避免读后升级写时遇到 SQLITE_BUSY 无法等待
+    event.listen(writer, 'begin', lambda conn: conn.exec_driver_sql('BEGIN IMMEDIATE'))
@@ -0,0 +1,337 @@
+import os
+import json
+import uuid
+import logging
+import threading
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from sqlalchemy import func
+from .init_db import sqlite, begin_write
+from .models import Job, User
+from .storage import get_storage
+from .utils import stream_zip
+from . import blobstore, journal, vfs
+
+# 后台任务：删除大目录、移动文件夹、打包下载等耗时操作写入 job 表排队，
+# 每个 Web 进程里有一个调度线程，把任务交给进程池执行，请求本身立即返回。
+# 同时运行的任务数按 JOB_WORKERS 全局限制（多进程部署时共享同一张表）。
+# JOB_WORKERS = 0 时不启用进程池，任务在提交它的请求里同步执行，便于开发调试。
+log = logging.getLogger(__name__)
+
+HANDLERS = {}
+_wake = threading.Event()
+_worker_app = None  # 进程池子进程里的 Flask 应用
+
+
+class JobFailed(Exception):
+    """任务无法完成，消息直接展示给用户"""
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+# ------------------ 提交与查询 ------------------
+def enqueue(user_id, kind, **params):
+    """登记任务并提交，返回任务 ID"""
+    job = Job(id=uuid.uuid4().hex, user_id=user_id, kind=kind, params=json.dumps(params))
+    sqlite.session.add(job)
+    sqlite.session.commit()
+    if not current_app.config.get('JOB_WORKERS'):
+        run_job(job.id)
+    else:
+        _wake.set()
+    return job.id
+
+def zip_job_for(user_id, folder_path, folder=None):
+    """文件夹（folder_path 为空时是整个用户目录）超过 ZIP_JOB_MIN_SIZE 时登记后台打包任务并返回任务 ID，
+    否则返回 None，由请求直接流式打包；WSGI 和 ASGI 的下载路由共用这一判断
+    """
+    size = folder.size if folder_path else sqlite.session.get(User, user_id).used_bytes
+    if (size or 0) <= current_app.config.get('ZIP_JOB_MIN_SIZE', float('inf')):
+        return None
+    return enqueue(user_id, 'zip', path=folder_path)
+
+def describe(job):
+    result = json.loads(job.result) if job.result else None
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'done': job.done,
+        'total': job.total,
+        'message': job.message,
+        'result': result,
+        'created_at': job.created_at.isoformat(timespec='seconds') + 'Z' if job.created_at else None,
+        'finished_at': job.finished_at.isoformat(timespec='seconds') + 'Z' if job.finished_at else None,
+    }
+
+
+# ------------------ 执行 ------------------
+def _progress(job_id):
+    """返回进度回调：更新进度并提交当前事务，处理函数只在数据一致的位置调用它"""
+    def report(done, total=None):
+        values = {'done': done, 'updated_at': datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        Job.query.filter_by(id=job_id).update(values)
+        sqlite.session.commit()
+    return report
+
+def _execute(job_id):
+    job = sqlite.session.get(Job, job_id)
+    if job is None:
+        return
+    if job.status != 'running':  # 同步执行时没有经过调度线程认领
+        job.status = 'running'
+        job.updated_at = datetime.utcnow()
+        sqlite.session.commit()
+    user_id, kind, params = job.user_id, job.kind, json.loads(job.params)
+    try:
+        result = HANDLERS[kind](job_id, user_id, params, _progress(job_id))
+    except Exception as e:
+        sqlite.session.rollback()
+        if not isinstance(e, JobFailed):
+            log.exception('任务 %s (%s) 执行失败', job_id, kind)
+        values = {'status': 'failed', 'message': str(e)[:255] or e.__class__.__name__}
+    else:
+        values = {'status': 'done', 'result': json.dumps(result) if result is not None else None}
+    values.update(updated_at=datetime.utcnow(), finished_at=datetime.utcnow())
+    Job.query.filter_by(id=job_id).update(values)
+    sqlite.session.commit()
+
+def run_job(job_id):
+    """执行一个任务：进程池子进程里使用自己的应用，同步模式下使用当前应用"""
+    app = _worker_app or current_app._get_current_object()
+    with app.app_context():
+        _execute(job_id)
+
+def _init_worker(config):
+    global _worker_app
+    from . import create_app
+    _worker_app = create_app(config, background=False)
+
+
+# ------------------ 调度 ------------------
+def claim(limit):
+    """认领最早的排队任务，全局运行数已达上限或没有任务时返回 None"""
+    begin_write()  # 计数和认领在同一个写事务里，多个进程不会抢到同一个任务
+    try:
+        running = Job.query.filter_by(status='running').count()
+        job = Job.query.filter_by(status='queued').order_by(Job.created_at).first() if running < limit else None
+        if job:
+            job.status = 'running'
+            job.updated_at = datetime.utcnow()
+        sqlite.session.commit()
+        return job.id if job else None
+    except Exception:
+        sqlite.session.rollback()
+        raise
+
+def heartbeat(job_ids):
+    """刷新本进程正在执行的任务的 updated_at：执行进程还活着，长时间没有进度的任务也不会被重新排队"""
+    if not job_ids:
+        return
+    Job.query.filter(Job.id.in_(job_ids), Job.status == 'running') \
+        .update({'updated_at': datetime.utcnow()}, synchronize_session=False)
+    sqlite.session.commit()
+
+def requeue_stale(stale_after):
+    """执行进程意外退出的任务（调度线程不再发心跳）长时间没有更新，放回队列重新执行"""
+    deadline = datetime.utcnow() - timedelta(seconds=stale_after)
+    count = Job.query.filter(Job.status == 'running', Job.updated_at < deadline) \
+        .update({'status': 'queued'}, synchronize_session=False)
+    sqlite.session.commit()
+    if count:
+        log.warning('%d 个任务超时未更新，已重新排队', count)
+
+def purge_expired(ttl):
+    """删除早已结束的任务及其产物"""
+    deadline = datetime.utcnow() - timedelta(seconds=ttl)
+    storage = get_storage()
+    expired = Job.query.filter(Job.status.in_(('done', 'failed')), Job.finished_at < deadline).all()
+    for job in expired:
+        result = json.loads(job.result) if job.result else {}
+        if result.get('key'):
+            storage.delete(result['key'])
+        sqlite.session.delete(job)
+    sqlite.session.commit()
+
+def worker_config(app):
+    """传给子进程的配置，只保留可以直接序列化的简单值"""
+    simple = (str, int, float, bool, type(None), dict, list, tuple)
+    return {k: v for k, v in app.config.items() if k.isupper() and isinstance(v, simple)}
+
+def fail_lost(job_ids):
+    """执行进程意外退出（进程池损坏）时正在运行的任务标记为失败，不再重试，避免反复拖垮进程池"""
+    now = datetime.utcnow()
+    Job.query.filter(Job.id.in_(job_ids), Job.status == 'running') \
+        .update({'status': 'failed', 'message': '执行进程意外退出', 'updated_at': now, 'finished_at': now},
+                synchronize_session=False)
+    sqlite.session.commit()
+    log.warning('进程池损坏，%d 个任务标记为失败', len(job_ids))
+
+def start_dispatcher(app):
+    """启动本进程的调度线程，JOB_WORKERS 为 0 时不启动"""
+    workers = app.config.get('JOB_WORKERS', 0)
+    if not workers:
+        return None
+    interval = app.config.get('JOB_POLL_INTERVAL', 2)
+    stale_after = app.config.get('JOB_STALE_AFTER', 600)
+    # 心跳间隔远小于超时时间，调度线程活着时它认领的任务不会被其他进程当作超时
+    beat_every = max(1, int(stale_after / 4 / interval))
+
+    def new_pool():
+        # spawn 启动子进程，避免 fork 带走当前进程的线程和数据库连接
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(worker_config(app),))
+
+    def loop():
+        pool = new_pool()
+        running = {}  # future -> 任务 ID
+        ticks = 0
+        while True:
+            _wake.wait(interval)
+            _wake.clear()
+            # 子进程被杀（如 OOM）后进程池不再可用，其中的任务都以 BrokenProcessPool 结束
+            lost = [job_id for f, job_id in running.items()
+                    if f.done() and isinstance(f.exception(), BrokenProcessPool)]
+            running = {f: job_id for f, job_id in running.items() if not f.done()}
+            broken = bool(lost)
+            try:
+                with app.app_context():
+                    if lost:
+                        fail_lost(lost)
+                    if ticks % beat_every == 0:
+                        heartbeat(list(running.values()))
+                    if ticks % 30 == 0:
+                        requeue_stale(stale_after)
+                        purge_expired(app.config.get('JOB_RESULT_TTL', 24 * 3600))
+                        journal.prune(app.config.get('CHANGES_RETENTION', 30 * 24 * 3600))
+                        sqlite.session.commit()
+                    while not broken and len(running) < workers:
+                        job_id = claim(workers)
+                        if not job_id:
+                            break
+                        try:
+                            future = pool.submit(run_job, job_id)
+                        except BrokenProcessPool:
+                            # 还没有执行，放回队列，换新进程池后重新认领
+                            Job.query.filter_by(id=job_id).update({'status': 'queued'})
+                            sqlite.session.commit()
+                            broken = True
+                            break
+                        future.add_done_callback(lambda f: _wake.set())
+                        running[future] = job_id
+            except Exception:
+                log.exception('任务调度失败')
+            if broken:
+                # 损坏的进程池里剩下的任务也会以 BrokenProcessPool 结束，下一轮标记失败
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = new_pool()
+                _wake.set()
+            ticks += 1
+
+    thread = threading.Thread(target=loop, name='job-dispatcher', daemon=True)
+    thread.start()
+    return thread
+
+
+# ------------------ 任务处理函数 ------------------
+# 签名为 (任务 ID, 用户 ID, 参数, 进度回调)，返回值作为任务结果保存
+
+@handler('delete')
+def run_delete(job_id, user_id, params, progress):
+    """先在一个事务里删除整棵子树的元数据，再分批删除不再被引用的 blob 内容"""
+    path = params['path']
+    if path and not vfs.get_entry(user_id, path):
+        raise JobFailed('文件/文件夹不存在')
+    gone = vfs.delete_path(user_id, path, purge=False)
+    progress(0, len(gone))
+    batch = current_app.config.get('JOB_PURGE_BATCH', 500)
+    for i in range(0, len(gone), batch):
+        blobstore.purge(gone[i:i + batch])
+        progress(min(i + batch, len(gone)))
+    return {'path': path, 'blobs': len(gone)}
+
+@handler('move')
+def run_move(job_id, user_id, params, progress):
+    try:
+        vfs.move_path(user_id, params['src'], params['dst'])
+    except FileNotFoundError:
+        raise JobFailed('源文件不存在')
+    except FileExistsError:
+        raise JobFailed('目标位置已存在同名项目')
+    except NotADirectoryError:
+        raise JobFailed('目标不是文件夹')
+    except ValueError as e:
+        raise JobFailed(str(e))
+    progress(1, 1)
+    return {'path': params['dst']}
+
+@handler('zip')
+def run_zip(job_id, user_id, params, progress):
+    """打包到暂存区再放入存储，进度按输出字节数估算（总量为原始大小）"""
+    folder = params['path']
+    if folder:
+        entry = vfs.get_entry(user_id, folder)
+        if not entry or not entry.is_folder:
+            raise JobFailed('文件夹不存在')
+    # 先取出全部条目：中途提交进度会结束当前事务，不能边查边提交
+    entries = list(vfs.iter_blobs(user_id, folder))
+    total = sum(size or 0 for _, _, size, _, _ in entries)
+    progress(0, total)
+
+    storage = get_storage()
+    staged = blobstore.staging_path(job_id + '.zip')
+    step = current_app.config['JOB_PROGRESS_BYTES']
+    written = reported = 0
+    try:
+        with open(staged, 'wb') as fp:
+            for data in stream_zip(entries, storage):
+                fp.write(data)
+                written += len(data)
+                if written - reported >= step:
+                    progress(min(written, total))
+                    reported = written
+        size = os.path.getsize(staged)
+        key = f'exports/{job_id}.zip'
+        storage.put(key, staged)
+    except BaseException:
+        if os.path.exists(staged):
+            os.remove(staged)
+        raise
+    progress(total)
+    return {'key': key, 'name': (folder.split('/')[-1] or 'root') + '.zip', 'size': size}
+
+@handler('gc')
+def run_gc(job_id, user_id, params, progress):
+    """清扫存储中没有 blob 行的内容（例如删除任务中途进程退出留下的）"""
+    storage = get_storage()
+    batch = current_app.config.get('JOB_PURGE_BATCH', 500)
+    scanned = removed = 0
+    pending = []
+
+    def flush():
+        nonlocal removed
+        removed += blobstore.purge(pending)
+        pending.clear()
+        progress(scanned)
+
+    for key in storage.list():
+        name = key.rsplit('/', 1)[-1]
+        if len(name) != 64 or blobstore.blob_key(name) != key:
+            continue  # 不是 blob（如打包产物）
+        scanned += 1
+        pending.append(name)
+        if len(pending) >= batch:
+            flush()
+    flush()
+    return {'scanned': scanned, 'removed': removed}
@@ -0,0 +1,155 @@
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, text
+from .init_db import sqlite
+from .models import Change, ChangeWatermark
+
+# 变更日志：vfs 每次修改文件树时在同一事务里追加记录，同步客户端按游标（最后见到的 id）
+# 增量拉取，代价与变更数成正比，不必重新列出整棵树。记录分三种：
+#   put     新建或覆盖的文件/文件夹，附带当时的大小和内容哈希
+#   delete  删除的路径，文件夹连同整棵子树（path 为 '' 表示清空整个用户目录）
+#   move    移动或重命名，文件夹连同整棵子树
+# 本进程提交后立即唤醒等待中的长轮询；其他进程（后台任务、多 worker）的修改靠
+# CHANGES_POLL_INTERVAL 定期查询发现。超过 CHANGES_RETENTION 的记录由调度线程清理，
+# 清理时按用户记下删掉的最大 id（ChangeWatermark），该用户的游标早于它时返回 410，
+# 客户端需要重新全量列出一次。
+_changed = threading.Condition()
+
+
+def record(user_id, op, path, target=None, entry=None):
+    """追加一条记录（不提交），put 时 entry 为对应的 File 行"""
+    sqlite.session.add(Change(
+        user_id=user_id, op=op, path=path, target=target,
+        is_folder=bool(entry and entry.is_folder),
+        size=entry.size if entry else None,
+        blob_hash=entry.blob_hash if entry else None,
+    ))
+    sqlite.session.info['journal_changed'] = True
+
+def record_puts(user_id, rows):
+    """批量追加 put 记录，rows 为 put_files 插入 file 表的字典（不提交）"""
+    if not rows:
+        return
+    created_at = datetime.utcnow()
+    sqlite.session.execute(insert(Change), [
+        dict(user_id=user_id, op='put', path=r['filename'], is_folder=r['is_folder'],
+             size=r.get('size'), blob_hash=r.get('blob_hash'), created_at=created_at)
+        for r in rows
+    ])
+    sqlite.session.info['journal_changed'] = True
+
+
+@event.listens_for(sqlite.session, 'after_commit')
+def _notify(session):
+    if session.info.pop('journal_changed', False):
+        with _changed:
+            _changed.notify_all()
+
+@event.listens_for(sqlite.session, 'after_rollback')
+def _discard(session):
+    session.info.pop('journal_changed', None)
+
+
+# ------------------ 读取 ------------------
+def head():
+    """全局最新一条记录的 id，对所有用户都是有效的游标；新客户端全量列出后从这里开始同步"""
+    return sqlite.session.query(func.max(Change.id)).scalar() or 0
+
+def latest(user_id):
+    """该用户最新一条记录的 id，没有记录时为 0"""
+    return sqlite.session.query(func.max(Change.id)).filter(Change.user_id == user_id).scalar() or 0
+
+def expired(user_id, cursor):
+    """该用户游标之后的记录是否有一部分已被清理（只看该用户自己被清理的记录）"""
+    watermark = sqlite.session.get(ChangeWatermark, user_id)
+    return watermark is not None and cursor < watermark.pruned_id
+
+def _covered(path, deleted):
+    """path 本身或它的某个上级在 deleted 中（'' 表示整个用户目录）"""
+    if '' in deleted:
+        return True
+    parts = path.split('/')
+    return any('/'.join(parts[:i]) in deleted for i in range(1, len(parts) + 1))
+
+def compact(changes):
+    """去掉被后续记录覆盖的记录：同一路径只保留最后一次 put，被删除的路径及其子树之前的记录都丢弃
+
+    move 会改变后续记录的路径含义，所以只在两次 move 之间压缩，move 本身原样保留。
+    """
+    result, segment = [], []
+
+    def flush():
+        kept, seen, deleted = [], set(), set()
+        for c in reversed(segment):
+            if _covered(c.path, deleted):
+                continue
+            if c.op == 'delete':
+                deleted.add(c.path)
+            elif c.path in seen:
+                continue
+            else:
+                seen.add(c.path)
+            kept.append(c)
+        result.extend(reversed(kept))
+        segment.clear()
+
+    for c in changes:
+        if c.op == 'move':
+            flush()
+            result.append(c)
+        else:
+            segment.append(c)
+    flush()
+    return result
+
+def describe(change):
+    item = {'id': change.id, 'op': change.op, 'path': change.path}
+    if change.op == 'move':
+        item['to'] = change.target
+    elif change.op == 'put':
+        item.update(is_folder=change.is_folder, size=change.size or 0, hash=change.blob_hash)
+    return item
+
+def changes_since(user_id, cursor, limit):
+    """cursor 之后的一页记录，返回 (压缩后的记录, 新游标, 是否还有更多)"""
+    rows = Change.query.filter(Change.user_id == user_id, Change.id > cursor) \
+        .order_by(Change.id).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return [describe(c) for c in compact(rows)], rows[-1].id if rows else cursor, more
+
+def wait_for(user_id, cursor, timeout, interval):
+    """等到该用户有 cursor 之后的记录或超时，返回是否有新记录
+
+    等待期间不占用数据库连接：每次查询后立即结束读事务。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        found = latest(user_id) > cursor
+        sqlite.session.rollback()
+        remaining = deadline - time.monotonic()
+        if found or remaining <= 0:
+            return found
+        with _changed:
+            _changed.wait(min(interval, remaining))
+
+
+def prune(retention):
+    """删除超过保留时间的记录并更新各用户的清理位置（不提交）
+
+    始终留下全局最新一条，让 head() 在清理后也不会回到 0。
+    """
+    deadline = datetime.utcnow() - timedelta(seconds=retention)
+    newest = head()
+    stale = (Change.created_at < deadline, Change.id < newest)
+    pruned = sqlite.session.query(Change.user_id, func.max(Change.id)).filter(*stale).group_by(Change.user_id).all()
+    if not pruned:
+        return 0
+    sqlite.session.execute(
+        text("INSERT INTO change_watermark (user_id, pruned_id) VALUES (:u, :p) "
+             "ON CONFLICT (user_id) DO UPDATE SET pruned_id = max(pruned_id, excluded.pruned_id)"),
+        [{'u': user_id, 'p': pruned_id} for user_id, pruned_id in pruned]
+    )
+    result = sqlite.session.execute(delete(Change).where(*stale))
+    return result.rowcount
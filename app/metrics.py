@@ -0,0 +1,241 @@
+import time
+import bisect
+import threading
+from collections import deque
+from datetime import datetime
+from flask import current_app, g, request
+from sqlalchemy import func
+from .init_db import sqlite
+from .models import User
+
+# 运行指标：计数器和直方图只在内存里累加，导出时不查数据库、不扫目录。
+# 文件数、用户数、总字节数这类库存数据按 METRICS_INVENTORY_TTL 缓存，过期后才查一次
+# （都从 user 表汇总：文件数累加 user.file_count，总字节数累加 user.used_bytes，不扫 file 表）。
+# 指标按进程统计；多进程部署时 Prometheus 分别抓取，或在前面汇总。
+RATE_WINDOW = 60  # JSON 快照里“每秒”速率的统计窗口（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """只增不减的计数，同时保留最近 RATE_WINDOW 秒的按秒明细，用于计算速率"""
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self.values = {}
+        self.recent = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        now = int(time.time())
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            recent = self.recent.setdefault(key, deque())
+            if recent and recent[-1][0] == now:
+                recent[-1][1] += amount
+            else:
+                recent.append([now, amount])
+            while recent[0][0] <= now - RATE_WINDOW:
+                recent.popleft()
+
+    def total(self, **labels):
+        with self.lock:
+            if labels:
+                return self.values.get(self.key(labels), 0)
+            return sum(self.values.values())
+
+    def rate(self, **labels):
+        """最近 RATE_WINDOW 秒的平均每秒增量"""
+        since = int(time.time()) - RATE_WINDOW
+        with self.lock:
+            keys = [self.key(labels)] if labels else list(self.recent)
+            amount = sum(n for k in keys for sec, n in self.recent.get(k, ()) if sec > since)
+        return amount / RATE_WINDOW
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f'{self.name}{_labels(self.label_names, k)} {v}' for k, v in items]
+
+
+class Gauge(Metric):
+    """导出时才取值的瞬时量"""
+    kind = 'gauge'
+
+    def __init__(self, name, doc, read):
+        super().__init__(name, doc)
+        self.read = read
+
+    def samples(self):
+        return [f'{self.name} {self.read()}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # key -> [各桶计数（不累计）, 总和, 次数]
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def summary(self, key):
+        """(次数, 平均值, p95 所在桶的上界)，落在最后一个桶之外时上界为 None"""
+        with self.lock:
+            counts, total, count = self.values[key][0][:], self.values[key][1], self.values[key][2]
+        seen, p95 = 0, None
+        for bound, n in zip(self.buckets + (None,), counts):
+            seen += n
+            if seen >= count * 0.95:
+                p95 = bound
+                break
+        return count, total / count if count else 0, p95
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, (v[0][:], v[1], v[2])) for k, v in self.values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+# ------------------ 库存数据（带缓存） ------------------
+_inventory = {'at': 0, 'values': None}
+_inventory_lock = threading.Lock()
+
+def inventory(ttl=30):
+    """{'users', 'files', 'bytes'}，ttl 秒内重复调用直接返回缓存"""
+    with _inventory_lock:
+        if _inventory['values'] is None or time.monotonic() - _inventory['at'] > ttl:
+            users, files, size = sqlite.session.query(
+                func.count(User.id), func.coalesce(func.sum(User.file_count), 0),
+                func.coalesce(func.sum(User.used_bytes), 0)).one()
+            _inventory['values'] = {'users': users, 'files': int(files), 'bytes': int(size)}
+            _inventory['at'] = time.monotonic()
+        return dict(_inventory['values'])
+
+def _inventory_value(name):
+    return lambda: inventory(current_app.config.get('METRICS_INVENTORY_TTL', 30))[name]
+
+
+# ------------------ 指标定义 ------------------
+REQUESTS = Counter('cloud_http_requests_total', '请求数', ('endpoint', 'method', 'status'))
+LATENCY = Histogram('cloud_http_request_duration_seconds', '请求处理时间（到返回响应为止，不含流式发送）',
+                    ('endpoint', 'method'))
+UPLOADS = Counter('cloud_uploads_total', '上传登记的文件数')
+UPLOAD_BYTES = Counter('cloud_upload_bytes_total', '上传登记的字节数')
+DOWNLOADS = Counter('cloud_downloads_total', '下载次数，kind 为 file / zip', ('kind',))
+DOWNLOAD_BYTES = Counter('cloud_download_bytes_total', '下载发送的字节数（单文件按响应长度计）', ('kind',))
+Gauge('cloud_users', '用户数', _inventory_value('users'))
+Gauge('cloud_files', '文件数（不含文件夹）', _inventory_value('files'))
+Gauge('cloud_stored_bytes', '所有用户的用量合计', _inventory_value('bytes'))
+
+
+def record_upload(count, size):
+    UPLOADS.inc(count)
+    UPLOAD_BYTES.inc(size)
+
+def record_download(status, headers, size):
+    """按下载计划计数：返回内容或重定向到存储地址都算一次下载"""
+    if status in (200, 206, 302):
+        DOWNLOADS.inc(kind='file')
+        DOWNLOAD_BYTES.inc(int(headers.get('Content-Length', size or 0)), kind='file')
+
+def count_zip(chunks):
+    """包一层 zip 数据流，按实际发出的字节计数"""
+    DOWNLOADS.inc(kind='zip')
+    for chunk in chunks:
+        DOWNLOAD_BYTES.inc(len(chunk), kind='zip')
+        yield chunk
+
+
+# ------------------ 导出 ------------------
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+def snapshot(ttl=30):
+    """给管理后台轮询的 JSON；time、count 两个键沿用旧接口，供仪表盘图表使用"""
+    totals = inventory(ttl)
+    latency = {}
+    for key in list(LATENCY.values):
+        count, avg, p95 = LATENCY.summary(key)
+        latency[' '.join(reversed(key))] = {'count': count, 'avg': round(avg, 4), 'p95': p95}
+    return {
+        'time': datetime.now().strftime('%H:%M'),
+        'count': totals['files'],
+        'users': totals['users'],
+        'files': totals['files'],
+        'bytes': totals['bytes'],
+        'uploads': {'total': UPLOADS.total(), 'per_second': round(UPLOADS.rate(), 3),
+                    'bytes': UPLOAD_BYTES.total(), 'bytes_per_second': round(UPLOAD_BYTES.rate(), 1)},
+        'downloads': {'total': DOWNLOADS.total(), 'per_second': round(DOWNLOADS.rate(), 3),
+                      'bytes': DOWNLOAD_BYTES.total(), 'bytes_per_second': round(DOWNLOAD_BYTES.rate(), 1)},
+        'requests': {'total': REQUESTS.total(), 'per_second': round(REQUESTS.rate(), 3)},
+        'latency': latency,
+    }
+
+
+# ------------------ 请求计时 ------------------
+def init_app(app):
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+            REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
@@ -0,0 +1,111 @@
+import os
+from flask import current_app
+from sqlalchemy import inspect, text
+from .init_db import sqlite
+from .models import File, parent_of
+from . import blobstore
+from .usage import reconcile_usage
+from .search import install_index
+
+
+def upgrade_schema():
+    """为旧数据库补齐新增列并回填数据（create_all 不会修改已存在的表）"""
+    columns = {c['name'] for c in inspect(sqlite.engine).get_columns('file')}
+    user_columns = {c['name'] for c in inspect(sqlite.engine).get_columns('user')}
+    blob_columns = {c['name'] for c in inspect(sqlite.engine).get_columns('blob')}
+
+    with sqlite.engine.begin() as conn:
+        if 'parent' not in columns:
+            conn.execute(text("ALTER TABLE file ADD COLUMN parent VARCHAR(255) NOT NULL DEFAULT ''"))
+            rows = conn.execute(text("SELECT id, filename FROM file WHERE filename LIKE '%/%'")).all()
+            if rows:
+                conn.execute(
+                    text("UPDATE file SET parent = :parent WHERE id = :id"),
+                    [{'id': r.id, 'parent': parent_of(r.filename)} for r in rows]
+                )
+
+        if 'mtime' not in columns:
+            conn.execute(text("ALTER TABLE file ADD COLUMN mtime DATETIME"))
+            # created_at 存的是 UTC，mtime 按本地时间展示
+            conn.execute(text("UPDATE file SET mtime = datetime(created_at, 'localtime')"))
+
+        if 'blob_hash' not in columns:
+            conn.execute(text("ALTER TABLE file ADD COLUMN blob_hash VARCHAR(64)"))
+
+        if 'codec' not in blob_columns:
+            conn.execute(text("ALTER TABLE blob ADD COLUMN codec VARCHAR(16)"))
+
+        if 'used_bytes' not in user_columns:
+            conn.execute(text("ALTER TABLE user ADD COLUMN used_bytes BIGINT NOT NULL DEFAULT 0"))
+        if 'quota_bytes' not in user_columns:
+            conn.execute(text("ALTER TABLE user ADD COLUMN quota_bytes BIGINT"))
+        if 'file_count' not in user_columns:
+            conn.execute(text("ALTER TABLE user ADD COLUMN file_count INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text("UPDATE user SET file_count = "
+                              "(SELECT count(*) FROM file WHERE file.user_id = user.id AND file.is_folder = 0)"))
+
+        if 'ix_file_list_name' not in {i['name'] for i in inspect(conn).get_indexes('file')}:
+            # 分页游标按 size/mtime 比较，旧数据里的 NULL 先补上；(user_id, parent) 索引被新索引覆盖
+            conn.execute(text("UPDATE file SET size = 0 WHERE size IS NULL"))
+            conn.execute(text("UPDATE file SET mtime = datetime(created_at, 'localtime') WHERE mtime IS NULL"))
+            conn.execute(text("DROP INDEX IF EXISTS ix_file_user_parent"))
+        if 'ux_file_user_filename' not in {i['name'] for i in inspect(conn).get_indexes('file')}:
+            dedupe_paths(conn)
+            conn.execute(text("DROP INDEX IF EXISTS ix_file_user_filename"))
+        for index in File.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+        install_index(conn)
+
+    if 'used_bytes' not in user_columns:
+        # 旧库的文件夹行 size 都是 0，按文件行汇总一次
+        reconcile_usage()
+
+
+def dedupe_paths(conn):
+    """建唯一索引前处理并发重命名/移动留下的重复路径：保留文件夹（没有时保留最早的一行），
+    多余的同名文件夹直接删除（子项按路径归属，不受影响），多余的文件改名为 '<路径>.dup<id>'
+    """
+    groups = conn.execute(text(
+        "SELECT user_id, filename FROM file GROUP BY user_id, filename HAVING count(*) > 1")).all()
+    for user_id, filename in groups:
+        rows = conn.execute(text(
+            "SELECT id, is_folder FROM file WHERE user_id = :u AND filename = :f ORDER BY is_folder DESC, id"),
+            {'u': user_id, 'f': filename}).all()
+        keep_folder = rows[0].is_folder
+        for row in rows[1:]:
+            if row.is_folder and keep_folder:
+                conn.execute(text("DELETE FROM file WHERE id = :id"), {'id': row.id})
+            else:
+                conn.execute(text("UPDATE file SET filename = :name WHERE id = :id"),
+                             {'name': f'{filename}.dup{row.id}', 'id': row.id})
+
+
+def import_legacy_files():
+    """把旧版按 uploads/<user_id>/<路径> 存放的文件搬进 blob 存储"""
+    root = current_app.config['UPLOAD_ROOT']
+    pending = File.query.filter(File.is_folder.is_(False), File.blob_hash.is_(None)).all()
+    moved = False
+    for f in pending:
+        legacy = os.path.join(root, str(f.user_id), f.filename)
+        if not os.path.isfile(legacy):
+            continue
+        blob_hash, size = blobstore.hash_file(legacy)
+        blobstore.ingest(legacy, blob_hash, size)
+        f.blob_hash = blob_hash
+        f.size = size
+        moved = True
+    if not moved:
+        return
+    sqlite.session.commit()
+    reconcile_usage()
+
+    # 清理搬空的旧用户目录
+    for entry in os.listdir(root):
+        if not entry.isdigit():
+            continue
+        for dirpath, _, _ in os.walk(os.path.join(root, entry), topdown=False):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
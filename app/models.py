@@ -1,5 +1,12 @@
 from .init_db import sqlite
 from datetime import datetime
+from sqlalchemy.orm import validates
+
+
+def parent_of(filename):
+    """返回相对路径的父目录，根目录下的条目父目录为 ''"""
+    return filename.rsplit('/', 1)[0] if '/' in filename else ''
+
 
 class User(sqlite.Model):
     __tablename__ = 'user'
@@ -10,13 +17,108 @@ class User(sqlite.Model):
     created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
     # 新增字段：最后登录 IP
     last_login_ip = sqlite.Column(sqlite.String(45))  # IPv6 也可存
+    # 已用空间，随上传/删除在同一事务内增减
+    used_bytes = sqlite.Column(sqlite.BigInteger, nullable=False, default=0)
+    # 文件数（不含文件夹），和 used_bytes 一样在同一事务内增减
+    file_count = sqlite.Column(sqlite.Integer, nullable=False, default=0)
+    # 空间配额（字节），为空时使用 DEFAULT_USER_QUOTA
+    quota_bytes = sqlite.Column(sqlite.BigInteger)
 
 class File(sqlite.Model):
     __tablename__ = 'file'
+    # 列目录按 (user_id, parent, is_folder) 取直接子项，分页排序的每一列各有一个索引；
+    # 同一用户下路径唯一
+    __table_args__ = (
+        sqlite.Index('ix_file_list_name', 'user_id', 'parent', 'is_folder', 'filename'),
+        sqlite.Index('ix_file_list_size', 'user_id', 'parent', 'is_folder', 'size'),
+        sqlite.Index('ix_file_list_mtime', 'user_id', 'parent', 'is_folder', 'mtime'),
+        sqlite.Index('ux_file_user_filename', 'user_id', 'filename', unique=True),
+    )
     id = sqlite.Column(sqlite.Integer, primary_key=True)
     filename = sqlite.Column(sqlite.String(255), nullable=False)
     user_id = sqlite.Column(sqlite.Integer, nullable=False)
-    size = sqlite.Column(sqlite.Integer, default=0)
+    # 父目录相对路径，随 filename 自动维护
+    parent = sqlite.Column(sqlite.String(255), nullable=False, default='')
+    size = sqlite.Column(sqlite.Integer, default=0)  # 文件夹为整棵子树的文件总大小
     is_folder = sqlite.Column(sqlite.Boolean, default=False)
     created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+    # 修改时间存库，列目录时不再逐个 stat 磁盘
+    mtime = sqlite.Column(sqlite.DateTime, default=datetime.now)
+    # 文件内容所在的 blob，文件夹为空
+    blob_hash = sqlite.Column(sqlite.String(64), index=True)
 
+    @validates('filename')
+    def _sync_parent(self, key, value):
+        self.parent = parent_of(value)
+        return value
+
+class Blob(sqlite.Model):
+    """按内容 sha256 去重存储的文件实体，refcount 为引用它的 File 行数"""
+    __tablename__ = 'blob'
+    hash = sqlite.Column(sqlite.String(64), primary_key=True)
+    size = sqlite.Column(sqlite.BigInteger, nullable=False)
+    refcount = sqlite.Column(sqlite.Integer, nullable=False, default=0)
+    codec = sqlite.Column(sqlite.String(16))  # 落盘编码，None 为原样存放，'gzip' 见 compression.py
+    created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+
+class UploadSession(sqlite.Model):
+    """分片上传会话，文件先写入暂存区，全部分片到齐后再落到目标位置"""
+    __tablename__ = 'upload_session'
+    id = sqlite.Column(sqlite.String(32), primary_key=True)
+    user_id = sqlite.Column(sqlite.Integer, nullable=False, index=True)
+    filename = sqlite.Column(sqlite.String(255), nullable=False)  # 目标相对路径
+    size = sqlite.Column(sqlite.BigInteger, nullable=False)
+    created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+
+class UploadChunk(sqlite.Model):
+    """已写入的分片区间 [offset, offset + length)"""
+    __tablename__ = 'upload_chunk'
+    id = sqlite.Column(sqlite.Integer, primary_key=True)
+    session_id = sqlite.Column(sqlite.String(32), nullable=False, index=True)
+    offset = sqlite.Column(sqlite.BigInteger, nullable=False)
+    length = sqlite.Column(sqlite.BigInteger, nullable=False)
+
+class Change(sqlite.Model):
+    """变更日志：文件和文件夹的每次新建/覆盖、删除、移动各记一行，id 只增不减，作为同步游标"""
+    __tablename__ = 'change'
+    __table_args__ = (
+        sqlite.Index('ix_change_user_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True},  # 删除旧记录后 id 也不会被重新使用
+    )
+    id = sqlite.Column(sqlite.Integer, primary_key=True)
+    user_id = sqlite.Column(sqlite.Integer, nullable=False)
+    op = sqlite.Column(sqlite.String(10), nullable=False)  # put / delete / move
+    path = sqlite.Column(sqlite.String(255), nullable=False)
+    target = sqlite.Column(sqlite.String(255))  # move 的新路径
+    # put 时条目的状态，客户端不必再查询
+    is_folder = sqlite.Column(sqlite.Boolean, default=False)
+    size = sqlite.Column(sqlite.BigInteger)
+    blob_hash = sqlite.Column(sqlite.String(64))
+    created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+
+class ChangeWatermark(sqlite.Model):
+    """每个用户已被清理的变更日志的最大 id，早于它的游标中间可能缺了记录"""
+    __tablename__ = 'change_watermark'
+    user_id = sqlite.Column(sqlite.Integer, primary_key=True)
+    pruned_id = sqlite.Column(sqlite.Integer, nullable=False, default=0)
+
+class Job(sqlite.Model):
+    """后台任务：打包、删除大目录、移动等，状态和进度存库，多个进程共享同一队列"""
+    __tablename__ = 'job'
+    __table_args__ = (
+        sqlite.Index('ix_job_status_created', 'status', 'created_at'),
+        sqlite.Index('ix_job_user_created', 'user_id', 'created_at'),
+    )
+    id = sqlite.Column(sqlite.String(32), primary_key=True)
+    user_id = sqlite.Column(sqlite.Integer, nullable=False)   # 被操作的用户
+    kind = sqlite.Column(sqlite.String(20), nullable=False)
+    params = sqlite.Column(sqlite.Text, nullable=False, default='{}')   # JSON
+    status = sqlite.Column(sqlite.String(10), nullable=False, default='queued')  # queued/running/done/failed
+    done = sqlite.Column(sqlite.BigInteger, nullable=False, default=0)
+    total = sqlite.Column(sqlite.BigInteger, nullable=False, default=0)
+    message = sqlite.Column(sqlite.String(255))
+    result = sqlite.Column(sqlite.Text)   # JSON
+    created_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+    # 运行中的任务定期刷新，长时间不动说明执行它的进程已经退出
+    updated_at = sqlite.Column(sqlite.DateTime, default=datetime.utcnow)
+    finished_at = sqlite.Column(sqlite.DateTime)
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from datetime import datetime
+from flask import request, template_rendered, before_render_template
+from sqlalchemy import event
+from werkzeug.wsgi import FileWrapper
+from .init_db import sqlite
+from .storage import create_storage
+
+# 请求级性能分析，PROFILE_ENABLED 打开时由 create_app 注册（默认关闭）。
+# 每个请求记录：SQL 条数和耗时（SQLAlchemy 游标事件）、存储读写耗时、模板渲染耗时，
+# 以 Server-Timing 响应头返回，结束时写一行日志；同一条 SQL 重复执行过多次（N+1）时告警。
+# 请求进行期间后台线程按 PROFILE_SAMPLE_INTERVAL 采样调用栈，超过 PROFILE_SLOW_MS 的请求
+# 把采样结果（可直接用 flamegraph.pl 画图的折叠栈）和 SQL 明细写到 PROFILE_DIR。
+# 只统计经过 Flask 的请求；ASGI 入口的异步路由不在其中。
+log = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('profile', default=None)
+_active = {}  # 线程 ID -> 正在进行的请求记录，供采样线程使用
+_active_lock = threading.Lock()
+
+
+class Profile:
+    """一个请求的统计"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])  # SQL 文本 -> [次数, 耗时]
+        self.storage_count = 0
+        self.storage_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+        self.samples = Counter()
+        self.handler_time = None
+
+    def add_storage(self, elapsed):
+        self.storage_count += 1
+        self.storage_time += elapsed
+
+
+# ------------------ SQL ------------------
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    starts = conn.info.get('profile_start')
+    if profile is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    profile.sql_count += 1
+    profile.sql_time += elapsed
+    stat = profile.statements[statement]
+    stat[0] += 1
+    stat[1] += elapsed
+
+
+# ------------------ 存储 ------------------
+class TimedStorage:
+    """包装存储后端，统计各操作耗时；read 按实际取数据的时间计，不含响应发送"""
+
+    TIMED = ('put', 'open', 'stat', 'delete', 'copy')
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if name not in self.TIMED:
+            return attr
+
+        def timed(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return attr(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                profile.add_storage(time.perf_counter() - start)
+        return timed
+
+    def list(self, prefix=''):
+        return self._storage.list(prefix)
+
+    def read(self, key, start=0, end=None):
+        blocks = self._storage.read(key, start, end)
+        while True:
+            profile = _current.get()
+            begin = time.perf_counter()
+            try:
+                block = next(blocks)
+            except StopIteration:
+                return
+            finally:
+                if profile is not None:
+                    profile.add_storage(time.perf_counter() - begin)
+            yield block
+
+
+# ------------------ 模板 ------------------
+def _before_render(sender, template, context, **extra):
+    profile = _current.get()
+    if profile is not None:
+        profile.template_start = time.perf_counter()
+
+def _after_render(sender, template, context, **extra):
+    profile = _current.get()
+    if profile is not None and profile.template_start is not None:
+        profile.template_time += time.perf_counter() - profile.template_start
+        profile.template_start = None
+
+
+# ------------------ 采样 ------------------
+def _frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+def _sampler(interval):
+    me = threading.get_ident()
+    while True:
+        time.sleep(interval)
+        with _active_lock:
+            if not _active:
+                continue
+            watched = dict(_active)
+        frames = sys._current_frames()
+        for ident, profile in watched.items():
+            frame = frames.get(ident)
+            if frame is not None and ident != me:
+                profile.samples[_frame_stack(frame)] += 1
+
+
+# ------------------ 输出 ------------------
+class _Finishing:
+    """响应体迭代器的包装，服务器关闭它时调用 finish"""
+
+    def __init__(self, iterable, finish):
+        self.iterable = iterable
+        self.finish = finish
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.finish()
+
+def _release(ident, token):
+    """请求结束：不再采样该线程，清除当前请求的统计对象"""
+    with _active_lock:
+        _active.pop(ident, None)
+    try:
+        _current.reset(token)
+    except ValueError:
+        _current.set(None)  # 在其他上下文里关闭响应
+
+def _summary(profile, total, info):
+    """info 为请求方法、路径、端点、状态码，响应发送完时请求上下文已经结束，需要提前取好"""
+    statements = sorted(profile.statements.items(), key=lambda kv: kv[1][1], reverse=True)
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        **info,
+        'total_ms': round(total * 1000, 1),
+        'handler_ms': round((profile.handler_time or total) * 1000, 1),
+        'sql': {'count': profile.sql_count, 'ms': round(profile.sql_time * 1000, 1),
+                'statements': [{'sql': sql, 'count': n, 'ms': round(t * 1000, 2)} for sql, (n, t) in statements[:50]]},
+        'storage': {'count': profile.storage_count, 'ms': round(profile.storage_time * 1000, 1)},
+        'template_ms': round(profile.template_time * 1000, 1),
+        'samples': sum(profile.samples.values()),
+    }
+
+def _dump(folder, summary, samples):
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    name = f"{stamp}_{summary['method']}_{summary['endpoint'] or 'unmatched'}_{int(summary['total_ms'])}ms"
+    with open(os.path.join(folder, name + '.json'), 'w', encoding='utf-8') as fp:
+        json.dump(summary, fp, ensure_ascii=False, indent=2)
+    if samples:
+        with open(os.path.join(folder, name + '.folded'), 'w', encoding='utf-8') as fp:
+            for stack, count in samples.most_common():
+                fp.write(f'{stack} {count}\n')
+
+
+def init_app(app):
+    config = app.config
+    slow = config.get('PROFILE_SLOW_MS', 500) / 1000
+    repeat_warn = config.get('PROFILE_REPEAT_WARN', 20)
+    folder = config.get('PROFILE_DIR', 'profiles')
+
+    with app.app_context():
+        for engine in sqlite.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_execute)
+            event.listen(engine, 'after_cursor_execute', _after_execute)
+    app.extensions['storage'] = TimedStorage(create_storage(config))
+    template_rendered.connect(_after_render, app)
+    before_render_template.connect(_before_render, app)
+
+    interval = config.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+    if interval:
+        threading.Thread(target=_sampler, args=(interval,), name='profile-sampler', daemon=True).start()
+
+    @app.before_request
+    def start_profile():
+        profile = Profile()
+        token = _current.set(profile)
+        with _active_lock:
+            _active[threading.get_ident()] = profile
+        request.environ['cloud.profile'] = (profile, token, threading.get_ident())
+
+    @app.after_request
+    def report_profile(response):
+        entry = request.environ.pop('cloud.profile', None)
+        if entry is None:
+            return response
+        profile, token, ident = entry
+        profile.handler_time = time.perf_counter() - profile.start
+        response.headers['Server-Timing'] = ', '.join([
+            f'sql;dur={profile.sql_time * 1000:.1f};desc="{profile.sql_count} queries"',
+            f'storage;dur={profile.storage_time * 1000:.1f}',
+            f'tmpl;dur={profile.template_time * 1000:.1f}',
+            f'app;dur={profile.handler_time * 1000:.1f}',
+        ])
+        info = {'method': request.method, 'path': request.full_path.rstrip('?'),
+                'endpoint': request.endpoint, 'status': response.status_code}
+
+        def finish():
+            _release(ident, token)
+            total = time.perf_counter() - profile.start
+            summary = _summary(profile, total, info)
+            log.info('%s %s %s %.1fms sql=%d/%.1fms storage=%d/%.1fms tmpl=%.1fms',
+                     info['method'], info['path'], info['status'], summary['total_ms'],
+                     profile.sql_count, profile.sql_time * 1000, profile.storage_count,
+                     profile.storage_time * 1000, profile.template_time * 1000)
+            for sql, (count, _) in profile.statements.items():
+                if count >= repeat_warn:
+                    log.warning('%s 中同一条 SQL 执行了 %d 次，可能是 N+1 查询：%s',
+                                info['endpoint'], count, ' '.join(sql.split())[:200])
+            if total >= slow:
+                try:
+                    _dump(folder, summary, profile.samples)
+                except OSError:
+                    log.exception('写入性能分析结果失败')
+
+        # 流式响应在发送完、服务器关闭迭代器时结束统计；direct_passthrough 的响应不会触发
+        # call_on_close，所以包一层迭代器。文件句柄交给 file_wrapper 的不包，以免失去 sendfile
+        streamed = response.is_streamed and request.method != 'HEAD' and response.status_code not in (204, 304)
+        if streamed and not isinstance(response.response, FileWrapper):
+            response.response = _Finishing(response.response, finish)
+        else:
+            finish()
+        return response
+
+    @app.teardown_request
+    def discard_profile(exc):
+        # 未处理的异常不会经过 after_request，记录还留在 environ 里，在这里清理，
+        # 否则采样线程会一直往这个已经结束的请求里记调用栈
+        entry = request.environ.pop('cloud.profile', None)
+        if entry is not None:
+            profile, token, ident = entry
+            _release(ident, token)
@@ -1,18 +1,15 @@
 import os
-import shutil
-import io
-import zipfile
 from datetime import datetime
-from flask import Blueprint, render_template, session, redirect, url_for, request, send_file, abort
-from ..models import User, File
+from flask import Blueprint, render_template, session, redirect, url_for, request, abort, jsonify, current_app
+from ..models import User
 from ..init_db import sqlite
+from ..utils import zip_response
+from ..serving import serve_blob
+from ..usage import quota_of
+from .. import jobs, metrics, vfs
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin', template_folder='../templates/admin')
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_ROOT = os.path.join(BASE_DIR, '../../uploads')
-os.makedirs(UPLOAD_ROOT, exist_ok=True)
-
 
 
 # ------------------ 权限检查 ------------------
@@ -22,160 +19,142 @@ def check_admin():
         return redirect(url_for('auth.login'))
 
 # ------------------ 工具函数 ------------------
-def get_abs_path(rel_path: str):
-    """返回 uploads 下的绝对路径"""
-    return os.path.join(UPLOAD_ROOT, rel_path)
-
-def list_folder(folder_path: str):
-    """列出目录下的文件和文件夹信息"""
-    abs_path = get_abs_path(folder_path)
-    if not os.path.exists(abs_path):
-        return []
-
-    items = []
-    for entry in sorted(os.listdir(abs_path)):
-        full_entry = os.path.join(abs_path, entry)
-        items.append({
-            'name': entry,
-            'is_folder': os.path.isdir(full_entry),
-            'mtime': datetime.fromtimestamp(os.path.getmtime(full_entry)),
-            'size': os.path.getsize(full_entry) if os.path.isfile(full_entry) else None
-        })
-    return items
+def split_target(rel_path: str):
+    """把 '<user_id>/<相对路径>' 拆成 (user_id, 相对路径)，用户 ID 不合法时返回 (None, None)"""
+    parts = rel_path.strip('/').split('/', 1)
+    if not parts[0].isdigit():
+        return None, None
+    return int(parts[0]), parts[1] if len(parts) > 1 else ''
 
 # ------------------ 管理首页 ------------------
 @admin_bp.route('/')
 def admin_index():
-    total_files = File.query.count()
-    total_users = len([d for d in os.listdir(UPLOAD_ROOT) if os.path.isdir(os.path.join(UPLOAD_ROOT, d))])
-    return render_template('admin.html', total_files=total_files, total_users=total_users)
+    totals = metrics.inventory(current_app.config.get('METRICS_INVENTORY_TTL', 30))
+    return render_template('admin.html', total_files=totals['files'], total_users=totals['users'])
 
 # ------------------ 浏览 uploads ------------------
-def get_user_map():
-    """返回 {user_id: username}"""
-    users = User.query.all()
-    return {str(u.id): u.username for u in users}
-# 在工具函数区域添加递归计算大小的函数
-def get_dir_size(path):
-    """递归计算文件夹总大小"""
-    total = 0
-    try:
-        with os.scandir(path) as it:
-            for entry in it:
-                if entry.is_file():
-                    total += entry.stat().st_size
-                elif entry.is_dir():
-                    total += get_dir_size(entry.path)
-    except Exception:
-        pass
-    return total
-
-# 修改后的 browse_uploads 路由
-@admin_bp.route('/uploads')
-@admin_bp.route('/uploads/<path:folder_path>')
+def user_item(user_obj):
+    return {
+        'id': user_obj.id,
+        'name': str(user_obj.id),    # 用户文件夹名（ID）
+        'display_name': user_obj.username,
+        'ip_addr': user_obj.last_login_ip or "从未登录",
+        'is_folder': True,
+        'mtime': user_obj.created_at,
+        'size': user_obj.used_bytes,
+        'quota': quota_of(user_obj)
+    }
 
+def user_page(after, limit):
+    """按 ID 分页列出用户，返回 (用户, 下一页游标)"""
+    limit = max(1, min(limit, vfs.LIST_PAGE_MAX))
+    users = User.query.filter(User.id > after).order_by(User.id).limit(limit + 1).all()
+    next_cursor = str(users[limit - 1].id) if len(users) > limit else None
+    return users[:limit], next_cursor
 
+def list_args():
+    sort = request.args.get('sort', 'name')
+    if sort not in vfs.SORT_COLUMNS:
+        raise ValueError('不支持的排序')
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    return sort, order, request.args.get('cursor') or None, request.args.get('limit', vfs.LIST_PAGE_SIZE, type=int)
 
 @admin_bp.route('/uploads')
 @admin_bp.route('/uploads/<path:folder_path>')
 def browse_uploads(folder_path=''):
     folder_path = folder_path.strip('/')
-
-    users = User.query.all()
-    user_map = {str(u.id): u for u in users}  # 保留 User 对象
-
-    # 根目录：显示所有用户
-    if folder_path == '':
-        items = []
-        for entry in sorted(os.listdir(UPLOAD_ROOT)):
-            full_entry = os.path.join(UPLOAD_ROOT, entry)
-            if os.path.isdir(full_entry):
-                user_obj = user_map.get(entry)
-                display_name = user_obj.username if user_obj else f"未知用户({entry})"
-                last_ip = user_obj.last_login_ip if user_obj and getattr(user_obj, 'last_login_ip', None) else "从未登录"
-                items.append({
-                    'name': entry,               # 用户文件夹名（ID）
-                    'display_name': display_name,
-                    'ip_addr': last_ip,          # 这里确保有 ip_addr
-                    'is_folder': True,
-                    'mtime': datetime.fromtimestamp(os.path.getmtime(full_entry)),
-                    'size': get_dir_size(full_entry)
-                })
-        return render_template('admin_uploads.html', current_path='', items=items)
-
-    # 用户目录或子目录
-    abs_path = get_abs_path(folder_path)
-    if not os.path.exists(abs_path):
-        return f"<script>alert('目录不存在');window.history.back();</script>"
+    try:
+        sort, order, cursor, limit = list_args()
+        # 根目录：分页显示所有用户
+        if folder_path == '':
+            users, next_cursor = user_page(int(cursor or 0), limit)
+            return render_template('admin_uploads.html', current_path='', items=[user_item(u) for u in users],
+                                   next_cursor=next_cursor)
+
+        # 用户目录或子目录
+        user_id, rel = split_target(folder_path)
+        if user_id is None or (rel and not vfs.get_entry(user_id, rel)):
+            return f"<script>alert('目录不存在');window.history.back();</script>"
+        entries, next_cursor = vfs.list_page(user_id, rel, sort, order, cursor, limit)
+    except ValueError:
+        abort(400)
 
     items = []
-    for entry in sorted(os.listdir(abs_path)):
-        full_entry = os.path.join(abs_path, entry)
-        try:
-            stat = os.stat(full_entry)
-            mtime = datetime.fromtimestamp(stat.st_mtime)
-            size = stat.st_size if os.path.isfile(full_entry) else get_dir_size(full_entry)
-        except Exception:
-            mtime = datetime.now()
-            size = 0
-
+    for f in entries:
         items.append({
-            'name': entry,
-            'display_name': entry,
-            'is_folder': os.path.isdir(full_entry),
-            'mtime': mtime,
-            'size': size
+            'name': f.filename.split('/')[-1],
+            'display_name': f.filename.split('/')[-1],
+            'is_folder': f.is_folder,
+            'mtime': f.mtime or datetime.now(),
+            'size': f.size
         })
 
-    return render_template('admin_uploads.html', current_path=folder_path, items=items)
+    return render_template('admin_uploads.html', current_path=folder_path, items=items, next_cursor=next_cursor)
+
+@admin_bp.route('/api/list')
+@admin_bp.route('/api/list/<path:folder_path>')
+def list_folder(folder_path=''):
+    """分页列目录的 JSON 接口，参数同 files.list_folder；根目录列出用户"""
+    folder_path = folder_path.strip('/')
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else None
+    try:
+        sort, order, cursor, limit = list_args()
+        if folder_path == '':
+            users, next_cursor = user_page(int(cursor or 0), limit)
+            items = [user_item(u) for u in users]
+            for item in items:
+                item['mtime'] = item['mtime'].isoformat(timespec='seconds') if item['mtime'] else None
+            if fields:
+                items = [{k: v for k, v in item.items() if k in fields} for item in items]
+            return jsonify({'items': items, 'next_cursor': next_cursor})
+
+        user_id, rel = split_target(folder_path)
+        if user_id is None or (rel and not vfs.get_entry(user_id, rel)):
+            return jsonify({'error': '目录不存在'}), 404
+        entries, next_cursor = vfs.list_page(user_id, rel, sort, order, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fields = [f for f in fields if f in vfs.LIST_FIELDS] if fields else vfs.LIST_FIELDS
+    return jsonify({'items': [vfs.describe(f, fields) for f in entries], 'next_cursor': next_cursor})
 
 # ------------------ 下载文件/文件夹 ------------------
 @admin_bp.route('/download/<path:rel_path>')
 def download(rel_path):
-    abs_path = get_abs_path(rel_path)
-    if not os.path.exists(abs_path):
+    user_id, rel = split_target(rel_path)
+    if user_id is None:
+        abort(404)
+    entry = vfs.get_entry(user_id, rel) if rel else None
+    if rel and not entry:
         abort(404)
 
-    if os.path.isdir(abs_path):
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for root, _, files in os.walk(abs_path):
-                for f in files:
-                    file_path = os.path.join(root, f)
-                    arcname = os.path.relpath(file_path, abs_path)
-                    zf.write(file_path, arcname=arcname)
-        memory_file.seek(0)
+    if entry is None or entry.is_folder:
+        # 和用户下载一样，大文件夹改为后台打包
+        job_id = jobs.zip_job_for(user_id, rel, entry)
+        if job_id:
+            back_url = url_for('admin.browse_uploads', folder_path=os.path.dirname(rel_path.strip('/')))
+            return render_template('job_wait.html', job_id=job_id, folder_path=rel, back_url=back_url)
         zip_name = os.path.basename(rel_path.rstrip("/")) + ".zip"
-        return send_file(memory_file, as_attachment=True, download_name=zip_name)
+        return zip_response(vfs.iter_blobs_paged(user_id, rel), zip_name)
     else:
-        return send_file(abs_path, as_attachment=True)
+        return serve_blob(entry)
 
 # ------------------ 删除文件/文件夹 ------------------
 @admin_bp.route('/delete', methods=['POST'])
 def delete():
     target_path = request.form.get('target_path', '').strip('/')
-    abs_path = get_abs_path(target_path)
-    if not os.path.exists(abs_path):
+    user_id, rel = split_target(target_path)
+    if user_id is None or (rel and not vfs.get_entry(user_id, rel)):
         return f"<script>alert('文件/文件夹不存在');window.history.back();</script>"
 
-    is_folder = os.path.isdir(abs_path)
-    try:
-        if is_folder:
-            shutil.rmtree(abs_path)
-        else:
-            os.remove(abs_path)
-    except Exception as e:
-        return f"<script>alert('删除失败: {str(e)}');window.history.back();</script>"
-
-    # 删除数据库元数据
-    parts = target_path.split('/', 1)
-    user_id = int(parts[0])
-    prefix = parts[1] if len(parts) > 1 else ""
-    affected = File.query.filter(File.user_id == user_id,
-                                 (File.filename == prefix) | (File.filename.startswith(prefix + '/'))).all()
-    for f in affected:
-        sqlite.session.delete(f)
-    sqlite.session.commit()
+    entry = vfs.get_entry(user_id, rel) if rel else None
+    if entry is None or entry.is_folder:
+        # 文件夹或整个用户目录放到后台删除
+        jobs.enqueue(user_id, 'delete', path=rel)
+    else:
+        # 删除数据库元数据，blob 无人引用时自动回收
+        vfs.delete_path(user_id, rel)
+        sqlite.session.commit()
 
     return redirect(url_for('admin.browse_uploads', folder_path=os.path.dirname(target_path)))
 
@@ -183,42 +162,45 @@ def delete():
 @admin_bp.route('/rename', methods=['POST'])
 def rename():
     old_name = request.form.get('old_name')
-    new_name = request.form.get('new_name')
+    new_name = request.form.get('new_name', '').strip()
     current_path = request.form.get('current_path', '').strip('/')
 
-    old_full = get_abs_path(os.path.join(current_path, old_name))
-    new_full = get_abs_path(os.path.join(current_path, new_name))
+    user_id, rel = split_target(current_path)
+    if user_id is None or not new_name or '/' in new_name:
+        return "<script>alert('名称不合法');window.history.back();</script>"
 
-    if not os.path.exists(old_full):
+    try:
+        vfs.move_path(user_id, vfs.join_path(rel, old_name), vfs.join_path(rel, new_name))
+    except FileNotFoundError:
         return "<script>alert('源不存在');window.history.back();</script>"
-    if os.path.exists(new_full):
+    except FileExistsError:
         return "<script>alert('目标已存在');window.history.back();</script>"
-
-    try:
-        os.rename(old_full, new_full)
-    except Exception as e:
-        return f"<script>alert('重命名失败: {str(e)}');window.history.back();</script>"
-
-    # 更新数据库
-    parts = (current_path + '/' + old_name).split('/', 1)
-    user_id = int(parts[0])
-    old_rel = parts[1] if len(parts) > 1 else old_name
-    new_rel = new_name if not parts[1:] else parts[1].replace(old_name, new_name, 1)
-
-    affected = File.query.filter(File.user_id == user_id,
-                                 File.filename.startswith(old_rel)).all()
-    for f in affected:
-        f.filename = f.filename.replace(old_rel, new_rel, 1)
     sqlite.session.commit()
 
     return redirect(url_for('admin.browse_uploads', folder_path=current_path))
 
+# ------------------ 用户配额 ------------------
+@admin_bp.route('/quota', methods=['POST'])
+def set_quota():
+    user_obj = sqlite.session.get(User, request.form.get('user_id', type=int))
+    if not user_obj:
+        return "<script>alert('用户不存在');window.history.back();</script>"
+    quota_mb = request.form.get('quota_mb', '').strip()
+    if quota_mb and not quota_mb.isdigit():
+        return "<script>alert('配额必须是整数 MB');window.history.back();</script>"
+    # 留空表示恢复默认配额
+    user_obj.quota_bytes = int(quota_mb) * 1024 * 1024 if quota_mb else None
+    sqlite.session.commit()
+    return redirect(url_for('admin.browse_uploads'))
+
+# ------------------ 存储清理 ------------------
+@admin_bp.route('/gc', methods=['POST'])
+def start_gc():
+    """后台清扫存储中没有 blob 记录的内容"""
+    jobs.enqueue(session['user_id'], 'gc')
+    return "<script>alert('已开始后台清理');window.history.back();</script>"
+
 @admin_bp.route('/api/stats')
 def get_stats():
-    total_files = File.query.count()
-    # 返回当前时间戳和文件总数
-    return {
-        "time": datetime.now().strftime('%H:%M'),
-        "count": total_files
-    }
-
+    # 内存里的计数加上带缓存的库存数据，轮询不会触发全表统计
+    return jsonify(metrics.snapshot(current_app.config.get('METRICS_INVENTORY_TTL', 30)))
@@ -0,0 +1,176 @@
+from flask import Blueprint, request, session, jsonify, current_app
+from ..init_db import sqlite, begin_write
+from ..models import parent_of
+from ..utils import normalize_rel_path, zip_response
+from .upload_ops import error
+from .. import blobstore, vfs
+
+# 多选的批量操作：
+#   POST /api/batch            {"op": "delete", "items": ["a.txt", "文件夹"]}
+#                              {"op": "move", "items": [...], "target": "目标文件夹"}
+#                              {"op": "rename", "items": [{"path": "a.txt", "name": "b.txt"}]}
+#        全部条目在一个写事务里处理、一次提交，按条目返回结果，单个条目失败不影响其他条目；
+#        删除释放的 blob 内容在提交后统一清理。同时选中文件夹和其中的条目时，后者随文件夹一起处理。
+#   POST /api/batch/download   items 为路径列表（JSON 或可重复的表单字段），打包成一个 zip 流式返回
+batch_bp = Blueprint('batch', __name__, url_prefix='/api/batch')
+
+
+@batch_bp.before_request
+def check_login():
+    if 'user_id' not in session:
+        return error('未登录', 401)
+
+def result(path, error=None, **extra):
+    if error:
+        return {'path': path, 'ok': False, 'error': error}
+    return dict({'path': path, 'ok': True}, **extra)
+
+def resolve(user_id, items):
+    """[(原始条目, 规整后的路径或 None, File 或 None)]，一次查出全部条目"""
+    paths = [normalize_rel_path(p) if isinstance(p, str) else None for p in items]
+    entries = vfs.get_entries(user_id, [p for p in paths if p])
+    return [(raw, path, entries.get(path)) for raw, path in zip(items, paths)]
+
+
+def batch_delete(user_id, items, data):
+    resolved = resolve(user_id, items)
+    folders = {path for _, path, entry in resolved if entry and entry.is_folder}
+    results, gone, done = [], [], set()
+    for raw, path, entry in resolved:
+        if not path:
+            results.append(result(raw, '路径不合法'))
+        elif path in done or vfs.selected_ancestor(path, folders):
+            results.append(result(path))
+        elif not entry:
+            results.append(result(path, '文件/文件夹不存在'))
+        else:
+            gone += vfs.delete_path(user_id, path, purge=False)
+            done.add(path)
+            results.append(result(path))
+    return results, gone
+
+def batch_move(user_id, items, data):
+    target = (data.get('target') or '').strip('/')
+    if target:
+        folder = vfs.get_entry(user_id, target)
+        if not folder or not folder.is_folder:
+            raise ValueError('目标文件夹不存在')
+    resolved = resolve(user_id, items)
+    folders = {path for _, path, entry in resolved if entry and entry.is_folder}
+    results = [None] * len(resolved)
+    moved = {}  # 实际移动的条目 -> 新路径，失败为 None
+    covered = []
+    for i, (raw, path, entry) in enumerate(resolved):
+        if not path:
+            results[i] = result(raw, '路径不合法')
+            continue
+        top = vfs.selected_ancestor(path, folders)
+        if top or path in moved:
+            covered.append((i, path, top or path))
+            continue
+        new_path = vfs.join_path(target, path.split('/')[-1])
+        moved[path] = None
+        if not entry:
+            results[i] = result(path, '源文件不存在')
+        elif new_path == path:
+            moved[path] = path
+            results[i] = result(path, new_path=path)
+        else:
+            try:
+                vfs.move_path(user_id, path, new_path)
+            except FileNotFoundError:
+                results[i] = result(path, '源文件不存在')
+            except FileExistsError:
+                results[i] = result(path, '目标位置已存在同名项目')
+            except ValueError as e:
+                results[i] = result(path, str(e))
+            else:
+                moved[path] = new_path
+                results[i] = result(path, new_path=new_path)
+    # 随上级文件夹一起移动的条目，结果跟着上级走
+    for i, path, top in covered:
+        new_top = moved.get(top)
+        if new_top:
+            results[i] = result(path, new_path=new_top + path[len(top):])
+        else:
+            results[i] = result(path, '所在文件夹移动失败')
+    return results, []
+
+def batch_rename(user_id, items, data):
+    results = []
+    for raw in items:
+        path = normalize_rel_path(raw.get('path')) if isinstance(raw, dict) else None
+        name = str(raw.get('name') or '').strip() if isinstance(raw, dict) else ''
+        if not path:
+            results.append(result(raw, '路径不合法'))
+            continue
+        if not name or '/' in name or name in ('.', '..'):
+            results.append(result(path, '名称不合法'))
+            continue
+        new_path = vfs.join_path(parent_of(path), name)
+        if new_path == path:
+            results.append(result(path, new_path=path))
+            continue
+        try:
+            vfs.move_path(user_id, path, new_path)
+        except FileNotFoundError:
+            results.append(result(path, '源不存在'))
+        except FileExistsError:
+            results.append(result(path, '名称已存在'))
+        else:
+            results.append(result(path, new_path=new_path))
+    return results, []
+
+OPERATIONS = {'delete': batch_delete, 'move': batch_move, 'rename': batch_rename}
+
+
+@batch_bp.route('', methods=['POST'])
+def run_batch():
+    user_id = session['user_id']
+    data = request.get_json(silent=True) or {}
+    operation = OPERATIONS.get(data.get('op'))
+    items = data.get('items')
+    if operation is None:
+        return error('不支持的操作', 400)
+    if not isinstance(items, list) or not items:
+        return error('没有选择条目', 400)
+    if len(items) > current_app.config.get('BATCH_MAX_ITEMS', 10000):
+        return error('选择的条目过多', 413)
+
+    begin_write()
+    try:
+        results, gone = operation(user_id, items, data)
+    except ValueError as e:
+        sqlite.session.rollback()
+        return error(str(e), 400)
+    sqlite.session.commit()
+
+    # 元数据已提交，再按批清理不再被引用的内容（purge 会在写事务里确认没有被重新引用）
+    batch = current_app.config.get('JOB_PURGE_BATCH', 500)
+    for i in range(0, len(gone), batch):
+        blobstore.purge(gone[i:i + batch])
+        sqlite.session.commit()
+
+    failed = sum(1 for r in results if not r['ok'])
+    return jsonify({'op': data['op'], 'results': results, 'succeeded': len(results) - failed, 'failed': failed})
+
+
+@batch_bp.route('/download', methods=['POST'])
+def download():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else request.form.getlist('items')
+    if not isinstance(items, list):
+        return error('没有选择条目', 400)
+    paths = [p for p in (normalize_rel_path(i) if isinstance(i, str) else None for i in items) if p]
+    if not paths:
+        return error('没有选择条目', 400)
+    if len(paths) > current_app.config.get('BATCH_MAX_ITEMS', 10000):
+        return error('选择的条目过多', 413)
+    user_id = session['user_id']
+    if not vfs.get_entries(user_id, paths):
+        return error('文件/文件夹不存在', 404)
+    if len(paths) == 1:
+        zip_name = paths[0].split('/')[-1] + '.zip'
+    else:
+        zip_name = (parent_of(min(paths, key=len)).split('/')[-1] or 'root') + '.zip'
+    return zip_response(vfs.iter_selection(user_id, paths), zip_name)
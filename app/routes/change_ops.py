@@ -0,0 +1,40 @@
+from flask import Blueprint, request, session, jsonify, current_app
+from .upload_ops import error
+from .. import journal
+
+# 变更订阅（桌面/移动端同步）：
+#   GET /api/changes/cursor                      当前游标；新客户端先全量列出，再从这里开始增量同步
+#   GET /api/changes?cursor=N[&limit=M][&wait=S] cursor 之后的变更（同一路径的多次修改已合并），
+#       has_more 为真时用返回的 cursor 继续取；带 wait 且暂时没有变更时最多等待 S 秒（长轮询）。
+#       cursor 早于已清理的日志时返回 410，需要重新全量列出
+changes_bp = Blueprint('changes', __name__, url_prefix='/api/changes')
+
+
+@changes_bp.before_request
+def check_login():
+    if 'user_id' not in session:
+        return error('未登录', 401)
+
+
+@changes_bp.route('/cursor')
+def get_cursor():
+    return jsonify({'cursor': journal.head()})
+
+
+@changes_bp.route('')
+def list_changes():
+    user_id = session['user_id']
+    config = current_app.config
+    cursor = request.args.get('cursor', type=int)
+    if cursor is None or cursor < 0:
+        return error('缺少游标', 400)
+    limit = request.args.get('limit', config.get('CHANGES_PAGE_SIZE', 500), type=int)
+    limit = max(1, min(limit, config.get('CHANGES_PAGE_MAX', 5000)))
+    wait = min(max(request.args.get('wait', 0, type=float), 0), config.get('CHANGES_WAIT_MAX', 60))
+
+    if journal.expired(user_id, cursor):
+        return error('游标已过期，请重新同步', 410)
+    if wait and not journal.wait_for(user_id, cursor, wait, config.get('CHANGES_POLL_INTERVAL', 1)):
+        return jsonify({'changes': [], 'cursor': cursor, 'has_more': False})
+    changes, next_cursor, more = journal.changes_since(user_id, cursor, limit)
+    return jsonify({'changes': changes, 'cursor': next_cursor, 'has_more': more})
@@ -1,40 +1,27 @@
 import os
-import shutil
-import zipfile
-import io
-from datetime import datetime
-from flask import Blueprint, render_template, request, redirect, session, url_for, send_file, abort
-from ..models import File, User
+from flask import Blueprint, render_template, request, redirect, session, url_for, abort, jsonify, make_response, \
+    current_app, send_file
+from ..models import File, parent_of
 from ..init_db import sqlite
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_ROOT = os.path.join(BASE_DIR, '../../uploads')  # 所有用户共享的根
-os.makedirs(UPLOAD_ROOT, exist_ok=True)
+from ..utils import normalize_rel_path, zip_response
+from ..serving import serve_blob
+from ..blobstore import QuotaExceeded
+from ..usage import remaining_quota
+from .. import blobstore, jobs, search, thumbnails, tree_cache, vfs
 
 files_bp = Blueprint('files', __name__, template_folder='../templates')
+files_bp.add_app_template_global(thumbnails.previewable, 'previewable')
 
-def get_user_folder(user_id):
-    """返回用户独立根目录"""
-    user_folder = os.path.join(UPLOAD_ROOT, str(user_id))
-    os.makedirs(user_folder, exist_ok=True)
-    return user_folder
-
-def get_folder_tree(base_path, current_rel="", level=0):
-    """递归获取文件夹树，用于前端移动操作的树状下拉列表"""
-    tree = []
-    full_path = os.path.join(base_path, current_rel)
-    if not os.path.exists(full_path):
-        return []
-    try:
-        dirs = [d for d in os.listdir(full_path) if os.path.isdir(os.path.join(full_path, d))]
-        for d in sorted(dirs):
-            rel_path = os.path.join(current_rel, d).replace("\\", "/")
-            display_name = "　" * level + "└─ " + d
-            tree.append({'path': rel_path, 'display': display_name})
-            tree.extend(get_folder_tree(base_path, rel_path, level + 1))
-    except PermissionError:
-        pass
-    return tree
+MULTIPART_OVERHEAD = 1024 * 1024  # 表单分隔符、字段等额外字节的余量
+
+def list_args():
+    """列目录的排序、翻页参数；游标不合法时抛 ValueError"""
+    sort = request.args.get('sort', 'name')
+    if sort not in vfs.SORT_COLUMNS:
+        raise ValueError('不支持的排序')
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    limit = request.args.get('limit', vfs.LIST_PAGE_SIZE, type=int)
+    return sort, order, request.args.get('cursor') or None, limit
 
 @files_bp.route('/')
 @files_bp.route('/<path:folder_path>')
@@ -43,65 +30,104 @@ def index(folder_path=''):
         return redirect(url_for('auth.login'))
 
     user_id = session['user_id']
-    user_folder = get_user_folder(user_id)
-    files_all = File.query.filter_by(user_id=user_id).all()
-
-    folders = set()
-    visible_files = []
     current_folder = folder_path.strip('/')
-    prefix = current_folder + '/' if current_folder else ''
-
-    for f in files_all:
-        if f.filename.startswith(prefix):
-            rest = f.filename[len(prefix):]
-            if not rest:
-                continue
-            if f.is_folder:
-                folder_name = rest.split('/')[0]
-                folders.add(folder_name)
-            else:
-                if '/' not in rest:
-                    full_path = os.path.join(user_folder, f.filename)
-                    f.mtime = datetime.fromtimestamp(os.path.getmtime(full_path)) if os.path.exists(full_path) else None
-                    f.size = os.path.getsize(full_path) if os.path.exists(full_path) else 0
-                    visible_files.append(f)
-
-    folder_tree = get_folder_tree(user_folder)
-
-    folder_infos = []
-    for folder in sorted(folders):
-        folder_rel = f"{current_folder}/{folder}" if current_folder else folder
-        folder_full = os.path.join(user_folder, folder_rel)
-        mtime = datetime.fromtimestamp(os.path.getmtime(folder_full)) if os.path.exists(folder_full) else None
-        folder_infos.append({'name': folder, 'mtime': mtime})
+
+    # 只取当前目录的一页直接子项，后面的页由前端滚动时按游标继续加载
+    try:
+        sort, order, cursor, limit = list_args()
+        entries, next_cursor = vfs.list_page(user_id, current_folder, sort, order, cursor, limit)
+    except ValueError:
+        abort(400)
+
+    if request.args.get('partial'):
+        response = make_response(render_template('file_rows.html', folder_path=current_folder, entries=entries))
+        response.headers['X-Next-Cursor'] = next_cursor or ''
+        return response
 
     return render_template(
         'index.html',
         username=session['username'],
         folder_path=current_folder,
-        folders=folder_infos,
-        files=visible_files,
-        folder_tree=folder_tree
+        entries=entries,
+        next_cursor=next_cursor,
+        sort=sort,
+        order=order
+    )
+
+@files_bp.route('/api/list')
+def list_folder():
+    """分页列目录：sort=name|size|mtime，order=asc|desc，cursor 为上一页的 next_cursor，fields 逗号分隔"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    user_id = session['user_id']
+    folder = request.args.get('path', '').strip('/')
+    if folder:
+        entry = vfs.get_entry(user_id, folder)
+        if not entry or not entry.is_folder:
+            return jsonify({'error': '文件夹不存在'}), 404
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f in vfs.LIST_FIELDS] if fields else vfs.LIST_FIELDS
+    try:
+        sort, order, cursor, limit = list_args()
+        entries, next_cursor = vfs.list_page(user_id, folder, sort, order, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': [vfs.describe(f, fields) for f in entries], 'next_cursor': next_cursor})
+
+@files_bp.route('/api/folders')
+def folder_children():
+    """移动对话框按需加载某个节点的子文件夹"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    parent = request.args.get('parent', '').strip('/')
+    return jsonify({'parent': parent, 'folders': tree_cache.folder_children(session['user_id'], parent)})
+
+@files_bp.route('/api/search')
+def search_files():
+    """按名称子串/扩展名搜索，cursor 为上一页返回的 next_cursor"""
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+    query = request.args.get('q', '').strip()
+    exts = [e for e in request.args.get('ext', '').split(',') if e.strip()]
+    if not query and not exts:
+        return jsonify({'error': '缺少搜索条件'}), 400
+    results, next_cursor = search.search(
+        session['user_id'], query, exts,
+        folder=request.args.get('path', '').strip('/'),
+        after=request.args.get('cursor', 0, type=int),
+        limit=request.args.get('limit', search.PAGE_SIZE, type=int),
     )
+    return jsonify({
+        'results': [{
+            'id': f.id,
+            'path': f.filename,
+            'name': f.filename.split('/')[-1],
+            'parent': f.parent,
+            'is_folder': f.is_folder,
+            'size': f.size or 0,
+            'mtime': f.mtime.isoformat(timespec='seconds') if f.mtime else None,
+        } for f in results],
+        'next_cursor': next_cursor,
+    })
 
 @files_bp.route('/create_folder', methods=['POST'])
 def create_folder():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
-    folder_name = request.form.get('folder_name').strip()
+    folder_name = request.form.get('folder_name', '').strip()
     folder_path = request.form.get('current_path', '').strip('/')
-    if not folder_name:
+    db_filename = normalize_rel_path(vfs.join_path(folder_path, folder_name))
+    if not folder_name or not db_filename:
         return redirect(url_for('files.index', folder_path=folder_path))
 
-    user_folder = get_user_folder(session['user_id'])
-    full_path = os.path.join(user_folder, folder_path, folder_name)
-    os.makedirs(full_path, exist_ok=True)
-
-    db_filename = f"{folder_path}/{folder_name}" if folder_path else folder_name
-    if not File.query.filter_by(filename=db_filename, user_id=session['user_id']).first():
-        file_record = File(filename=db_filename, user_id=session['user_id'], is_folder=True)
-        sqlite.session.add(file_record)
-        sqlite.session.commit()
+    existing = vfs.get_entry(session['user_id'], db_filename)
+    if existing and not existing.is_folder:
+        return "<script>alert('已存在同名文件');window.history.back();</script>"
+    try:
+        vfs.ensure_folders(session['user_id'], db_filename)
+    except NotADirectoryError:
+        return "<script>alert('上级路径是文件，不能在其中新建文件夹');window.history.back();</script>"
+    sqlite.session.commit()
     return redirect(url_for('files.index', folder_path=folder_path))
 
 @files_bp.route('/upload', methods=['POST'])
@@ -109,39 +135,58 @@ def upload():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
 
+    user_id = session['user_id']
+    # 前端批量上传小文件时要 JSON 结果，普通表单提交仍然跳转回目录页
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    quota_error = (jsonify({'error': '空间不足'}), 413) if wants_json else \
+        ("<script>alert('空间不足，上传已取消');window.history.back();</script>", 413)
+
+    # 读取请求体之前先按 Content-Length 检查配额，并让表单解析在超限时立即中断
+    remaining = remaining_quota(user_id)
+    if remaining is not None:
+        limit = max(remaining, 0) + MULTIPART_OVERHEAD
+        if request.content_length is not None and request.content_length > limit:
+            return quota_error
+        request.max_content_length = limit
+
     files = request.files.getlist('files')
     folder_path = request.form.get('current_path', '').strip('/')
-    user_id = session['user_id']
-    user_folder = get_user_folder(user_id)
 
+    targets = []
     for file in files:
         if not file.filename:
             continue
-        # 这里确保获取正确属性名
-        rel_path = getattr(file, 'webkitRelativePath', file.filename) or file.filename
-        rel_path = rel_path.replace("\\", "/")  # 统一分隔符
-
-        save_path = os.path.join(user_folder, folder_path, rel_path)
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        file.save(save_path)
-
-        db_filename = f"{folder_path}/{rel_path}" if folder_path else rel_path
-        db_filename = db_filename.replace("\\", "/")  # 数据库存相对路径统一
-
-        existing = File.query.filter_by(filename=db_filename, user_id=user_id).first()
-        if existing:
-            existing.size = os.path.getsize(save_path)
-        else:
-            parts = db_filename.split('/')
-            for i in range(len(parts)-1):
-                folder_db_name = '/'.join(parts[:i+1])
-                if not File.query.filter_by(filename=folder_db_name, user_id=user_id).first():
-                    folder_record = File(filename=folder_db_name, user_id=user_id, is_folder=True)
-                    sqlite.session.add(folder_record)
-            file_record = File(filename=db_filename, user_id=user_id, size=os.path.getsize(save_path), is_folder=False)
-            sqlite.session.add(file_record)
-
+        # 文件夹上传时浏览器会把相对路径放在 filename 里
+        db_filename = normalize_rel_path(vfs.join_path(folder_path, file.filename))
+        if db_filename:
+            targets.append((file, db_filename))
+
+    # 同名条目一次查出，不再逐个文件查询
+    existing = vfs.get_entries(user_id, [name for _, name in targets])
+    staged = []
+    try:
+        for file, db_filename in targets:
+            entry = existing.get(db_filename)
+            if entry and entry.is_folder:
+                continue  # 不能用文件覆盖同名文件夹
+            # 覆盖同名文件时旧文件占用的空间可以抵扣
+            budget = None if remaining is None else remaining + (entry.size if entry else 0)
+            path, blob_hash, size = blobstore.stage_stream(file.stream, budget)
+            staged.append((path, blob_hash, size, db_filename))
+            if remaining is not None:
+                remaining = budget - size
+    except QuotaExceeded:
+        for path, *_ in staged:
+            os.remove(path)
+        return quota_error
+
+    # 整批文件入库、登记，一次提交
+    blobstore.ingest_many([(path, blob_hash, size) for path, blob_hash, size, _ in staged])
+    saved = vfs.put_files(user_id, [(name, blob_hash, size) for _, blob_hash, size, name in staged])
     sqlite.session.commit()
+
+    if wants_json:
+        return jsonify({'uploaded': len(saved)})
     return redirect(url_for('files.index', folder_path=folder_path))
 
 
@@ -149,35 +194,52 @@ def upload():
 def download(file_id):
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
-    f = File.query.get(file_id)
-    if not f or f.user_id != session['user_id']:
+    f = sqlite.session.get(File, file_id)
+    if not f or f.user_id != session['user_id'] or not f.blob_hash:
         abort(404)
-    user_folder = get_user_folder(f.user_id)
-    file_path = os.path.join(user_folder, f.filename)
-    if not os.path.exists(file_path):
+    return serve_blob(f)
+
+@files_bp.route('/thumb/<int:file_id>')
+def thumbnail(file_id):
+    if 'user_id' not in session:
+        return redirect(url_for('auth.login'))
+    f = sqlite.session.get(File, file_id)
+    if not f or f.user_id != session['user_id'] or not f.blob_hash:
         abort(404)
-    return send_file(file_path, as_attachment=True)
+    kind = thumbnails.previewable(f.filename)
+    if not kind:
+        abort(404)
+    size = thumbnails.snap_size(request.args.get('size', 128, type=int))
+    path = thumbnails.get_thumbnail(f.blob_hash, kind, size)
+    if not path:
+        abort(404)
+    # 地址里的 v 是内容哈希，文件被覆盖后地址随之改变，缓存可以一直有效
+    response = send_file(path, mimetype='image/jpeg', etag=f'{f.blob_hash}-{size}',
+                         max_age=current_app.config.get('THUMB_MAX_AGE', 86400))
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 @files_bp.route('/download_folder')
 def download_folder():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
     folder_path = request.args.get('folder_path', '').strip('/')
-    user_folder = get_user_folder(session['user_id'])
-    abs_folder_path = os.path.join(user_folder, folder_path)
-    if not os.path.exists(abs_folder_path):
-        return f"<script>alert('文件夹不存在！');window.history.back();</script>"
-
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for root, _, filenames in os.walk(abs_folder_path):
-            for filename in filenames:
-                abs_file = os.path.join(root, filename)
-                rel_path = os.path.relpath(abs_file, abs_folder_path)
-                zf.write(abs_file, arcname=rel_path)
-    memory_file.seek(0)
+    user_id = session['user_id']
+    folder = None
+    if folder_path:
+        folder = vfs.get_entry(user_id, folder_path)
+        if not folder or not folder.is_folder:
+            return f"<script>alert('文件夹不存在！');window.history.back();</script>"
+
+    # 大文件夹改为后台打包，打好后再下载，避免长时间占用 worker
+    job_id = jobs.zip_job_for(user_id, folder_path, folder)
+    if job_id:
+        return render_template('job_wait.html', job_id=job_id, folder_path=folder_path, parent_of=parent_of)
+
     zip_name = (folder_path.split('/')[-1] or "root") + ".zip"
-    return send_file(memory_file, as_attachment=True, download_name=zip_name)
+    return zip_response(vfs.iter_blobs_paged(user_id, folder_path), zip_name)
 
 @files_bp.route('/delete/<file_id>', methods=['POST'])
 def delete(file_id):
@@ -185,32 +247,21 @@ def delete(file_id):
         return redirect(url_for('auth.login'))
     current_path = request.form.get('current_path', '').strip('/')
     user_id = session['user_id']
-    user_folder = get_user_folder(user_id)
 
     if str(file_id).endswith('_folder'):
-        folder_name = request.form.get('folder_name')
-        rel_folder_path = f"{current_path}/{folder_name}" if current_path else folder_name
-        full_folder_path = os.path.join(user_folder, rel_folder_path)
-
-        if os.path.exists(full_folder_path):
-            shutil.rmtree(full_folder_path)
-
-        prefix = rel_folder_path + '/'
-        affected = File.query.filter(
-            File.user_id == user_id,
-            (File.filename == rel_folder_path) | (File.filename.startswith(prefix))
-        ).all()
-        for a in affected:
-            sqlite.session.delete(a)
+        # 整个文件夹放到后台删除，页面上的任务进度条会在完成后刷新目录
+        # 名称为空时拼出的是当前目录（根目录下就是整个用户目录），必须拒绝
+        folder_name = request.form.get('folder_name', '').strip()
+        target = normalize_rel_path(vfs.join_path(current_path, folder_name))
+        if not folder_name or '/' in folder_name or not target:
+            return "<script>alert('文件夹名称不合法');window.history.back();</script>"
+        jobs.enqueue(user_id, 'delete', path=target)
     else:
         f = File.query.get(file_id)
         if f and f.user_id == user_id:
-            path = os.path.join(user_folder, f.filename)
-            if os.path.exists(path):
-                os.remove(path)
-            sqlite.session.delete(f)
+            vfs.delete_path(user_id, f.filename)
+        sqlite.session.commit()
 
-    sqlite.session.commit()
     return redirect(url_for('files.index', folder_path=current_path))
 
 @files_bp.route('/rename', methods=['POST'])
@@ -219,39 +270,21 @@ def rename():
         return redirect(url_for('auth.login'))
 
     old_name = request.form.get('old_name')
-    new_name = request.form.get('new_name')
+    new_name = request.form.get('new_name', '').strip()
     current_path = request.form.get('current_path', '').strip('/')
-    is_folder = request.form.get('is_folder') == '1'
     user_id = session['user_id']
-    user_folder = get_user_folder(user_id)
-
-    old_rel = f"{current_path}/{old_name}" if current_path else old_name
-    new_rel = f"{current_path}/{new_name}" if current_path else new_name
 
-    old_full = os.path.join(user_folder, old_rel)
-    new_full = os.path.join(user_folder, new_rel)
+    if not new_name or '/' in new_name or new_name in ('.', '..'):
+        return "<script>alert('名称不合法');window.history.back();</script>"
+    old_rel = vfs.join_path(current_path, old_name)
+    new_rel = vfs.join_path(current_path, new_name)
 
-    if not os.path.exists(old_full):
+    try:
+        vfs.move_path(user_id, old_rel, new_rel)
+    except FileNotFoundError:
         return "<script>alert('源不存在');window.history.back();</script>"
-    if os.path.exists(new_full):
+    except FileExistsError:
         return "<script>alert('名称已存在');window.history.back();</script>"
-
-    try:
-        os.rename(old_full, new_full)
-        now = datetime.now().timestamp()
-        if is_folder:
-            for root, dirs, files in os.walk(new_full):
-                os.utime(root, (now, now))
-                for f in files:
-                    os.utime(os.path.join(root, f), (now, now))
-        else:
-            os.utime(new_full, (now, now))
-    except Exception as e:
-        return f"<script>alert('重命名失败: {str(e)}');window.history.back();</script>"
-
-    affected = File.query.filter(File.user_id == user_id, File.filename.startswith(old_rel)).all()
-    for f in affected:
-        f.filename = f.filename.replace(old_rel, new_rel, 1)
     sqlite.session.commit()
 
     return redirect(url_for('files.index', folder_path=current_path))
@@ -261,39 +294,32 @@ def move():
     if 'user_id' not in session:
         return redirect(url_for('auth.login'))
     item_name = request.form.get('item_name')
-    is_folder = request.form.get('is_folder') == '1'
     current_path = request.form.get('current_path', '').strip('/')
     target_folder = request.form.get('target_folder', '').strip('/')
     user_id = session['user_id']
-    user_folder = get_user_folder(user_id)
-
-    old_rel = f"{current_path}/{item_name}" if current_path else item_name
-    new_rel = f"{target_folder}/{item_name}" if target_folder else item_name
 
-    old_full = os.path.join(user_folder, old_rel)
-    new_full = os.path.join(user_folder, new_rel)
+    old_rel = vfs.join_path(current_path, item_name)
+    new_rel = vfs.join_path(target_folder, item_name)
 
-    if not os.path.exists(old_full):
+    if new_rel == old_rel or new_rel.startswith(old_rel + '/'):
+        return f"<script>alert('不能移动到自身或其子文件夹！');window.history.back();</script>"
+    source = vfs.get_entry(user_id, old_rel)
+    if not source:
         return f"<script>alert('源文件不存在！');window.history.back();</script>"
-    if os.path.exists(new_full):
+    if vfs.get_entry(user_id, new_rel):
         return f"<script>alert('目标位置已存在同名项目！');window.history.back();</script>"
-
+    if target_folder and vfs.file_ancestor(user_id, new_rel):
+        return f"<script>alert('目标不是文件夹！');window.history.back();</script>"
+    if source.is_folder:
+        # 文件夹要改写整棵子树，放到后台执行
+        jobs.enqueue(user_id, 'move', src=old_rel, dst=new_rel)
+        return redirect(url_for('files.index', folder_path=current_path))
     try:
-        shutil.move(old_full, new_full)
-        now = datetime.now().timestamp()
-        if is_folder:
-            for root, dirs, files in os.walk(new_full):
-                os.utime(root, (now, now))
-                for f in files:
-                    os.utime(os.path.join(root, f), (now, now))
-        else:
-            os.utime(new_full, (now, now))
-    except Exception as e:
-        return f"<script>alert('移动失败: {str(e)}');window.history.back();</script>"
-
-    affected = File.query.filter(File.user_id == user_id, File.filename.startswith(old_rel)).all()
-    for f in affected:
-        f.filename = f.filename.replace(old_rel, new_rel, 1)
+        vfs.move_path(user_id, old_rel, new_rel)
+    except FileNotFoundError:
+        return f"<script>alert('源文件不存在！');window.history.back();</script>"
+    except FileExistsError:
+        return f"<script>alert('目标位置已存在同名项目！');window.history.back();</script>"
     sqlite.session.commit()
 
     return redirect(url_for('files.index', folder_path=current_path))
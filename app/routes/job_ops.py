@@ -0,0 +1,71 @@
+from flask import Blueprint, request, session, current_app, jsonify, redirect, Response
+from ..models import Job
+from ..init_db import sqlite
+from ..serving import offload_header
+from ..storage import get_storage
+from ..utils import content_disposition
+from .. import jobs, metrics
+
+# 后台任务查询：
+#   GET /api/jobs                 当前用户最近的任务，active=1 只看未结束的
+#   GET /api/jobs/<id>            单个任务的状态和进度
+#   GET /api/jobs/<id>/download   下载打包任务的结果
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+RECENT_JOBS = 20
+
+
+@jobs_bp.before_request
+def check_login():
+    if 'user_id' not in session:
+        return jsonify({'error': '未登录'}), 401
+
+def get_visible_job(job_id):
+    """自己的任务，管理员可以看所有任务"""
+    job = sqlite.session.get(Job, job_id)
+    if not job or (job.user_id != session['user_id'] and not session.get('is_admin')):
+        return None
+    return job
+
+@jobs_bp.route('')
+def list_jobs():
+    rows = Job.query.filter_by(user_id=session['user_id'])
+    if request.args.get('active'):
+        rows = rows.filter(Job.status.in_(('queued', 'running')))
+    rows = rows.order_by(Job.created_at.desc()).limit(RECENT_JOBS)
+    return jsonify({'jobs': [jobs.describe(j) for j in rows]})
+
+@jobs_bp.route('/<job_id>')
+def job_status(job_id):
+    job = get_visible_job(job_id)
+    if not job:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(jobs.describe(job))
+
+@jobs_bp.route('/<job_id>/download')
+def job_download(job_id):
+    job = get_visible_job(job_id)
+    if not job or job.kind != 'zip':
+        return jsonify({'error': '任务不存在'}), 404
+    if job.status != 'done':
+        return jsonify({'error': '打包尚未完成'}), 409
+
+    result = jobs.describe(job)['result']
+    storage = get_storage()
+    key, name = result['key'], result['name']
+    url = storage.url_for(key, name, 'application/zip')
+    if url:
+        return redirect(url)
+    size = storage.stat(key)
+    if size is None:
+        return jsonify({'error': '打包结果已过期'}), 410
+
+    metrics.DOWNLOADS.inc(kind='zip')
+    metrics.DOWNLOAD_BYTES.inc(size, kind='zip')
+    headers = {'Content-Disposition': content_disposition(name)}
+    offload = offload_header(storage, key, current_app.config)
+    if offload:
+        headers[offload[0]] = offload[1]
+        return Response(headers=headers, mimetype='application/zip')
+    headers['Content-Length'] = str(size)
+    return Response(storage.read(key), headers=headers, mimetype='application/zip', direct_passthrough=True)
@@ -0,0 +1,19 @@
+import hmac
+from flask import Blueprint, Response, current_app, request, session, abort
+from .. import metrics
+
+# Prometheus 抓取地址。只允许管理员会话和携带 METRICS_TOKEN 的请求；
+# 不按来源地址放行——部署在反向代理后面时所有请求都来自本机。
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def export():
+    token = current_app.config.get('METRICS_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    allowed = session.get('is_admin') or (token and hmac.compare_digest(auth, f'Bearer {token}'))
+    if not allowed:
+        abort(403)
+    ttl = current_app.config.get('METRICS_INVENTORY_TTL', 30)
+    metrics.inventory(ttl)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
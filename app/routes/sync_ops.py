@@ -0,0 +1,85 @@
+import os
+from flask import Blueprint, request, session, jsonify
+from ..init_db import sqlite, begin_write
+from ..delta import PatchError
+from .upload_ops import error, file_info, fits_quota
+from .. import blobstore, delta, vfs
+
+# 增量同步（修改过的大文件只传变化的部分）：
+#   GET  /api/sync/signature?path=P[&block_size=N]   旧版本的块签名和版本哈希
+#   POST /api/sync/patch?path=P&base=H&block_size=N&size=S[&sha256=X]
+#        请求体为补丁指令流（格式见 app/delta.py），服务器拼出新版本后整体替换；
+#        base 与当前版本不一致时返回 409，客户端重新取签名即可
+sync_bp = Blueprint('sync', __name__, url_prefix='/api/sync')
+
+
+@sync_bp.before_request
+def check_login():
+    if 'user_id' not in session:
+        return error('未登录', 401)
+
+def get_file(user_id, path):
+    entry = vfs.get_entry(user_id, (path or '').strip('/'))
+    if not entry or entry.is_folder or not entry.blob_hash:
+        return None
+    return entry
+
+
+@sync_bp.route('/signature')
+def get_signature():
+    entry = get_file(session['user_id'], request.args.get('path'))
+    if not entry:
+        return error('文件不存在', 404)
+    block_size = delta.block_size_for(request.args.get('block_size', type=int))
+    blocks = delta.signature(entry.blob_hash, block_size)
+    return jsonify({
+        'path': entry.filename,
+        'size': entry.size,
+        'base': entry.blob_hash,
+        'block_size': block_size,
+        'blocks': [[weak, strong.hex()] for weak, strong in blocks],
+    })
+
+
+@sync_bp.route('/patch', methods=['POST'])
+def apply_patch():
+    user_id = session['user_id']
+    entry = get_file(user_id, request.args.get('path'))
+    if not entry:
+        return error('文件不存在', 404)
+    base = request.args.get('base', '')
+    block_size = request.args.get('block_size', type=int)
+    size = request.args.get('size', type=int)
+    expected = (request.args.get('sha256') or '').lower()
+    if block_size is None or block_size != delta.block_size_for(block_size):
+        return error('块大小不合法', 400)
+    if size is None or size < 0:
+        return error('缺少文件大小', 400)
+    if base != entry.blob_hash:
+        return error('文件已被修改，请重新获取签名', 409)
+    if not fits_quota(user_id, size, entry):
+        return error('空间不足', 413)
+
+    try:
+        staged, blob_hash, size, copied, literal = \
+            delta.apply_patch(request.stream, base, entry.size, block_size, size)
+    except PatchError as e:
+        return error(str(e), 400)
+    if expected and expected != blob_hash:
+        os.remove(staged)
+        return error('结果校验失败', 400)
+
+    # 在写事务里确认旧版本没有被并发修改，再一次性换上新版本；落盘压缩放在拿写锁之前
+    path = entry.filename
+    encoded = blobstore.compress_staged([(staged, blob_hash, size)])
+    begin_write()
+    sqlite.session.expire_all()
+    current = vfs.get_entry(user_id, path)
+    if not current or current.blob_hash != base:
+        sqlite.session.rollback()
+        os.remove(staged)
+        return error('文件已被修改，请重新获取签名', 409)
+    blobstore.ingest(staged, blob_hash, size, encoded)
+    f = vfs.put_file(user_id, path, blob_hash, size)
+    sqlite.session.commit()
+    return jsonify(dict(file_info(f), copied=copied, uploaded=literal))
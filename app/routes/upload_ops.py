@@ -0,0 +1,190 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+from flask import Blueprint, request, session, current_app, jsonify
+from ..models import UploadSession, UploadChunk
+from ..init_db import sqlite
+from ..utils import normalize_rel_path, merge_ranges
+from ..usage import remaining_quota
+from .. import blobstore, vfs
+
+# 分片上传协议：
+#   POST /api/upload                 初始化，返回会话 id 和建议分片大小；
+#                                    带上 sha256 且本人已有该内容时直接秒传
+#   PUT  /api/upload/<id>?offset=N   写入一个分片（请求体即分片内容，可并发）
+#   GET  /api/upload/<id>            查询已收到的区间，用于断点续传
+#   POST /api/upload/<id>/complete   全部到齐后落盘并登记
+upload_bp = Blueprint('upload', __name__, url_prefix='/api/upload')
+
+STREAM_BLOCK = 1024 * 1024
+
+
+def error(msg, status):
+    return jsonify({'error': msg}), status
+
+def partial_path(upload_id):
+    return blobstore.staging_path(upload_id + '.part')
+
+def file_info(f):
+    return {'id': f.id, 'path': f.filename, 'size': f.size}
+
+def received_ranges(upload_id):
+    chunks = UploadChunk.query.filter_by(session_id=upload_id).all()
+    return merge_ranges((c.offset, c.offset + c.length) for c in chunks)
+
+def get_own_session(upload_id):
+    up = sqlite.session.get(UploadSession, upload_id)
+    if not up or up.user_id != session['user_id']:
+        return None
+    return up
+
+def discard(up):
+    """删除会话、分片记录和暂存文件（不提交）"""
+    UploadChunk.query.filter_by(session_id=up.id).delete()
+    sqlite.session.delete(up)
+    try:
+        os.remove(partial_path(up.id))
+    except FileNotFoundError:
+        pass
+
+def fits_quota(user_id, size, existing, exclude_upload=None):
+    """新文件（覆盖时扣除旧文件大小）是否放得下；进行中的上传已预占各自的大小"""
+    remaining = remaining_quota(user_id, exclude_upload)
+    if remaining is None:
+        return True
+    return size - (existing.size if existing else 0) <= remaining
+
+def purge_expired(user_id):
+    """清理该用户过期未完成的上传"""
+    deadline = datetime.utcnow() - timedelta(seconds=current_app.config['UPLOAD_SESSION_TTL'])
+    for up in UploadSession.query.filter(UploadSession.user_id == user_id,
+                                         UploadSession.created_at < deadline).all():
+        discard(up)
+
+
+@upload_bp.before_request
+def check_login():
+    if 'user_id' not in session:
+        return error('未登录', 401)
+
+
+@upload_bp.route('', methods=['POST'])
+def init_upload():
+    data = request.get_json(silent=True) or {}
+    current_path = (data.get('current_path') or '').strip('/')
+    rel_path = normalize_rel_path(f"{current_path}/{data.get('path', '')}")
+    size = data.get('size')
+    if not rel_path:
+        return error('路径不合法', 400)
+    if not isinstance(size, int) or size < 0:
+        return error('缺少文件大小', 400)
+
+    user_id = session['user_id']
+    purge_expired(user_id)
+    existing = vfs.get_entry(user_id, rel_path)
+    if existing and existing.is_folder:
+        return error('已存在同名文件夹', 409)
+    if not existing and vfs.file_ancestor(user_id, rel_path):
+        return error('上级路径是文件', 409)
+    if not fits_quota(user_id, size, existing):
+        return error('空间不足', 413)
+
+    # 秒传：内容已在库里就只登记元数据，不用再传字节。哈希由客户端提供，不能证明对方真的
+    # 持有内容，所以只在本人已有文件引用该 blob 时秒传，否则照常上传（入库时仍会去重）
+    sha256 = (data.get('sha256') or '').lower()
+    if sha256 and vfs.owns_blob(user_id, sha256) and blobstore.find_blob(sha256, size) \
+            and blobstore.add_ref(sha256):
+        f = vfs.put_file(user_id, rel_path, sha256, size)
+        sqlite.session.commit()
+        return jsonify(dict(file_info(f), instant=True))
+
+    up = UploadSession(id=uuid.uuid4().hex, user_id=user_id, filename=rel_path, size=size)
+    # 预先占好目标大小，各分片按偏移直接写入，不需要事后拼接
+    with open(partial_path(up.id), 'wb') as fp:
+        fp.truncate(size)
+    sqlite.session.add(up)
+    sqlite.session.commit()
+    return jsonify({'id': up.id, 'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE']}), 201
+
+
+@upload_bp.route('/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    up = get_own_session(upload_id)
+    if not up:
+        return error('上传会话不存在', 404)
+    ranges = received_ranges(up.id)
+    received = sum(end - start for start, end in ranges)
+    return jsonify({'id': up.id, 'path': up.filename, 'size': up.size,
+                    'received': ranges, 'complete': received == up.size})
+
+
+@upload_bp.route('/<upload_id>', methods=['PUT'])
+def put_chunk(upload_id):
+    up = get_own_session(upload_id)
+    if not up:
+        return error('上传会话不存在', 404)
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or offset < 0:
+        return error('缺少 offset', 400)
+    if length is None:
+        return error('缺少 Content-Length', 411)
+    if length > current_app.config['UPLOAD_CHUNK_MAX']:
+        return error('分片过大', 413)
+    if offset + length > up.size:
+        return error('分片超出文件范围', 416)
+
+    # 直接从请求流写到目标偏移，每次只占用一个读块的内存
+    written = 0
+    with open(partial_path(up.id), 'r+b') as fp:
+        fp.seek(offset)
+        while written < length:
+            block = request.stream.read(min(STREAM_BLOCK, length - written))
+            if not block:
+                break
+            fp.write(block)
+            written += len(block)
+    if written != length:
+        return error('分片不完整，请重传', 400)
+
+    sqlite.session.add(UploadChunk(session_id=up.id, offset=offset, length=length))
+    sqlite.session.commit()
+    return '', 204
+
+
+@upload_bp.route('/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    up = get_own_session(upload_id)
+    if not up:
+        return error('上传会话不存在', 404)
+    discard(up)
+    sqlite.session.commit()
+    return '', 204
+
+
+@upload_bp.route('/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    up = get_own_session(upload_id)
+    if not up:
+        return error('上传会话不存在', 404)
+    ranges = received_ranges(up.id)
+    if up.size and ranges != [[0, up.size]]:
+        return error('还有分片未上传', 409)
+
+    existing = vfs.get_entry(up.user_id, up.filename)
+    if existing and existing.is_folder:
+        return error('已存在同名文件夹', 409)
+    if not existing and vfs.file_ancestor(up.user_id, up.filename):
+        return error('上级路径是文件', 409)
+    if not fits_quota(up.user_id, up.size, existing, exclude_upload=up.id):
+        return error('空间不足', 413)
+
+    # 分片可能乱序到达，只能在最后整体计算一次哈希
+    staged = partial_path(up.id)
+    blob_hash, size = blobstore.hash_file(staged)
+    blobstore.ingest(staged, blob_hash, size)
+    f = vfs.put_file(up.user_id, up.filename, blob_hash, size)
+    UploadChunk.query.filter_by(session_id=up.id).delete()
+    sqlite.session.delete(up)
+    sqlite.session.commit()
+    return jsonify(file_info(f))
@@ -0,0 +1,98 @@
+import sqlite3
+from sqlalchemy import column, func, or_, text
+from .init_db import sqlite
+from .models import File
+from . import vfs
+
+# 文件名搜索：file_search 是 FTS5 trigram 索引，rowid 即 file.id，只索引文件名最后一段。
+# 由 file 表上的触发器同步，上传、删除、重命名、移动都不需要改业务代码；
+# 子树移动时只有名称真正变化的那一行会更新索引。
+# 关键词按空白拆分，至少 3 个字符的词走索引，更短的词只能逐行 LIKE。
+MIN_TERM = 3
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# 路径最后一段：rtrim 去掉末尾的非 '/' 字符得到目录前缀，再截掉前缀
+_BASENAME = "substr({0}.filename, length(rtrim({0}.filename, replace({0}.filename, '/', ''))) + 1)"
+
+INDEX_DDL = [
+    "CREATE VIRTUAL TABLE file_search USING fts5(name, tokenize='trigram')",
+    f"""CREATE TRIGGER file_search_ai AFTER INSERT ON file BEGIN
+        INSERT INTO file_search(rowid, name) VALUES (new.id, {_BASENAME.format('new')});
+    END""",
+    """CREATE TRIGGER file_search_ad AFTER DELETE ON file BEGIN
+        DELETE FROM file_search WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER file_search_au AFTER UPDATE OF filename ON file
+        WHEN {_BASENAME.format('old')} != {_BASENAME.format('new')} BEGIN
+        UPDATE file_search SET name = {_BASENAME.format('new')} WHERE rowid = new.id;
+    END""",
+    f"INSERT INTO file_search(rowid, name) SELECT id, {_BASENAME.format('file')} FROM file",
+]
+
+
+def trigram_supported():
+    """当前 SQLite 是否带 FTS5 且支持 trigram 分词器（3.34+）"""
+    try:
+        sqlite3.connect(':memory:').execute("CREATE VIRTUAL TABLE t USING fts5(x, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+def install_index(conn):
+    """建立搜索索引和同步触发器并导入已有数据；不支持时搜索退化为逐行 LIKE"""
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'file_search'")).first()
+    if exists or not trigram_supported():
+        return
+    for ddl in INDEX_DDL:
+        conn.execute(text(ddl))
+
+def has_index():
+    return sqlite.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'file_search'")).first() is not None
+
+def _escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def _basename():
+    return func.substr(File.filename, func.length(func.rtrim(File.filename, func.replace(File.filename, '/', ''))) + 1)
+
+
+def search(user_id, query='', exts=(), folder='', after=0, limit=PAGE_SIZE):
+    """按名称子串和扩展名搜索，返回 (结果, 下一页游标)；结果按 id 排序，游标为上一页最后一个 id
+
+    query 中的多个词需同时出现在名称里；exts 为不带点的扩展名，满足其一即可；
+    folder 非空时只在该文件夹的子树里搜索。
+    """
+    terms = query.split()
+    suffixes = ['.' + e.lower().strip('.') for e in exts if e.strip('.')]
+    rows = File.query.filter(File.user_id == user_id, File.id > after)
+    if folder:
+        rows = rows.filter(vfs.subtree_clause(user_id, folder), File.filename != folder)
+
+    indexed = has_index()
+    if indexed:
+        # 能走索引的条件拼成一个 MATCH：长关键词之间 AND，扩展名之间 OR
+        match = [_phrase(t) for t in terms if len(t) >= MIN_TERM]
+        if suffixes and all(len(e) >= MIN_TERM for e in suffixes):
+            match.append('(' + ' OR '.join(_phrase(e) for e in suffixes) + ')')
+        if match:
+            ids = text("SELECT rowid FROM file_search WHERE file_search MATCH :match") \
+                .bindparams(match=' AND '.join(match)).columns(column('rowid'))
+            rows = rows.filter(File.id.in_(ids))
+
+    # 短关键词没有索引可用，只能在已缩小的范围内逐行匹配名称
+    name = _basename()
+    for term in terms:
+        if not indexed or len(term) < MIN_TERM:
+            rows = rows.filter(name.ilike('%' + _escape(term) + '%', escape='\\'))
+    # 索引只能确认子串出现过，扩展名还要在结尾
+    if suffixes:
+        rows = rows.filter(or_(*(File.filename.ilike('%' + _escape(e), escape='\\') for e in suffixes)))
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    found = rows.order_by(File.id).limit(limit + 1).all()
+    next_cursor = found[limit - 1].id if len(found) > limit else None
+    return found[:limit], next_cursor
@@ -0,0 +1,176 @@
+import uuid
+import mimetypes
+from datetime import datetime, timezone
+from flask import request, Response, abort, current_app
+from werkzeug.wsgi import wrap_file
+from werkzeug.http import http_date, is_resource_modified, parse_range_header, parse_if_range_header
+from .utils import content_disposition
+from .storage import get_storage
+from . import blobstore, compression, metrics
+
+# 文件下载：ETag 直接用内容哈希，Last-Modified 用 File.mtime，
+# 支持 304 协商缓存、单段/多段 Range 以及 If-Range 断点续传。
+# 存储后端能给出直接下载地址（S3 预签名 URL）时重定向过去，Range 由存储服务处理；
+# 配置了 DOWNLOAD_OFFLOAD 时本地文件交给前端代理发送，否则尽量走 wsgi.file_wrapper（sendfile）。
+# 落盘压缩过的内容：客户端接受 gzip 且不是 Range 请求时原样发送（Content-Encoding: gzip），
+# 否则边解压边发送；这类内容不重定向、不交给代理，存储里的字节和原始内容不一致。
+MAX_RANGES = 16  # 多段请求超过该数量时忽略 Range，按整文件返回
+
+
+def resolve_ranges(environ, size):
+    """把请求的 Range 换算成 [start, end) 列表；None 表示按整文件返回，[] 表示无法满足"""
+    rng = parse_range_header(environ.get('HTTP_RANGE'))
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) > MAX_RANGES:
+        return None
+    resolved = []
+    for start, stop in rng.ranges:
+        if start < 0:  # 后缀区间 bytes=-N
+            start, stop = max(size + start, 0), size
+        stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+def if_range_matches(environ, etag, last_modified):
+    """If-Range 与当前版本一致时才按 Range 返回部分内容
+
+    按 RFC 9110 §13.1.5 只接受强校验：弱 ETag 一律不匹配，日期必须与 Last-Modified 完全相同（精确到秒）。
+    """
+    value = environ.get('HTTP_IF_RANGE')
+    if value and value.strip().startswith('W/'):
+        return False
+    if_range = parse_if_range_header(value)
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return last_modified == if_range.date.replace(microsecond=0)
+    return True
+
+def offload_header(storage, key, config):
+    """DOWNLOAD_OFFLOAD 对应的 (响应头, 值)，未开启或不是本地存储时返回 None
+
+    x-accel：nginx 的 X-Accel-Redirect，值为 DOWNLOAD_OFFLOAD_PREFIX + key，需要配置 internal location；
+    x-sendfile：Apache mod_xsendfile / lighttpd 的 X-Sendfile，值为 blob 的绝对路径。
+    """
+    mode = config.get('DOWNLOAD_OFFLOAD')
+    path = storage.local_path(key)
+    if not mode or not path:
+        return None
+    if mode == 'x-accel':
+        return 'X-Accel-Redirect', config.get('DOWNLOAD_OFFLOAD_PREFIX', '/_blobs/') + key
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', path
+    raise ValueError(f'未知的 DOWNLOAD_OFFLOAD: {mode}')
+
+def plan_blob(entry, environ, storage, offload=None):
+    """算出下载响应的 (状态码, 响应头, 存储 key, 分段, 结尾, 编码)，与 Web 框架无关
+
+    分段为 [(段前缀, start, end)]，依次输出前缀和 [start, end) 区间的内容，最后输出结尾；
+    没有响应体（304/416/重定向/404/交给代理发送）时分段为 None。编码不为 None 时
+    区间是解码后的偏移，要用 compression.read_blob 读取，不能直接发送存储里的文件。
+    offload 为 offload_header() 的结果，此时 Range 由代理按原始请求处理。
+    """
+    key = blobstore.blob_key(entry.blob_hash)
+    size = entry.size
+    name = entry.filename.split('/')[-1]
+    codec = blobstore.blob_codec(entry.blob_hash)
+    # 原样发送压缩内容是另一种表示，ETag 要区分开
+    encoded = codec == compression.GZIP and compression.accepts_gzip(environ) and not environ.get('HTTP_RANGE')
+    etag = entry.blob_hash + '-gzip' if encoded else entry.blob_hash
+    # mtime 按本地时间存库，换成 UTC 且精确到秒，与 HTTP 日期比较
+    last_modified = datetime.fromtimestamp(int((entry.mtime or datetime.now()).timestamp()), timezone.utc)
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': content_disposition(name),
+    }
+    if codec:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+        return 304, headers, key, None, b'', None
+
+    url = None if codec else storage.url_for(key, name, mimetype)
+    if url:
+        # 预签名地址会过期，不能缓存重定向
+        return 302, {'Location': url, 'Cache-Control': 'private, no-store'}, key, None, b'', None
+    stored = storage.stat(key)
+    if stored is None:
+        return 404, {}, key, None, b'', None
+    if encoded:
+        headers['Content-Type'] = mimetype
+        headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(stored)
+        return 200, headers, key, [(b'', 0, stored)], b'', None
+    if offload and not codec:
+        headers['Content-Type'] = mimetype
+        headers[offload[0]] = offload[1]
+        return 200, headers, key, None, b'', None
+
+    ranges = resolve_ranges(environ, size) if if_range_matches(environ, etag, last_modified) else None
+    if ranges is None:
+        headers['Content-Type'] = mimetype
+        headers['Content-Length'] = str(size)
+        return 200, headers, key, [(b'', 0, size)], b'', codec
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return 416, headers, key, None, b'', None
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Type'] = mimetype
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        headers['Content-Length'] = str(end - start)
+        return 206, headers, key, [(b'', start, end)], b'', codec
+
+    # 多段：multipart/byteranges，各段头部预先算好以便给出准确的 Content-Length
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        head = (f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode('latin-1')
+        parts.append((head, start, end))
+    tail = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    headers['Content-Length'] = str(sum(len(h) + e - s for h, s, e in parts) + len(tail))
+    return 206, headers, key, parts, tail, codec
+
+def serve_blob(entry):
+    """把 File 行对应的内容作为附件返回，处理协商缓存和 Range"""
+    storage = get_storage()
+    key = blobstore.blob_key(entry.blob_hash)
+    offload = offload_header(storage, key, current_app.config)
+    status, headers, key, parts, tail, codec = plan_blob(entry, request.environ, storage, offload)
+    metrics.record_download(status, headers, entry.size)
+    if status == 404:
+        abort(404)
+    if parts is None:
+        return Response(status=status, headers=headers)
+
+    # 从某处一直读到文件末尾（整文件、断点续传、原样发送的压缩内容）时交给服务器的 file_wrapper，
+    # gunicorn 等会用 os.sendfile 直接从页缓存发送；werkzeug 开发服务器没有 file_wrapper，仍按块读取
+    path = None if codec else storage.local_path(key)
+    to_end = parts[0][2] == entry.size or 'Content-Encoding' in headers
+    if path and len(parts) == 1 and not tail and to_end and 'wsgi.file_wrapper' in request.environ:
+        fp = open(path, 'rb')
+        fp.seek(parts[0][1])
+        return Response(wrap_file(request.environ, fp), status, headers=headers, direct_passthrough=True)
+
+    def generate():
+        reader = compression.BlobReader(storage, key, codec)
+        try:
+            for head, start, end in parts:
+                if head:
+                    yield head
+                yield from reader.read(start, end)
+        finally:
+            reader.close()
+        if tail:
+            yield tail
+
+    return Response(generate(), status, headers=headers, direct_passthrough=True)
@@ -1,15 +1,123 @@
-// 上传逻辑（支持文件 / 文件夹 / 进度条）
-function autoSubmitUpload() {
+// 上传逻辑：分片 + 并发 + 断点续传（进度条按总字节计算）
+const UPLOAD_PARALLEL = 4;   // 单个文件同时上传的分片数
+const UPLOAD_RETRIES = 3;    // 单个分片失败重试次数
+const HASH_LIMIT = 256 * 1024 * 1024;  // 不超过该大小的文件先算 sha256 尝试秒传
+const SMALL_FILE = 4 * 1024 * 1024;    // 小文件合并成批，一次表单请求上传
+const BATCH_BYTES = 32 * 1024 * 1024;
+const BATCH_FILES = 500;
+
+async function uploadApi(url, options = {}) {
+    const resp = await fetch(url, Object.assign({ credentials: 'same-origin' }, options));
+    if (!resp.ok) {
+        let msg = resp.status;
+        try { msg = (await resp.json()).error || msg; } catch (e) {}
+        throw new Error(msg);
+    }
+    return resp.status === 204 ? null : resp.json();
+}
+
+async function sha256Hex(file) {
+    if (!window.crypto || !crypto.subtle || file.size > HASH_LIMIT) return null;
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// 找回之前中断的会话，只补传缺失的分片
+async function resumeOrInit(api, file, relPath, currentPath) {
+    const key = 'upload:' + currentPath + '/' + relPath + ':' + file.size + ':' + file.lastModified;
+    const saved = localStorage.getItem(key);
+    if (saved) {
+        try {
+            const info = JSON.parse(saved);
+            const status = await uploadApi(api + '/' + info.id);
+            return { key, id: info.id, chunkSize: info.chunkSize, received: status.received };
+        } catch (e) {
+            localStorage.removeItem(key);
+        }
+    }
+    const created = await uploadApi(api, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            path: relPath, size: file.size, current_path: currentPath, sha256: await sha256Hex(file)
+        })
+    });
+    if (created.instant) return { key, instant: true };
+    localStorage.setItem(key, JSON.stringify({ id: created.id, chunkSize: created.chunk_size }));
+    return { key, id: created.id, chunkSize: created.chunk_size, received: [] };
+}
+
+async function uploadOneFile(api, file, relPath, currentPath, onBytes) {
+    const up = await resumeOrInit(api, file, relPath, currentPath);
+    if (up.instant) {  // 服务器已有相同内容，秒传完成
+        onBytes(file.size);
+        return;
+    }
+    const isReceived = (start, end) => up.received.some(r => r[0] <= start && end <= r[1]);
+
+    const pending = [];
+    for (let start = 0; start < file.size; start += up.chunkSize) {
+        const end = Math.min(start + up.chunkSize, file.size);
+        if (isReceived(start, end)) onBytes(end - start);
+        else pending.push([start, end]);
+    }
+
+    const worker = async () => {
+        while (pending.length) {
+            const [start, end] = pending.shift();
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    await uploadApi(api + '/' + up.id + '?offset=' + start, {
+                        method: 'PUT', body: file.slice(start, end)
+                    });
+                    break;
+                } catch (e) {
+                    if (attempt >= UPLOAD_RETRIES) throw e;
+                }
+            }
+            onBytes(end - start);
+        }
+    };
+    await Promise.all(Array.from({ length: UPLOAD_PARALLEL }, worker));
+
+    await uploadApi(api + '/' + up.id + '/complete', { method: 'POST' });
+    localStorage.removeItem(up.key);
+}
+
+function splitBatches(files) {
+    const batches = [];
+    let current = [], bytes = 0;
+    for (const file of files) {
+        if (current.length && (bytes + file.size > BATCH_BYTES || current.length >= BATCH_FILES)) {
+            batches.push(current);
+            current = [];
+            bytes = 0;
+        }
+        current.push(file);
+        bytes += file.size;
+    }
+    if (current.length) batches.push(current);
+    return batches;
+}
+
+// 一批小文件走普通表单上传，服务器端一个事务登记整批
+async function uploadBatch(action, batch, currentPath) {
+    const formData = new FormData();
+    formData.append('current_path', currentPath);
+    batch.forEach(f => formData.append('files', f, f.webkitRelativePath || f.name));
+    await uploadApi(action, { method: 'POST', body: formData, headers: { 'Accept': 'application/json' } });
+}
+
+async function autoSubmitUpload() {
     const form = document.getElementById('uploadForm');
     if (!form) return;
 
     const fileInputs = form.querySelectorAll('input[type="file"]');
-    const hasFile = Array.from(fileInputs).some(input => input.files.length > 0);
-    if (!hasFile) return; // 没选文件不上传
+    const files = Array.from(fileInputs).flatMap(input => Array.from(input.files));
+    if (!files.length) return; // 没选文件不上传
 
-    const formData = new FormData(form);
-
-    const xhr = new XMLHttpRequest();
+    const api = form.dataset.chunkApi;
+    const currentPath = form.querySelector('input[name="current_path"]').value;
     const wrapper = document.getElementById('uploadProgressWrapper');
     const bar = document.getElementById('uploadProgressBar');
     const percentText = document.getElementById('progressPercent');
@@ -21,39 +129,42 @@ function autoSubmitUpload() {
     percentText.innerText = '0%';
     statusText.innerText = '准备上传...';
 
-    // 上传进度
-    xhr.upload.onprogress = function (e) {
-        if (e.lengthComputable) {
-            const percent = Math.round((e.loaded / e.total) * 100);
-            bar.style.width = percent + '%';
-            percentText.innerText = percent + '%';
-            statusText.innerText = '正在上传...';
-        }
+    const total = files.reduce((sum, f) => sum + f.size, 0) || 1;
+    let loaded = 0;
+    const onBytes = n => {
+        loaded += n;
+        const percent = Math.round((loaded / total) * 100);
+        bar.style.width = percent + '%';
+        percentText.innerText = percent + '%';
     };
 
-    // 完成回调
-    xhr.onload = function () {
-        if (xhr.status === 200) {
-            statusText.innerText = '上传成功，刷新中...';
-            setTimeout(() => {
-                // 清空 input，避免重复触发
-                fileInputs.forEach(i => i.value = '');
-                location.reload();
-            }, 500);
-        } else {
-            statusText.innerText = '上传失败';
-            alert('上传失败，请重试');
-            wrapper.style.display = 'none';
-        }
-    };
+    const small = files.filter(f => f.size <= SMALL_FILE);
+    const large = files.filter(f => f.size > SMALL_FILE);
 
-    xhr.onerror = function () {
-        alert('网络错误，上传中断');
+    try {
+        let done = 0;
+        for (const batch of splitBatches(small)) {
+            statusText.innerText = '正在上传 (' + (done + 1) + '-' + (done + batch.length) + '/' + files.length + ')';
+            await uploadBatch(form.action, batch, currentPath);
+            batch.forEach(f => onBytes(f.size));
+            done += batch.length;
+        }
+        for (const file of large) {
+            done += 1;
+            statusText.innerText = '正在上传 (' + done + '/' + files.length + ')：' + file.name;
+            await uploadOneFile(api, file, file.webkitRelativePath || file.name, currentPath, onBytes);
+        }
+        statusText.innerText = '上传成功，刷新中...';
+        setTimeout(() => {
+            // 清空 input，避免重复触发
+            fileInputs.forEach(i => i.value = '');
+            location.reload();
+        }, 500);
+    } catch (e) {
+        statusText.innerText = '上传失败';
+        alert('上传中断：' + e.message + '\n重新选择相同文件即可从断点继续');
         wrapper.style.display = 'none';
-    };
-
-    xhr.open('POST', form.action, true);
-    xhr.send(formData);
+    }
 }
 
 
@@ -69,62 +180,275 @@ function openRenameModal(oldName, isFolder) {
     new bootstrap.Modal(document.getElementById('renameModal')).show();
 }
 
+// 移动对话框的文件夹树：节点展开时才向服务器请求子文件夹
+async function loadFolderNodes(ul, parent) {
+    const tree = document.getElementById('moveTree');
+    const resp = await fetch(tree.dataset.api + '?parent=' + encodeURIComponent(parent), { credentials: 'same-origin' });
+    const data = await resp.json();
+    ul.innerHTML = '';
+    data.folders.forEach(f => ul.appendChild(makeFolderNode(f.path, f.name, f.has_children)));
+}
+
+function makeFolderNode(path, name, hasChildren) {
+    const li = document.createElement('li');
+    const row = document.createElement('div');
+    row.className = 'd-flex align-items-center py-1 folder-node';
+    row.style.cursor = 'pointer';
+
+    const toggle = document.createElement('i');
+    toggle.className = 'bi me-1 ' + (hasChildren ? 'bi-caret-right-fill' : 'bi-dot text-muted');
+    const label = document.createElement('span');
+    label.innerHTML = '<i class="bi bi-folder-fill folder-color me-1"></i>';
+    label.appendChild(document.createTextNode(name));
+    row.append(toggle, label);
+
+    const children = document.createElement('ul');
+    children.className = 'list-unstyled ps-3 d-none';
+    li.append(row, children);
+
+    toggle.addEventListener('click', async e => {
+        e.stopPropagation();
+        if (!hasChildren) return;
+        const opening = children.classList.contains('d-none');
+        if (opening && !children.dataset.loaded) {
+            await loadFolderNodes(children, path);
+            children.dataset.loaded = '1';
+        }
+        children.classList.toggle('d-none', !opening);
+        toggle.className = 'bi me-1 ' + (opening ? 'bi-caret-down-fill' : 'bi-caret-right-fill');
+    });
+    row.addEventListener('click', () => selectMoveTarget(path, row));
+    return li;
+}
+
+function selectMoveTarget(path, row) {
+    document.getElementById('moveTarget').value = path;
+    document.getElementById('moveTargetLabel').innerText = path || '(根目录)';
+    document.querySelectorAll('#moveTree .folder-node').forEach(n => n.classList.remove('bg-light', 'fw-bold'));
+    if (row) row.classList.add('bg-light', 'fw-bold');
+}
+
 // 移动模态框监听器
 document.addEventListener('DOMContentLoaded', () => {
     const moveModalEl = document.getElementById('moveModal');
     if(moveModalEl){
         moveModalEl.addEventListener('show.bs.modal', e => {
             const btn = e.relatedTarget;
+            moveModalEl.dataset.batch = btn.hasAttribute('data-batch') ? '1' : '';
             document.getElementById('moveItemName').value = btn.getAttribute('data-item');
             document.getElementById('moveIsFolder').value = btn.getAttribute('data-isfolder');
+
+            const tree = document.getElementById('moveTree');
+            tree.innerHTML = '';
+            const root = makeFolderNode('', '(根目录)', true);
+            tree.appendChild(root);
+            selectMoveTarget('', root.firstChild);
+            root.firstChild.firstChild.click();  // 默认展开根目录
+        });
+        // 多选移动走批量接口
+        moveModalEl.querySelector('form').addEventListener('submit', e => {
+            if (!moveModalEl.dataset.batch) return;
+            e.preventDefault();
+            runBatch({ op: 'move', items: selectedPaths(), target: document.getElementById('moveTarget').value });
         });
     }
 });
 
 // 3. 排序逻辑
-let currentSort = { col: null, asc: true };
-function sortTable(colIndex) {
-    const table = document.getElementById('fileTable');
-    const tbody = table.tBodies[0];
-    const rows = Array.from(tbody.rows);
-    const headerCells = table.tHead.rows[0].cells;
-
-    if (currentSort.col === colIndex) currentSort.asc = !currentSort.asc;
-    else { currentSort.col = colIndex; currentSort.asc = true; }
-
-    const folders = rows.filter(r => r.querySelector('.folder-color'));
-    const files = rows.filter(r => !r.querySelector('.folder-color'));
-
-    const compare = (a, b) => {
-        let valA, valB;
-        if(colIndex === 1) { // 大小列用 data-size 排序
-            valA = parseFloat(a.cells[1].getAttribute('data-size')) || 0;
-            valB = parseFloat(b.cells[1].getAttribute('data-size')) || 0;
-        } else {
-            valA = a.cells[colIndex].innerText.trim().toLowerCase();
-            valB = b.cells[colIndex].innerText.trim().toLowerCase();
-        }
-        if (valA === valB) return 0;
-        return currentSort.asc ? (valA > valB ? 1 : -1) : (valA < valB ? 1 : -1);
+// --- 文件名搜索：以 . 开头的词作为扩展名过滤，其余作为名称关键词 ---
+let searchState = null;
+
+function runSearch(event) {
+    event.preventDefault();
+    const words = document.getElementById('searchInput').value.trim().split(/\s+/).filter(Boolean);
+    if (!words.length) {
+        closeSearch();
+        return false;
+    }
+    searchState = {
+        q: words.filter(w => !w.startsWith('.')).join(' '),
+        ext: words.filter(w => w.startsWith('.')).map(w => w.slice(1)).join(','),
+        cursor: null,
+        count: 0,
+    };
+    document.getElementById('searchResults').innerHTML = '';
+    document.getElementById('searchPanel').classList.remove('d-none');
+    loadSearchPage();
+    return false;
+}
+
+async function loadSearchPage() {
+    const form = document.getElementById('searchForm');
+    const params = new URLSearchParams({ q: searchState.q, ext: searchState.ext });
+    if (searchState.cursor) params.set('cursor', searchState.cursor);
+    const resp = await fetch(form.dataset.api + '?' + params);
+    const data = await resp.json();
+    if (!resp.ok) {
+        document.getElementById('searchSummary').innerText = data.error || '搜索失败';
+        return;
     }
 
-    folders.sort(compare);
-    files.sort(compare);
-
-    tbody.innerHTML = '';
-    folders.concat(files).forEach(r => tbody.appendChild(r));
-
-    // 更新图标
-    Array.from(headerCells).forEach((cell, idx) => {
-        const icon = cell.querySelector('.sort-icon');
-        if (icon) {
-            if (idx === colIndex) {
-                icon.className = currentSort.asc ? 'bi bi-sort-down sort-icon' : 'bi bi-sort-up sort-icon';
-                icon.style.color = '#4361ee';
-            } else {
-                icon.className = 'bi bi-arrow-down-up sort-icon';
-                icon.style.color = '#ccc';
-            }
+    const list = document.getElementById('searchResults');
+    const browse = path => form.dataset.browse + path.split('/').map(encodeURIComponent).join('/');
+    data.results.forEach(item => {
+        const li = document.createElement('li');
+        li.className = 'list-group-item d-flex align-items-center';
+        const link = document.createElement('a');
+        link.className = 'text-decoration-none flex-grow-1';
+        link.href = item.is_folder ? browse(item.path) : form.dataset.download.replace(/0$/, item.id);
+        link.innerHTML = '<i class="bi ' + (item.is_folder ? 'bi-folder-fill folder-color' : 'bi-file-earmark-text text-secondary') + ' me-2"></i>';
+        link.appendChild(document.createTextNode(item.name));
+        const where = document.createElement('a');
+        where.className = 'small text-muted text-decoration-none';
+        where.href = browse(item.parent);
+        where.innerText = '/' + item.parent;
+        li.append(link, where);
+        list.appendChild(li);
+    });
+
+    searchState.count += data.results.length;
+    searchState.cursor = data.next_cursor;
+    document.getElementById('searchSummary').innerText = '找到 ' + searchState.count + (data.next_cursor ? '+' : '') + ' 项';
+    document.getElementById('searchMore').classList.toggle('d-none', !data.next_cursor);
+}
+
+function closeSearch() {
+    searchState = null;
+    document.getElementById('searchPanel').classList.add('d-none');
+}
+
+// --- 后台任务（删除/移动文件夹等）：有未完成的任务时显示进度，全部结束后刷新目录 ---
+const JOB_LABELS = { delete: '删除', move: '移动', zip: '打包', gc: '清理存储' };
+
+async function pollJobs(hadActive) {
+    const panel = document.getElementById('jobPanel');
+    if (!panel) return;
+    const resp = await fetch(panel.dataset.api + '?active=1');
+    if (!resp.ok) return;
+    const jobs = (await resp.json()).jobs;
+    if (!jobs.length) {
+        panel.classList.add('d-none');
+        if (hadActive) window.location.reload();
+        return;
+    }
+    const list = document.getElementById('jobList');
+    list.innerHTML = '';
+    jobs.forEach(job => {
+        const percent = job.total ? Math.min(100, Math.round(job.done * 100 / job.total)) : 0;
+        const target = job.params.path || job.params.src || '';
+        const row = document.createElement('div');
+        row.className = 'mb-2';
+        row.innerHTML = '<div class="small"></div><div class="progress" style="height: 6px;">' +
+            '<div class="progress-bar progress-bar-striped progress-bar-animated"></div></div>';
+        row.querySelector('.small').innerText = (JOB_LABELS[job.kind] || job.kind) + ' ' + target +
+            (job.status === 'queued' ? '（排队中）' : '');
+        row.querySelector('.progress-bar').style.width = (job.status === 'queued' ? 0 : Math.max(percent, 5)) + '%';
+        list.appendChild(row);
+    });
+    panel.classList.remove('d-none');
+    setTimeout(() => pollJobs(true), 2000);
+}
+
+document.addEventListener('DOMContentLoaded', () => pollJobs(false));
+
+// --- 长目录分页：滚动到底部时按游标加载后面的行 ---
+let loadingRows = false;
+
+async function loadMoreRows() {
+    const more = document.getElementById('listMore');
+    if (!more || loadingRows || !more.dataset.cursor) return;
+    loadingRows = true;
+    try {
+        const url = more.dataset.url + (more.dataset.url.includes('?') ? '&' : '?') +
+            new URLSearchParams({ cursor: more.dataset.cursor, partial: 1 });
+        const resp = await fetch(url);
+        if (!resp.ok) return;
+        const tbody = document.querySelector('#fileTable tbody');
+        tbody.insertAdjacentHTML('beforeend', await resp.text());
+        updateSelection();
+        more.dataset.cursor = resp.headers.get('X-Next-Cursor') || '';
+        if (!more.dataset.cursor) more.remove();
+    } finally {
+        loadingRows = false;
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const more = document.getElementById('listMore');
+    if (more && 'IntersectionObserver' in window) {
+        new IntersectionObserver(entries => {
+            if (entries.some(e => e.isIntersecting)) loadMoreRows();
+        }, { rootMargin: '400px' }).observe(more);
+    }
+});
+
+// --- 多选：批量删除/移动/下载，一次请求处理全部所选条目 ---
+function selectedPaths() {
+    return Array.from(document.querySelectorAll('#fileTable .row-select:checked')).map(box => box.value);
+}
+
+function updateSelection() {
+    const bar = document.getElementById('selectionBar');
+    if (!bar) return;
+    const count = selectedPaths().length;
+    document.getElementById('selectionCount').innerText = count;
+    bar.classList.toggle('d-none', !count);
+    bar.classList.toggle('d-flex', count > 0);
+    const boxes = document.querySelectorAll('#fileTable .row-select');
+    const all = document.getElementById('selectAll');
+    all.checked = boxes.length > 0 && count === boxes.length;
+    all.indeterminate = count > 0 && count < boxes.length;
+}
+
+async function runBatch(body) {
+    const bar = document.getElementById('selectionBar');
+    try {
+        const data = await uploadApi(bar.dataset.api, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        const failed = data.results.filter(r => !r.ok);
+        if (failed.length) {
+            alert(failed.length + ' 项失败：\n' + failed.slice(0, 10).map(r => r.path + '：' + r.error).join('\n'));
         }
+    } catch (e) {
+        alert('操作失败：' + e.message);
+    }
+    window.location.reload();
+}
+
+function deleteSelected() {
+    const items = selectedPaths();
+    if (items.length && confirm('确定删除所选的 ' + items.length + ' 项？')) runBatch({ op: 'delete', items });
+}
+
+// 用表单提交，浏览器直接把返回的 zip 流保存为下载
+function downloadSelected() {
+    const form = document.createElement('form');
+    form.method = 'post';
+    form.action = document.getElementById('selectionBar').dataset.download;
+    selectedPaths().forEach(path => {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = 'items';
+        input.value = path;
+        form.appendChild(input);
     });
-}
\ No newline at end of file
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const table = document.getElementById('fileTable');
+    const all = document.getElementById('selectAll');
+    if (!table || !all) return;
+    table.addEventListener('change', e => {
+        if (e.target.classList.contains('row-select')) updateSelection();
+    });
+    all.addEventListener('change', () => {
+        document.querySelectorAll('#fileTable .row-select').forEach(box => { box.checked = all.checked; });
+        updateSelection();
+    });
+});
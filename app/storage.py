@@ -0,0 +1,193 @@
+import os
+import shutil
+from flask import current_app
+
+# blob 内容的存放后端。blobstore 只通过这里读写内容，数据库里只存 key（即哈希）。
+#   local：UPLOAD_ROOT/.blobs 下的文件，默认
+#   s3：任意 S3 兼容存储（AWS S3 / MinIO 等），需要安装 boto3；
+#       大文件自动分片上传，下载可以直接重定向到预签名地址，不再经过 Flask 转发
+READ_BLOCK = 256 * 1024
+
+
+class Storage:
+    """存储后端接口；key 是形如 'ab/cd/<hash>' 的相对路径"""
+
+    def put(self, key, src_path):
+        """把本地文件放入存储，成功后源文件被移走或删除"""
+        raise NotImplementedError
+
+    def open(self, key, start=0, end=None):
+        """以二进制只读文件对象打开 [start, end) 区间，不存在时抛 FileNotFoundError"""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """内容大小，不存在时返回 None"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """删除内容，不存在时忽略"""
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        """列出 prefix 开头的所有 key"""
+        raise NotImplementedError
+
+    def copy(self, src_key, dst_key):
+        raise NotImplementedError
+
+    def url_for(self, key, filename, mimetype):
+        """可以让客户端直接下载的地址，后端不支持时返回 None"""
+        return None
+
+    def local_path(self, key):
+        """内容在本机磁盘上的路径，不是本地存储时返回 None"""
+        return None
+
+    def read(self, key, start=0, end=None):
+        """按块读取 [start, end) 区间的生成器"""
+        with self.open(key, start, end) as fp:
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                block = fp.read(READ_BLOCK if remaining is None else min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                if remaining is not None:
+                    remaining -= len(block)
+                yield block
+
+
+class LocalStorage(Storage):
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key, src_path):
+        target = self.local_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(src_path, target)
+
+    def open(self, key, start=0, end=None):
+        fp = open(self.local_path(key), 'rb')
+        if start:
+            fp.seek(start)
+        return fp
+
+    def stat(self, key):
+        try:
+            return os.path.getsize(self.local_path(key))
+        except OSError:
+            return None
+
+    def delete(self, key):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=''):
+        for dirpath, _, filenames in os.walk(self.root):
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for name in filenames:
+                key = name if rel == '.' else f'{rel}/{name}'
+                if key.startswith(prefix):
+                    yield key
+
+    def copy(self, src_key, dst_key):
+        target = self.local_path(dst_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(self.local_path(src_key), target)
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 multipart_chunk=64 * 1024 * 1024, presign_ttl=300, redirect=True):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError:
+            raise RuntimeError('STORAGE_BACKEND = "s3" 需要先安装 boto3')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presign_ttl = presign_ttl
+        self.redirect = redirect
+        # 超过一个分片大小的文件自动走 multipart upload / copy
+        self.transfer = TransferConfig(multipart_threshold=multipart_chunk, multipart_chunksize=multipart_chunk)
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def put(self, key, src_path):
+        self.client.upload_file(src_path, self.bucket, self._key(key), Config=self.transfer)
+        os.remove(src_path)
+
+    def open(self, key, start=0, end=None):
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if start or end is not None:
+            params['Range'] = f'bytes={start}-{"" if end is None else end - 1}'
+        try:
+            return self.client.get_object(**params)['Body']
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+
+    def stat(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))['ContentLength']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for obj in page.get('Contents', ()):
+                yield obj['Key'][len(self.prefix):]
+
+    def copy(self, src_key, dst_key):
+        self.client.copy({'Bucket': self.bucket, 'Key': self._key(src_key)}, self.bucket, self._key(dst_key),
+                         Config=self.transfer)
+
+    def url_for(self, key, filename, mimetype):
+        if not self.redirect:
+            return None
+        from .utils import content_disposition
+        return self.client.generate_presigned_url('get_object', ExpiresIn=self.presign_ttl, Params={
+            'Bucket': self.bucket,
+            'Key': self._key(key),
+            'ResponseContentDisposition': content_disposition(filename),
+            'ResponseContentType': mimetype,
+        })
+
+
+def create_storage(config):
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(os.path.join(config['UPLOAD_ROOT'], '.blobs'))
+    if backend == 's3':
+        return S3Storage(
+            config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            access_key=config.get('S3_ACCESS_KEY'),
+            secret_key=config.get('S3_SECRET_KEY'),
+            multipart_chunk=config.get('S3_MULTIPART_CHUNK', 64 * 1024 * 1024),
+            presign_ttl=config.get('S3_PRESIGN_TTL', 300),
+            redirect=config.get('S3_REDIRECT_DOWNLOADS', True),
+        )
+    raise ValueError(f'未知的 STORAGE_BACKEND: {backend}')
+
+def get_storage():
+    """当前应用的存储后端，首次使用时按配置创建"""
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        storage = current_app.extensions['storage'] = create_storage(current_app.config)
+    return storage
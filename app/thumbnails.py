@@ -0,0 +1,196 @@
+import os
+import shutil
+import logging
+import threading
+import subprocess
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from .diskcache import DiskCache
+from .storage import get_storage
+from . import blobstore, compression
+
+# 缩略图：图片用 Pillow 缩放，PDF 取第一页（pdftoppm），视频取一帧（ffmpeg），
+# 哪个工具没装就不提供对应类型的预览。统一输出 JPEG。
+# 生成放到进程池里，结果存入 UPLOAD_ROOT/.thumbs 下按 内容哈希 + 尺寸 命名的文件，
+# 同一内容的多个副本共用一份缩略图；缓存目录总大小超过上限时按最近使用时间淘汰。
+IMAGE_EXTS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff'}
+PDF_EXTS = {'pdf'}
+VIDEO_EXTS = {'mp4', 'mov', 'm4v', 'webm', 'mkv', 'avi'}
+JPEG_QUALITY = 80
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+_inflight = {}  # 正在生成的缩略图，同一张图的并发请求共用一次生成
+_inflight_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _has_pillow():
+    try:
+        import PIL.Image  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+@lru_cache(maxsize=None)
+def _has_tool(name):
+    return shutil.which(name) is not None
+
+def previewable(filename):
+    """文件能生成哪种预览：'image' / 'pdf' / 'video'，不支持时返回 None"""
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if ext in IMAGE_EXTS and _has_pillow():
+        return 'image'
+    if ext in PDF_EXTS and _has_tool('pdftoppm'):
+        return 'pdf'
+    if ext in VIDEO_EXTS and _has_tool('ffmpeg'):
+        return 'video'
+    return None
+
+def snap_size(size):
+    """把请求的尺寸对齐到配置里的档位，避免任意尺寸撑爆缓存"""
+    sizes = current_app.config.get('THUMB_SIZES', (128, 512))
+    return min(sizes, key=lambda s: (s < size, abs(s - size)))
+
+
+# ------------------ 生成（在进程池子进程里执行，不依赖 Flask 上下文） ------------------
+def _render_image(src, dst, size):
+    from PIL import Image, ImageOps
+    with Image.open(src) as im:
+        im.draft('RGB', (size, size))  # JPEG 直接按缩小的比例解码，省掉大部分解码时间
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((size, size))
+        if im.mode in ('RGBA', 'LA', 'P'):
+            im = im.convert('RGBA')
+            background = Image.new('RGB', im.size, 'white')
+            background.paste(im, mask=im.getchannel('A'))
+            im = background
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+        im.save(dst, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+
+def _render_pdf(src, dst, size, timeout):
+    prefix = dst[:-len('.jpg')]
+    subprocess.run(['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-scale-to', str(size), src, prefix],
+                   check=True, timeout=timeout, capture_output=True)
+
+def _render_video(src, dst, size, timeout):
+    scale = f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease"
+    # 第 1 秒通常已经越过黑场；不足 1 秒的视频退回第一帧
+    for offset in ('1', '0'):
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-ss', offset, '-i', src, '-frames:v', '1', '-vf', scale, dst],
+                       check=True, timeout=timeout, capture_output=True)
+        if os.path.exists(dst) and os.path.getsize(dst):
+            return
+
+def render(kind, src, dst, size, timeout=30):
+    """把 src 的预览写到 dst（.jpg），成功返回 True"""
+    try:
+        if kind == 'image':
+            _render_image(src, dst, size)
+        elif kind == 'pdf':
+            _render_pdf(src, dst, size, timeout)
+        elif kind == 'video':
+            _render_video(src, dst, size, timeout)
+    except Exception as e:
+        log.warning('生成预览失败 %s: %s', src, e)
+        return False
+    return os.path.exists(dst) and os.path.getsize(dst) > 0
+
+
+def get_cache():
+    cache = current_app.extensions.get('thumb_cache')
+    if cache is None:
+        root = os.path.join(current_app.config['UPLOAD_ROOT'], '.thumbs')
+        cache = current_app.extensions['thumb_cache'] = \
+            DiskCache(root, current_app.config.get('THUMB_CACHE_MAX', 512 * 1024 * 1024))
+    return cache
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_pool(pool):
+    """子进程意外退出后进程池不再可用，丢弃它，下次请求时重建"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_thumbnail(blob_hash, kind, size):
+    """返回缩略图在缓存里的路径，无法生成时返回 None"""
+    cache = get_cache()
+    key = f'{blob_hash}_{size}.jpg'
+    path = cache.get(key)
+    if path:
+        return path
+
+    with _inflight_lock:
+        waiter = _inflight.get(key)
+        if waiter is None:
+            _inflight[key] = threading.Event()
+    if waiter is not None:
+        waiter.wait(current_app.config.get('THUMB_TIMEOUT', 30))
+        return cache.get(key)
+    try:
+        return _generate(cache, key, blob_hash, kind, size)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key).set()
+
+def _generate(cache, key, blob_hash, kind, size):
+    config = current_app.config
+    timeout = config.get('THUMB_TIMEOUT', 30)
+    storage = get_storage()
+    blob = blobstore.blob_key(blob_hash)
+    codec = blobstore.blob_codec(blob_hash)
+    src = None if codec else storage.local_path(blob)
+    fetched = None
+    if src is None:
+        # 远端存储或压缩存放的内容先解码到暂存区，子进程和外部工具只能读本地文件
+        fetched = src = blobstore.staging_path()
+        with open(fetched, 'wb') as fp:
+            for block in compression.read_blob(storage, blob, codec):
+                fp.write(block)
+    temp = cache.temp_path(key, '.jpg')  # ffmpeg 按扩展名选择输出格式
+
+    def cleanup(*_):
+        for path in (temp, fetched):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    workers = config.get('THUMB_WORKERS', 2)
+    if not workers:
+        try:
+            return cache.put(key, temp) if render(kind, src, temp, size, timeout) else None
+        finally:
+            cleanup()
+    pool = _get_pool(workers)
+    try:
+        future = pool.submit(render, kind, src, temp, size, timeout)
+        ok = future.result(timeout=timeout)
+    except TimeoutError:
+        # 子进程还在处理，等它结束后再删除临时文件
+        log.warning('生成预览超时 %s', blob_hash)
+        future.add_done_callback(cleanup)
+        return None
+    except BrokenProcessPool:
+        # 子进程被杀（如渲染时内存耗尽），换新进程池，这次按无法生成处理
+        log.warning('生成预览的进程池已损坏 %s', blob_hash)
+        _reset_pool(pool)
+        cleanup()
+        return None
+    try:
+        return cache.put(key, temp) if ok else None
+    finally:
+        cleanup()
@@ -0,0 +1,70 @@
+import time
+import threading
+from sqlalchemy import event
+from .init_db import sqlite
+from .models import File, parent_of
+
+# 移动对话框用的文件夹树：按 (用户, 父目录) 缓存直接子文件夹，前端展开节点时再按需加载。
+# 文件夹增删改在事务提交后只失效受影响的节点；多进程部署时各进程缓存独立，
+# 靠 FOLDER_TREE_TTL 兜底过期。
+FOLDER_TREE_TTL = 60
+
+_cache = {}  # user_id -> {parent: (加载时间, [(name, has_children), ...])}
+_lock = threading.Lock()
+
+
+def _load(user_id, parent):
+    names = [r.filename.split('/')[-1] for r in
+             sqlite.session.query(File.filename)
+             .filter_by(user_id=user_id, parent=parent, is_folder=True)
+             .order_by(File.filename)]
+    paths = [f"{parent}/{n}" if parent else n for n in names]
+    nested = set()
+    if paths:
+        nested = {r.parent for r in
+                  sqlite.session.query(File.parent).distinct()
+                  .filter(File.user_id == user_id, File.is_folder.is_(True), File.parent.in_(paths))}
+    return [(name, path in nested) for name, path in zip(names, paths)]
+
+def folder_children(user_id, parent=''):
+    """parent 下的直接子文件夹 [{'path', 'name', 'has_children'}]"""
+    now = time.monotonic()
+    with _lock:
+        hit = _cache.get(user_id, {}).get(parent)
+    if hit and now - hit[0] < FOLDER_TREE_TTL:
+        children = hit[1]
+    else:
+        children = _load(user_id, parent)
+        with _lock:
+            _cache.setdefault(user_id, {})[parent] = (now, children)
+    return [{'path': f"{parent}/{name}" if parent else name, 'name': name, 'has_children': has_children}
+            for name, has_children in children]
+
+def invalidate(user_id, path):
+    """path 处的文件夹被创建/删除/移走：失效其父、祖父（has_children 可能变化）和它自己的子树"""
+    parent = parent_of(path)
+    stale = {parent, parent_of(parent)}
+    with _lock:
+        nodes = _cache.get(user_id)
+        if not nodes:
+            return
+        if not path:  # 整个用户目录被清空
+            nodes.clear()
+            return
+        for key in list(nodes):
+            if key in stale or key == path or key.startswith(path + '/'):
+                del nodes[key]
+
+def mark_dirty(user_id, path):
+    """登记待失效的节点，事务提交后才真正失效，避免并发请求把未提交的状态缓存下来"""
+    sqlite.session.info.setdefault('tree_dirty', set()).add((user_id, path))
+
+
+@event.listens_for(sqlite.session, 'after_commit')
+def _apply_invalidations(session):
+    for user_id, path in session.info.pop('tree_dirty', ()):
+        invalidate(user_id, path)
+
+@event.listens_for(sqlite.session, 'after_rollback')
+def _drop_invalidations(session):
+    session.info.pop('tree_dirty', None)
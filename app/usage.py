@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import func, update
+from .init_db import sqlite
+from .models import File, User, Blob, UploadSession
+from .storage import get_storage
+from . import blobstore
+from .vfs import ancestors
+
+# 用量计数由 vfs 在每次修改时增量维护；这里定期全量对账，修复意外漂移。
+log = logging.getLogger(__name__)
+
+
+def quota_of(user):
+    """用户配额（字节），None 表示不限制"""
+    if user.quota_bytes is not None:
+        return user.quota_bytes
+    return current_app.config.get('DEFAULT_USER_QUOTA')
+
+def remaining_quota(user_id, exclude_upload=None):
+    """剩余可写字节数，已扣除进行中的分片上传预占的空间；不限制时返回 None"""
+    user = sqlite.session.get(User, user_id)
+    quota = quota_of(user)
+    if quota is None:
+        return None
+    reserved = sqlite.session.query(func.sum(UploadSession.size)) \
+        .filter(UploadSession.user_id == user_id, UploadSession.id != exclude_upload).scalar()
+    return quota - (user.used_bytes or 0) - (reserved or 0)
+
+
+def reconcile_blob_sizes():
+    """以存储后端中的实际内容为准校正记录的大小，返回修正的 blob 数"""
+    storage = get_storage()
+    fixed = 0
+    for blob in Blob.query.yield_per(1000):
+        actual = storage.stat(blobstore.blob_key(blob.hash))
+        if actual is None:
+            log.warning('blob %s 在存储中不存在', blob.hash)
+            continue
+        if actual != blob.size and not blob.codec:  # 压缩存放的内容，存储里的大小本来就不同于原始大小
+            blob.size = actual
+            sqlite.session.execute(update(File).where(File.blob_hash == blob.hash).values(size=actual))
+            fixed += 1
+    return fixed
+
+def reconcile_user(user_id):
+    """按文件行重新汇总该用户各文件夹大小、总用量和文件数，返回修正的行数"""
+    totals = defaultdict(int)
+    used = count = 0
+    rows = sqlite.session.query(File.filename, File.size) \
+        .filter(File.user_id == user_id, File.is_folder.is_(False))
+    for filename, size in rows:
+        size = size or 0
+        used += size
+        count += 1
+        for folder in ancestors(filename):
+            totals[folder] += size
+
+    fixed = 0
+    folders = sqlite.session.query(File.id, File.filename, File.size) \
+        .filter(File.user_id == user_id, File.is_folder.is_(True)).all()
+    for folder_id, filename, size in folders:
+        if size != totals[filename]:
+            sqlite.session.execute(update(File).where(File.id == folder_id).values(size=totals[filename]))
+            fixed += 1
+    user = sqlite.session.get(User, user_id)
+    if user and user.used_bytes != used:
+        user.used_bytes = used
+        fixed += 1
+    if user and user.file_count != count:
+        user.file_count = count
+        fixed += 1
+    return fixed
+
+def reconcile_usage(user_id=None):
+    """全量对账：先校正 blob 大小，再重算文件夹和用户用量"""
+    fixed = reconcile_blob_sizes() if user_id is None else 0
+    user_ids = [user_id] if user_id is not None else [uid for uid, in sqlite.session.query(User.id)]
+    for uid in user_ids:
+        fixed += reconcile_user(uid)
+    sqlite.session.commit()
+    if fixed:
+        log.info('用量对账修正了 %d 处', fixed)
+    return fixed
+
+def start_reconciler(app):
+    """后台线程按 USAGE_RECONCILE_INTERVAL 秒定期对账，0 表示关闭"""
+    interval = app.config.get('USAGE_RECONCILE_INTERVAL', 0)
+    if not interval:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    reconcile_usage()
+            except Exception:
+                log.exception('用量对账失败')
+
+    thread = threading.Thread(target=loop, name='usage-reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -1,26 +1,109 @@
-import os
+import io
+import unicodedata
 from datetime import datetime
+import zipfile
+from urllib.parse import quote
+from flask import Response, stream_with_context
+from .storage import get_storage
+from . import compression, metrics
 
-def get_folder_tree(base_path, current_rel="", level=0):
-    tree = []
-    full_path = os.path.join(base_path, current_rel)
-    if not os.path.exists(full_path):
-        return []
-    try:
-        dirs = [d for d in os.listdir(full_path) if os.path.isdir(os.path.join(full_path, d))]
-        for d in sorted(dirs):
-            rel_path = os.path.join(current_rel, d).replace("\\", "/")
-            display_name = "　" * level + "└─ " + d
-            tree.append({'path': rel_path, 'display': display_name})
-            tree.extend(get_folder_tree(base_path, rel_path, level + 1))
-    except PermissionError:
-        pass
-    return tree
-
-def get_file_info(path):
-    if not os.path.exists(path):
+# ------------------ 流式 ZIP ------------------
+# 已经是压缩格式的文件直接 STORED，重复压缩只浪费 CPU
+STORED_EXTENSIONS = {
+    'zip', 'rar', '7z', 'gz', 'tgz', 'bz2', 'xz', 'zst',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic',
+    'mp3', 'aac', 'ogg', 'flac', 'm4a',
+    'mp4', 'mov', 'mkv', 'avi', 'webm',
+    'docx', 'xlsx', 'pptx', 'pdf', 'apk', 'jar',
+}
+ZIP_READ_SIZE = 256 * 1024
+
+
+class _ZipSink(io.RawIOBase):
+    """不可 seek 的写入端，ZipFile 写进来的数据由生成器随时取走"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compress_type_for(name):
+    """按扩展名选择压缩方式"""
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries, storage):
+    """边读文件边产出 zip 数据块，entries 为 (存储 key, 包内路径, 大小, 修改时间, 编码) 序列
+
+    输出流不可 seek，ZipFile 会自动使用 data descriptor，大文件按需写 ZIP64 头，
+    内存占用只与单次读取块大小有关。
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for key, arcname, size, mtime, codec in entries:
+            try:
+                src = compression.open_blob(storage, key, codec)
+            except OSError:
+                continue  # 打包过程中文件被删除，跳过
+            zinfo = zipfile.ZipInfo(arcname, (mtime or datetime.now()).timetuple()[:6])
+            zinfo.file_size = size or 0  # ZipFile 据此决定是否需要 ZIP64 头
+            zinfo.compress_type = compress_type_for(arcname)
+            with src, zf.open(zinfo, 'w') as dst:
+                while True:
+                    block = src.read(ZIP_READ_SIZE)
+                    if not block:
+                        break
+                    dst.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+def content_disposition(filename):
+    """生成兼容中文文件名的 Content-Disposition"""
+    fallback = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+    fallback = fallback.replace('"', '').replace('\\', '') or 'download'
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def zip_response(entries, download_name):
+    """以流式响应返回 zip，首字节时间与目录大小无关"""
+    chunks = metrics.count_zip(stream_zip(entries, get_storage()))
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = content_disposition(download_name)
+    response.headers['X-Accel-Buffering'] = 'no'  # 让 nginx 不要整包缓冲
+    return response
+
+
+def normalize_rel_path(path):
+    """统一分隔符并校验相对路径，含 '..' 等非法段时返回 None"""
+    parts = [p for p in (path or '').replace("\\", "/").split('/') if p]
+    if not parts or any(p in ('.', '..') for p in parts):
         return None
-    return {
-        'size': os.path.getsize(path),
-        'mtime': datetime.fromtimestamp(os.path.getmtime(path))
-    }
+    return '/'.join(parts)
+
+
+def merge_ranges(ranges):
+    """合并重叠或相邻的 [start, end) 区间"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
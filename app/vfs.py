@@ -0,0 +1,389 @@
+import json
+import base64
+import binascii
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import and_, or_, case, func, insert, text, tuple_, update
+from .init_db import sqlite, begin_write
+from .models import Blob, File, User, parent_of
+from . import blobstore, journal, metrics, tree_cache
+
+# 用户目录树完全由 File 表描述：文件夹只是 is_folder 行，文件行指向 blob。
+# 创建、删除、重命名、移动都只改元数据，不再触碰磁盘上的目录结构。
+# 修改目录树的函数一开始就切到写连接（begin_write），存在性检查、读取大小和修改都在同一个
+# BEGIN IMMEDIATE 事务里，并发的重命名/移动不会基于旧快照各自通过检查；(user_id, filename) 唯一索引兜底。
+
+
+def join_path(folder, name):
+    return f"{folder}/{name}" if folder else name
+
+def get_entry(user_id, path):
+    return File.query.filter_by(user_id=user_id, filename=path).first()
+
+def owns_blob(user_id, blob_hash):
+    """该用户是否已有文件引用这份内容"""
+    return sqlite.session.query(File.id).filter_by(user_id=user_id, blob_hash=blob_hash).first() is not None
+
+# ------------------ 分页列目录 ------------------
+# 按 (文件夹在前, 排序列, id) 做 keyset 分页，每种排序都有 (user_id, parent, is_folder, 列) 索引，
+# 翻到第几页都只是一次索引区间扫描，不会读出整个目录。
+SORT_COLUMNS = {'name': File.filename, 'size': File.size, 'mtime': File.mtime}
+LIST_PAGE_SIZE = 200
+LIST_PAGE_MAX = 1000
+LIST_FIELDS = ('id', 'name', 'path', 'is_folder', 'size', 'mtime')
+
+
+def encode_cursor(entry, sort):
+    value = getattr(entry, SORT_COLUMNS[sort].key)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([bool(entry.is_folder), value, entry.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token, sort):
+    """游标不合法时抛 ValueError"""
+    try:
+        is_folder, value, entry_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if sort == 'mtime':
+            value = datetime.fromisoformat(value)
+        return bool(is_folder), value, int(entry_id)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('无效的游标')
+
+def list_page(user_id, folder, sort='name', order='asc', cursor=None, limit=LIST_PAGE_SIZE):
+    """folder 直接子项的一页，文件夹在前；返回 (条目, 下一页游标)，没有下一页时游标为 None"""
+    column = SORT_COLUMNS[sort]
+    desc = order == 'desc'
+    after = decode_cursor(cursor, sort) if cursor else None
+    limit = max(1, min(limit, LIST_PAGE_MAX))
+
+    entries = []
+    for is_folder in (True, False):
+        if after and is_folder and not after[0]:
+            continue  # 游标已经在文件部分
+        rows = File.query.filter_by(user_id=user_id, parent=folder, is_folder=is_folder)
+        if after and after[0] == is_folder:
+            key, bound = tuple_(column, File.id), tuple_(after[1], after[2])
+            rows = rows.filter(key < bound if desc else key > bound)
+        rows = rows.order_by(column.desc(), File.id.desc()) if desc else rows.order_by(column, File.id)
+        entries += rows.limit(limit + 1 - len(entries)).all()
+        if len(entries) > limit:
+            break
+    next_cursor = encode_cursor(entries[limit - 1], sort) if len(entries) > limit else None
+    return entries[:limit], next_cursor
+
+def describe(entry, fields=LIST_FIELDS):
+    """条目的 JSON 表示，只包含 fields 中的字段"""
+    values = {
+        'id': lambda: entry.id,
+        'name': lambda: entry.filename.split('/')[-1],
+        'path': lambda: entry.filename,
+        'is_folder': lambda: bool(entry.is_folder),
+        'size': lambda: entry.size or 0,
+        'mtime': lambda: entry.mtime.isoformat(timespec='seconds') if entry.mtime else None,
+    }
+    return {f: values[f]() for f in fields if f in values}
+
+def subtree_clause(user_id, path):
+    """path 本身及其所有后代的过滤条件
+
+    后代用区间 ['path/', 'path0') 表示（'0' 是 '/' 的下一个字符），既能走
+    (user_id, filename) 索引，又按路径段边界匹配，'a' 不会匹配到 'ab/...'。
+    """
+    if not path:
+        return File.user_id == user_id
+    return and_(
+        File.user_id == user_id,
+        or_(File.filename == path, and_(File.filename >= path + '/', File.filename < path + '0'))
+    )
+
+def subtree_query(user_id, path):
+    return File.query.filter(subtree_clause(user_id, path))
+
+def ancestors(path):
+    """path 的所有上级文件夹，由近到远的顺序无关紧要"""
+    parts = path.split('/')
+    return ['/'.join(parts[:i]) for i in range(1, len(parts))]
+
+def selected_ancestor(path, selected):
+    """selected 中包含 path 的最上层文件夹，没有时返回 None（多选时去掉重复包含的条目）"""
+    found = [folder for folder in ancestors(path) if folder in selected]
+    return min(found, key=len) if found else None
+
+def adjust_folders(user_id, path, delta):
+    """path 的所有上级文件夹汇总大小加上 delta（不提交）"""
+    folders = ancestors(path)
+    if delta and folders:
+        sqlite.session.execute(
+            update(File).where(File.user_id == user_id, File.is_folder.is_(True), File.filename.in_(folders))
+            .values(size=File.size + delta)
+        )
+
+def adjust_usage(user_id, path, delta, files=0):
+    """文件增删时同步更新上级文件夹大小、用户总用量和文件数，与业务修改在同一事务内（不提交）"""
+    if not delta and not files:
+        return
+    adjust_folders(user_id, path, delta)
+    sqlite.session.execute(update(User).where(User.id == user_id).values(
+        used_bytes=User.used_bytes + delta, file_count=User.file_count + files))
+
+def file_ancestor(user_id, path):
+    """path 的上级中已存在的文件，没有时返回 None；文件下面不能再有条目"""
+    found = get_entries(user_id, ancestors(path))
+    return next((a for a, entry in found.items() if not entry.is_folder), None)
+
+def ensure_folders(user_id, path):
+    """补建 path 及其缺失的上级文件夹，途中遇到同名文件时抛 NotADirectoryError（不提交）"""
+    begin_write()
+    parts = path.split('/')
+    for i in range(len(parts)):
+        folder = '/'.join(parts[:i + 1])
+        existing = get_entry(user_id, folder)
+        if existing and not existing.is_folder:
+            raise NotADirectoryError(folder)
+        if not existing:
+            entry = File(filename=folder, user_id=user_id, is_folder=True)
+            sqlite.session.add(entry)
+            sqlite.session.flush()
+            tree_cache.mark_dirty(user_id, folder)
+            journal.record(user_id, 'put', folder, entry=entry)
+
+def put_file(user_id, path, blob_hash, size):
+    """登记文件（调用方已为 blob 加过引用），同名文件会被覆盖（不提交）
+
+    path 是文件夹时抛 IsADirectoryError，上级路径是文件时抛 NotADirectoryError。
+    """
+    begin_write()
+    existing = get_entry(user_id, path)
+    if existing and existing.is_folder:
+        raise IsADirectoryError(path)
+    if not existing and '/' in path:
+        ensure_folders(user_id, path.rsplit('/', 1)[0])
+    metrics.record_upload(1, size)
+    if existing:
+        old_hash, old_size = existing.blob_hash, existing.size or 0
+        existing.blob_hash = blob_hash
+        existing.size = size
+        existing.mtime = datetime.now()
+        sqlite.session.flush()
+        adjust_usage(user_id, path, size - old_size)
+        blobstore.release([old_hash])
+        journal.record(user_id, 'put', path, entry=existing)
+        return existing
+    record = File(filename=path, user_id=user_id, size=size, is_folder=False, blob_hash=blob_hash)
+    sqlite.session.add(record)
+    sqlite.session.flush()
+    adjust_usage(user_id, path, size, files=1)
+    journal.record(user_id, 'put', path, entry=record)
+    return record
+
+def get_entries(user_id, paths):
+    """批量查询多个路径，返回 {path: File}"""
+    paths = list(set(paths))
+    found = {}
+    for i in range(0, len(paths), blobstore.IN_BATCH):
+        batch = paths[i:i + blobstore.IN_BATCH]
+        for f in File.query.filter(File.user_id == user_id, File.filename.in_(batch)):
+            found[f.filename] = f
+    return found
+
+def put_files(user_id, items):
+    """批量登记文件 [(path, blob_hash, size)]，用于大量文件的一次上传（不提交）
+
+    已有条目和所有上级文件夹一次查出，新行批量插入，用量按文件夹汇总后一次写回。
+    调用方已为每个 blob 加过引用；路径被同名文件夹（或上级路径被同名文件）占用的
+    条目会被跳过并释放引用。返回实际登记的路径列表。
+    """
+    begin_write()
+    latest, dropped = {}, []
+    for path, blob_hash, size in items:
+        if path in latest:
+            dropped.append(latest[path][0])  # 同一批里重复的路径，以最后一个为准
+        latest[path] = (blob_hash, size)
+
+    needed = {a for path in latest for a in ancestors(path)}
+    existing = get_entries(user_id, needed | set(latest))
+    for path in list(latest):
+        entry = existing.get(path)
+        blocked = any(a in existing and not existing[a].is_folder for a in ancestors(path))
+        if (entry and entry.is_folder) or blocked:
+            dropped.append(latest.pop(path)[0])
+
+    metrics.record_upload(len(latest), sum(size for _, size in latest.values()))
+    now, created_at = datetime.now(), datetime.utcnow()
+    new_folders = sorted({a for path in latest for a in ancestors(path)} - existing.keys())
+    rows = [dict(filename=f, parent=parent_of(f), user_id=user_id, is_folder=True, size=0,
+                 mtime=now, created_at=created_at) for f in new_folders]
+
+    deltas, replaced, total, added = defaultdict(int), [], 0, 0
+    for path, (blob_hash, size) in latest.items():
+        entry = existing.get(path)
+        if entry:
+            replaced.append(entry.blob_hash)
+            delta = size - (entry.size or 0)
+            entry.blob_hash, entry.size, entry.mtime = blob_hash, size, now
+            journal.record(user_id, 'put', path, entry=entry)
+        else:
+            rows.append(dict(filename=path, parent=parent_of(path), user_id=user_id, is_folder=False,
+                             size=size, blob_hash=blob_hash, mtime=now, created_at=created_at))
+            delta = size
+            added += 1
+        total += delta
+        for a in ancestors(path):
+            deltas[a] += delta
+
+    if rows:
+        sqlite.session.execute(insert(File), rows)
+        journal.record_puts(user_id, rows)
+    sqlite.session.flush()
+    folder_updates = [{'d': d, 'u': user_id, 'f': f} for f, d in deltas.items() if d]
+    if folder_updates:
+        sqlite.session.execute(
+            text("UPDATE file SET size = size + :d WHERE user_id = :u AND filename = :f AND is_folder = 1"),
+            folder_updates
+        )
+    if total or added:
+        sqlite.session.execute(update(User).where(User.id == user_id).values(
+            used_bytes=User.used_bytes + total, file_count=User.file_count + added))
+
+    # 只需失效最上层的新文件夹，它的子树会一并失效
+    created = set(new_folders)
+    for f in new_folders:
+        if parent_of(f) not in created:
+            tree_cache.mark_dirty(user_id, f)
+    blobstore.release(replaced + dropped)
+    return list(latest)
+
+def delete_path(user_id, path, purge=True):
+    """删除文件或整个文件夹并释放引用的 blob，返回被回收的 blob 哈希（不提交）
+
+    purge=False 时 blob 内容不在本事务内删除，由调用方之后用 blobstore.purge 分批清理。
+    """
+    begin_write()
+    # 文件夹行的 size 就是整棵子树的大小，无需再汇总
+    if path:
+        entry = get_entry(user_id, path)
+        removed = entry.size if entry else 0
+        if entry and entry.is_folder:
+            tree_cache.mark_dirty(user_id, path)
+    else:
+        removed = sqlite.session.get(User, user_id).used_bytes
+        tree_cache.mark_dirty(user_id, '')
+
+    # 整棵子树一条 DELETE，不逐行加载成对象
+    hashes = [h for h, in sqlite.session.query(File.blob_hash)
+              .filter(subtree_clause(user_id, path), File.is_folder.is_(False))]
+    adjust_usage(user_id, path, -(removed or 0), files=-len(hashes))
+    hashes = [h for h in hashes if h]
+    sqlite.session.query(File).filter(subtree_clause(user_id, path)).delete(synchronize_session=False)
+    sqlite.session.expire_all()
+    journal.record(user_id, 'delete', path)
+    return blobstore.release(hashes, purge=purge)
+
+def move_path(user_id, old_path, new_path):
+    """重命名或移动，文件夹连同后代一起改路径（不提交）
+
+    目标在源自身的子树里时抛 ValueError，目标的上级路径是文件时抛 NotADirectoryError。
+    """
+    begin_write()
+    if new_path.startswith(old_path + '/'):
+        raise ValueError('不能移动到自身或其子文件夹')
+    entry = get_entry(user_id, old_path)
+    if not entry:
+        raise FileNotFoundError(old_path)
+    if get_entry(user_id, new_path):
+        raise FileExistsError(new_path)
+    new_parent = parent_of(new_path)
+    if new_parent:
+        ensure_folders(user_id, new_parent)
+    if entry.is_folder:
+        tree_cache.mark_dirty(user_id, old_path)
+        tree_cache.mark_dirty(user_id, new_path)
+    if parent_of(old_path) != new_parent:
+        # 跨目录移动：大小从旧的上级链挪到新的上级链，用户总量不变
+        adjust_folders(user_id, old_path, -(entry.size or 0))
+        adjust_folders(user_id, new_path, entry.size or 0)
+
+    # 一条 UPDATE 改写整棵子树的 filename/parent，只有被操作的条目本身更新 mtime
+    cut = len(old_path) + 1
+    is_root = File.filename == old_path
+    sqlite.session.execute(
+        update(File).where(subtree_clause(user_id, old_path)).values(
+            filename=new_path + func.substr(File.filename, cut),
+            parent=case((is_root, new_parent), else_=new_path + func.substr(File.parent, cut)),
+            mtime=case((is_root, datetime.now()), else_=File.mtime),
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    # 会话里已加载的对象路径已过期
+    sqlite.session.expire_all()
+    journal.record(user_id, 'move', old_path, target=new_path)
+
+def iter_blobs(user_id, folder, after=None, limit=None):
+    """文件夹下所有文件的 (blob key, 相对路径, 大小, 修改时间, 存储编码)，用于打包下载
+
+    after/limit 用于分页读取：只取完整路径大于 after 的前 limit 个文件。
+    """
+    rows = subtree_query(user_id, folder).filter(File.is_folder.is_(False)) \
+        .join(Blob, Blob.hash == File.blob_hash).add_columns(Blob.codec).order_by(File.filename)
+    if after is not None:
+        rows = rows.filter(File.filename > after)
+    if limit is not None:
+        rows = rows.limit(limit)
+    offset = len(folder) + 1 if folder else 0
+    for f, codec in rows.yield_per(500):
+        yield blobstore.blob_key(f.blob_hash), f.filename[offset:], f.size, f.mtime, codec
+
+ZIP_PAGE = 500
+
+def iter_blobs_paged(user_id, folder, page=ZIP_PAGE):
+    """同 iter_blobs，按 page 个一页分开查询，每页读完立即结束读事务
+
+    打包下载的速度取决于客户端，不能让游标一直占着读连接和 WAL 快照（快照不释放，检查点就无法收缩 WAL）。
+    """
+    after = None
+    while True:
+        rows = list(iter_blobs(user_id, folder, after, page))
+        sqlite.session.rollback()
+        yield from rows
+        if len(rows) < page:
+            return
+        after = join_path(folder, rows[-1][1])
+
+def iter_selection(user_id, paths):
+    """多选的文件和文件夹打包下载的条目，格式同 iter_blobs；包内路径相对于所选条目共同的上级文件夹
+
+    同时选中了某个文件夹及其中的条目时只打包一次；不存在的路径直接跳过。
+    """
+    selected = set(paths)
+    top = sorted(p for p in selected if not selected_ancestor(p, selected))
+    if not top:
+        return
+    common = parent_of(top[0]).split('/')
+    for path in top[1:]:
+        parts = parent_of(path).split('/')
+        n = 0
+        while n < min(len(common), len(parts)) and common[n] == parts[n]:
+            n += 1
+        common = common[:n]
+    common = '/'.join(common)
+    offset = len(common) + 1 if common else 0
+
+    entries = get_entries(user_id, top)
+    hashes = list({e.blob_hash for e in entries.values() if e.blob_hash})
+    codecs = {}
+    for i in range(0, len(hashes), blobstore.IN_BATCH):
+        batch = hashes[i:i + blobstore.IN_BATCH]
+        codecs.update(sqlite.session.query(Blob.hash, Blob.codec).filter(Blob.hash.in_(batch)))
+    # 先取出需要的字段再结束读事务，文件夹里的条目由 iter_blobs_paged 分页读取
+    found = {path: (e.is_folder, e.blob_hash, e.size, e.mtime) for path, e in entries.items()}
+    sqlite.session.rollback()
+    for path in top:
+        if path not in found:
+            continue
+        is_folder, blob_hash, size, mtime = found[path]
+        if is_folder:
+            for key, arcname, size, mtime, codec in iter_blobs_paged(user_id, path):
+                yield key, path[offset:] + '/' + arcname, size, mtime, codec
+        elif blob_hash in codecs:
+            yield blobstore.blob_key(blob_hash), path[offset:], size, mtime, codecs[blob_hash]
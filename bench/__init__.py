@@ -0,0 +1 @@
+"""性能基准：python -m bench.run --help"""
@@ -0,0 +1,355 @@
+"""性能基准：生成合成数据，并发请求主要页面，统计延迟分位数、吞吐、峰值内存和 SQL 条数
+
+    python -m bench.run                                  # 默认规模，测试客户端 + 本地服务器
+    python -m bench.run --files 20000 --concurrency 16 --save bench/baseline.json
+    python -m bench.run --baseline bench/baseline.json  # 与基线比较，退步超过容差时退出码为 1
+
+数据和数据库放在 --workdir（默认临时目录），不会碰到真实的 uploads/ 和数据库；
+同一个 --workdir 再次运行时复用已生成的数据。SQL 条数取自性能分析层的 Server-Timing 头。
+每个场景在单独的子进程里运行，峰值内存（ru_maxrss 是进程生命周期内的最高值）只反映该场景；
+吞吐按双向传输的内容计算：下载为响应体，上传为上传的文件内容。
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import http.client
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import create_app
+from . import synth
+
+SCENARIOS = ('index', 'list_api', 'download', 'download_folder', 'upload', 'browse_uploads')
+PERCENTILES = (50, 90, 99)
+
+
+# ------------------ 客户端 ------------------
+def sql_count(headers):
+    """从 Server-Timing 里取出 SQL 条数"""
+    timing = headers.get('Server-Timing', '')
+    for part in timing.split(','):
+        if part.strip().startswith('sql;') and 'desc="' in part:
+            return int(part.split('desc="', 1)[1].split(' ', 1)[0])
+    return None
+
+def multipart(fields, files):
+    boundary = 'bench' + os.urandom(8).hex()
+    chunks = []
+    for name, value in fields.items():
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files:
+        chunks.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    chunks.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(chunks), f'multipart/form-data; boundary={boundary}'
+
+
+class TestClientDriver:
+    """进程内的 Flask 测试客户端，不经过网络和 WSGI 服务器"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def login(self, username):
+        self.client.post('/login', data={'username': username, 'password': synth.PASSWORD})
+
+    def request(self, method, path, form=None, files=None):
+        data = dict(form or {})
+        if files:
+            data['files'] = [(io.BytesIO(content), filename) for _, (filename, content) in files]
+        response = self.client.open(path, method=method, data=data or None)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size, sql_count(response.headers)
+
+
+class HttpDriver:
+    """通过 HTTP 访问本地服务器（werkzeug 多线程服务器，每个请求一个连接）"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = ''
+
+    def login(self, username):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        conn.request('POST', '/login', urlencode({'username': username, 'password': synth.PASSWORD}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        cookie = SimpleCookie(response.headers.get('Set-Cookie', ''))
+        self.cookie = '; '.join(f'{k}={v.value}' for k, v in cookie.items())
+        conn.close()
+
+    def request(self, method, path, form=None, files=None):
+        headers = {'Cookie': self.cookie}
+        body = None
+        if files:
+            body, headers['Content-Type'] = multipart(form or {}, files)
+        elif form:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            conn.request(method, quote(path, safe='/?=&%'), body, headers)
+            response = conn.getresponse()
+            size = 0
+            while True:
+                block = response.read(256 * 1024)
+                if not block:
+                    break
+                size += len(block)
+            return response.status, size, sql_count(response.headers)
+        finally:
+            conn.close()
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# ------------------ 场景 ------------------
+def make_scenario(name, accounts, ids, worker, rng):
+    """返回 (登录用户名, 生成下一个请求的函数)，请求为 (方法, 路径, 表单, 文件)"""
+    account = accounts[worker % len(accounts)]
+    folders = account['folders'] or ['']
+    top = [f for f in folders if '/' not in f] or ['']
+    if name == 'index':
+        return account['username'], lambda: ('GET', '/' + rng.choice(folders), None, None)
+    if name == 'list_api':
+        return account['username'], lambda: ('GET', '/api/list?path=' + rng.choice(folders), None, None)
+    if name == 'download':
+        user_ids = ids[account['id']]
+        return account['username'], lambda: ('GET', f'/download/{rng.choice(user_ids)}', None, None)
+    if name == 'download_folder':
+        return account['username'], lambda: ('GET', '/download_folder?folder_path=' + rng.choice(top), None, None)
+    if name == 'upload':
+        counter = iter(range(10 ** 9))
+
+        def upload():
+            n = next(counter)
+            files = [('files', (f'w{worker}_{n}_{i}.bin', rng.randbytes(rng.randint(1024, 64 * 1024)))) for i in range(5)]
+            return 'POST', '/upload', {'current_path': f'bench-upload/w{worker}'}, files
+        return account['username'], upload
+    if name == 'browse_uploads':
+        # 管理员浏览其他用户的目录
+        return accounts[0]['username'], lambda: (
+            'GET', f"/admin/uploads/{rng.choice(accounts)['id']}/{rng.choice(folders)}".rstrip('/'), None, None)
+    raise ValueError(name)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def run_scenario(name, make_driver, accounts, ids, args):
+    latencies, sql, errors, transferred = [], [], [0], [0]
+    lock = threading.Lock()
+    per_worker = max(1, args.requests // args.concurrency)
+    # 所有线程预热完再同时开始计时
+    ready = threading.Barrier(args.concurrency + 1)
+
+    def work(worker):
+        rng = random.Random(args.seed * 1000 + worker)
+        driver = make_driver()
+        username, next_request = make_scenario(name, accounts, ids, worker, rng)
+        try:
+            driver.login(username)
+            for _ in range(args.warmup):
+                driver.request(*next_request())
+        finally:
+            ready.wait()
+        for _ in range(per_worker):
+            method, path, form, files = next_request()
+            payload = sum(len(content) for _, (_, content) in files or ())
+            start = time.perf_counter()
+            try:
+                status, size, queries = driver.request(method, path, form, files)
+            except Exception:
+                status, size, queries = None, 0, None
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status is None or status >= 400:
+                    errors[0] += 1
+                latencies.append(elapsed)
+                transferred[0] += size + payload
+                if queries is not None:
+                    sql.append(queries)
+
+    threads = [threading.Thread(target=work, args=(w,)) for w in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'mb_per_s': round(transferred[0] / wall / 1024 / 1024, 2) if wall else None,
+        'sql_mean': round(sum(sql) / len(sql), 1) if sql else None,
+        'sql_max': max(sql) if sql else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        result[f'p{p}_ms'] = round(value * 1000, 2) if value is not None else None
+    return result
+
+
+# ------------------ 报告与基线 ------------------
+COLUMNS = ('requests', 'errors', 'rps', 'p50_ms', 'p90_ms', 'p99_ms', 'mb_per_s', 'sql_mean', 'peak_rss_mb')
+# 与基线比较的指标：(名称, 越大越好)
+COMPARED = (('p50_ms', False), ('p99_ms', False), ('rps', True), ('sql_mean', False), ('peak_rss_mb', False))
+
+def print_table(results):
+    header = f"{'mode':<8}{'scenario':<18}" + ''.join(f'{c:>12}' for c in COLUMNS)
+    print(header)
+    print('-' * len(header))
+    for mode, scenarios in results.items():
+        for name, row in scenarios.items():
+            cells = ''.join(f"{'-' if row.get(c) is None else row[c]:>12}" for c in COLUMNS)
+            print(f'{mode:<8}{name:<18}{cells}')
+
+def compare(results, baseline, tolerance):
+    """打印与基线的差异，返回退步的条目"""
+    regressions = []
+    print(f'\n与基线比较（容差 {tolerance:.0%}）：')
+    for mode, scenarios in results.items():
+        for name, row in scenarios.items():
+            base = baseline.get(mode, {}).get(name)
+            if not base:
+                continue
+            diffs = []
+            for metric, higher_better in COMPARED:
+                old, new = base.get(metric), row.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = -change if higher_better else change
+                flag = ' !' if worse > tolerance else ''
+                if flag:
+                    regressions.append((mode, name, metric, old, new))
+                diffs.append(f'{metric} {old}->{new} ({change:+.0%}){flag}')
+            print(f'  {mode:<8}{name:<18}' + '  '.join(diffs))
+    return regressions
+
+
+# ------------------ 运行 ------------------
+def make_app(workdir):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'UPLOAD_ROOT': os.path.join(workdir, 'uploads'),
+        'STORAGE_BACKEND': 'local',
+        'DOWNLOAD_OFFLOAD': None,
+        'DEFAULT_USER_QUOTA': None,
+        'JOB_WORKERS': 0,
+        'ZIP_JOB_MIN_SIZE': float('inf'),
+        'THUMB_WORKERS': 0,
+        'USAGE_RECONCILE_INTERVAL': 0,
+        # 只为拿到每个请求的 SQL 条数，不采样、不落盘
+        'PROFILE_ENABLED': True,
+        'PROFILE_SAMPLE_INTERVAL': 0,
+        'PROFILE_SLOW_MS': float('inf'),
+    }, background=False)
+
+def measure(mode, name, workdir, accounts, ids, args):
+    """在子进程里执行：新建应用（数据已在 workdir 里），跑一个场景"""
+    app = make_app(workdir)
+    if mode == 'client':
+        return run_scenario(name, lambda: TestClientDriver(app), accounts, ids, args)
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        return run_scenario(name, lambda: HttpDriver(server.server_port), accounts, ids, args)
+    finally:
+        server.shutdown()
+
+def isolated(mode, name, workdir, accounts, ids, args):
+    """每个场景一个全新的子进程，峰值内存互不影响"""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(measure, mode, name, workdir, accounts, ids, args).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workdir', help='数据目录，默认使用临时目录并在结束后删除')
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--files', type=int, default=2000, help='每个用户的文件数')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--size-median', type=int, default=16 * 1024)
+    parser.add_argument('--size-sigma', type=float, default=1.5)
+    parser.add_argument('--size-max', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--dup-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=('client', 'server', 'both'), default='both')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400, help='每个场景的请求总数')
+    parser.add_argument('--warmup', type=int, default=3, help='每个并发线程先发的预热请求数')
+    parser.add_argument('--save', help='把结果写入 JSON 文件，可作为之后的基线')
+    parser.add_argument('--baseline', help='与之前保存的结果比较')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cloud-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    app = make_app(workdir)
+
+    try:
+        start = time.perf_counter()
+        with app.app_context():
+            accounts = synth.populate(args.users, args.files, args.depth, args.fanout, args.size_median,
+                                      args.size_sigma, args.size_max, args.dup_ratio, args.seed)
+            ids = {a['id']: synth.file_ids(a['id']) for a in accounts}
+        print(f'数据准备 {time.perf_counter() - start:.1f}s：{args.users} 个用户 × {args.files} 个文件，目录 {workdir}')
+
+        scenarios = [s for s in args.scenarios.split(',') if s]
+        modes = ('client', 'server') if args.mode == 'both' else (args.mode,)
+        results = {mode: {s: isolated(mode, s, workdir, accounts, ids, args) for s in scenarios} for mode in modes}
+
+        print()
+        print_table(results)
+        regressions = []
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as fp:
+                regressions = compare(results, json.load(fp)['results'], args.tolerance)
+        if args.save:
+            meta = {k: v for k, v in vars(args).items() if k not in ('save', 'baseline', 'workdir')}
+            meta.update(python=platform.python_version(), platform=platform.platform(),
+                        time=time.strftime('%Y-%m-%d %H:%M:%S'))
+            with open(args.save, 'w', encoding='utf-8') as fp:
+                json.dump({'meta': meta, 'results': results}, fp, ensure_ascii=False, indent=2)
+        return 1 if regressions else 0
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import math
+import random
+import hashlib
+from app import blobstore, vfs
+from app.init_db import sqlite
+from app.models import File, User
+
+# 合成测试数据：直接写入存储和 file 表，不经过 HTTP，几万个文件也只要几秒。
+# 目录树为 fanout 叉、depth 层，文件随机分布在各层目录（含根目录）里；
+# 文件大小服从对数正态分布（中位数 size_median，超过 size_max 截断），
+# dup_ratio 比例的文件复用已有内容，用来覆盖去重路径。同一个 seed 生成的数据完全相同。
+PASSWORD = 'bench'
+BATCH = 1000
+
+
+def folder_tree(depth, fanout):
+    """所有文件夹路径，按层次顺序"""
+    folders, level = [], ['']
+    for d in range(depth):
+        level = [vfs.join_path(parent, f'dir{d}_{i}') for parent in level for i in range(fanout)]
+        folders.extend(level)
+    return folders
+
+def file_size(rng, median, sigma, maximum):
+    return min(maximum, int(median * math.exp(sigma * rng.gauss(0, 1))))
+
+
+def _write_batch(user_id, items, known):
+    """items 为 [(路径, 内容或已有哈希, 大小)]，内容为 bytes 时新建 blob"""
+    staged, reused = [], []
+    for path, content, size in items:
+        if isinstance(content, str):
+            reused.append((path, content, size))
+            continue
+        blob_hash = hashlib.sha256(content).hexdigest()
+        temp = blobstore.staging_path()
+        with open(temp, 'wb') as fp:
+            fp.write(content)
+        staged.append((temp, blob_hash, size, path))
+    blobstore.ingest_many([(temp, h, size) for temp, h, size, _ in staged])
+    for _, blob_hash, _ in reused:
+        blobstore.add_ref(blob_hash)
+    vfs.put_files(user_id, [(path, h, size) for _, h, size, path in staged] + reused)
+    sqlite.session.commit()
+    known.extend((h, size) for _, h, size, _ in staged)
+
+
+def populate(users=3, files=2000, depth=3, fanout=4, size_median=16 * 1024, size_sigma=1.5,
+             size_max=4 * 1024 * 1024, dup_ratio=0.1, seed=42):
+    """在当前应用上下文里生成用户和文件，返回每个用户的 {'id', 'username', 'folders'}
+
+    第一个用户是管理员。已经生成过（同名用户存在）时直接返回已有的数据。
+    """
+    rng = random.Random(seed)
+    folders = folder_tree(depth, fanout)
+    accounts = []
+    for n in range(users):
+        username = f'bench{n}'
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(username=username, password=PASSWORD, is_admin=(n == 0))
+            sqlite.session.add(user)
+            sqlite.session.commit()
+            known, batch = [], []
+            targets = [''] + folders
+            for i in range(files):
+                path = vfs.join_path(rng.choice(targets), f'file{i:06d}.bin')
+                if known and rng.random() < dup_ratio:
+                    blob_hash, size = rng.choice(known)
+                    batch.append((path, blob_hash, size))
+                else:
+                    size = file_size(rng, size_median, size_sigma, size_max)
+                    batch.append((path, rng.randbytes(size), size))
+                if len(batch) >= BATCH:
+                    _write_batch(user.id, batch, known)
+                    batch = []
+            if batch:
+                _write_batch(user.id, batch, known)
+            for folder in folders:
+                vfs.ensure_folders(user.id, folder)
+            sqlite.session.commit()
+        accounts.append({'id': user.id, 'username': username, 'folders': folders})
+    return accounts
+
+def file_ids(user_id, limit=1000):
+    """用于下载场景的文件 ID"""
+    rows = File.query.filter_by(user_id=user_id, is_folder=False).order_by(File.id).limit(limit)
+    return [f.id for f in rows]
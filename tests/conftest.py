@@ -0,0 +1,48 @@
+import pytest
+from app import create_app
+from app.init_db import sqlite
+from app.models import User
+
+PASSWORD = 'secret'
+
+
+def make_config(tmp_path, **overrides):
+    """数据库和上传目录都放在 pytest 的临时目录里，不启动后台线程，任务同步执行"""
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'UPLOAD_ROOT': str(tmp_path / 'uploads'),
+        'STORAGE_BACKEND': 'local',
+        'DOWNLOAD_OFFLOAD': None,
+        'JOB_WORKERS': 0,
+        'THUMB_WORKERS': 0,
+        'USAGE_RECONCILE_INTERVAL': 0,
+    }
+    config.update(overrides)
+    return config
+
+def add_user(app, username, is_admin=False):
+    with app.app_context():
+        user = User(username=username, password=PASSWORD, is_admin=is_admin)
+        sqlite.session.add(user)
+        sqlite.session.commit()
+        return user.id
+
+def login(app, username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': PASSWORD})
+    return client
+
+
+@pytest.fixture
+def config(tmp_path):
+    return make_config(tmp_path)
+
+@pytest.fixture
+def app(config):
+    return create_app(config, background=False)
+
+@pytest.fixture
+def client(app):
+    add_user(app, 'alice', is_admin=True)
+    return login(app, 'alice')
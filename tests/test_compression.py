@@ -0,0 +1,106 @@
+import gzip
+import io
+import pytest
+from app import create_app
+from app.init_db import sqlite
+from app.models import Blob, File
+from conftest import add_user, login, make_config
+
+CONTENT = b''.join(b'2026-10-18 12:00:%02d INFO request handled in %d ms\n' % (i % 60, i) for i in range(5000))
+
+
+def upload(client, name='app.log', content=CONTENT):
+    client.post('/upload', data={'current_path': '', 'files': [(io.BytesIO(content), name)]},
+                headers={'Accept': 'application/json'})
+
+def stored(app, name='app.log'):
+    with app.app_context():
+        f = File.query.filter_by(filename=name).one()
+        return f.id, sqlite.session.get(Blob, f.blob_hash).codec
+
+
+@pytest.fixture
+def config(tmp_path):
+    return make_config(tmp_path, COMPRESS_AT_REST=True)
+
+
+def test_download_passes_gzip_through(app, client):
+    upload(client)
+    file_id, codec = stored(app)
+    assert codec == 'gzip'
+
+    response = client.get(f'/download/{file_id}', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == CONTENT
+
+def test_download_decodes_without_accept_encoding(app, client):
+    upload(client)
+    file_id, _ = stored(app)
+
+    response = client.get(f'/download/{file_id}')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == CONTENT
+
+    # 带 Range 时按原始内容的偏移返回，即使客户端支持 gzip
+    response = client.get(f'/download/{file_id}', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.get_data() == CONTENT[10:20]
+
+
+# ------------------ ASGI 入口 ------------------
+def asgi_get(asgi_app, path, headers):
+    """不依赖 HTTP 客户端，直接按 ASGI 协议调用一次 GET，返回 (状态码, 响应头, 响应体)"""
+    anyio = pytest.importorskip('anyio')
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    anyio.run(asgi_app, scope, receive, send)
+    start = messages[0]
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, body
+
+@pytest.fixture
+def asgi(tmp_path, monkeypatch):
+    """app.asgi 在导入时用 Config 创建应用，先把 Config 指向临时目录再重新导入"""
+    pytest.importorskip('starlette')
+    import sys
+    from app.config import Config
+    for key, value in make_config(tmp_path, COMPRESS_AT_REST=True).items():
+        monkeypatch.setattr(Config, key, value, raising=False)
+    monkeypatch.delitem(sys.modules, 'app.asgi', raising=False)
+    import app.asgi
+    return app.asgi
+
+def test_asgi_download_gzip_and_identity(asgi):
+    flask_app = asgi.flask_app
+    add_user(flask_app, 'alice')
+    client = login(flask_app, 'alice')
+    upload(client)
+    file_id, codec = stored(flask_app)
+    assert codec == 'gzip'
+    cookie = f"{flask_app.config['SESSION_COOKIE_NAME']}={client.get_cookie(flask_app.config['SESSION_COOKIE_NAME']).value}"
+
+    status, headers, body = asgi_get(asgi.app, f'/download/{file_id}', {'Cookie': cookie, 'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['content-encoding'] == 'gzip'
+    assert gzip.decompress(body) == CONTENT
+
+    status, headers, body = asgi_get(asgi.app, f'/download/{file_id}', {'Cookie': cookie})
+    assert status == 200
+    assert 'content-encoding' not in headers
+    assert body == CONTENT
@@ -0,0 +1,45 @@
+import io
+import zipfile
+from app import vfs
+from app.init_db import sqlite
+from app.models import Job, User
+
+
+def upload(client, files, current_path=''):
+    client.post('/upload', data={'current_path': current_path,
+                                 'files': [(io.BytesIO(content), name) for name, content in files.items()]},
+                headers={'Accept': 'application/json'})
+
+FILES = {f'd/s{i % 3}/f{i}.txt': b'content %d' % i for i in range(7)}
+
+
+def test_paged_blobs_release_the_read_transaction(app, client):
+    upload(client, FILES)
+    with app.app_context():
+        user_id = User.query.filter_by(username='alice').one().id
+        expected = list(vfs.iter_blobs(user_id, 'd'))
+        sqlite.session.rollback()
+        paged = []
+        for entry in vfs.iter_blobs_paged(user_id, 'd', page=2):
+            # 每页读完都结束了读事务，向客户端发送期间不占用连接
+            assert not sqlite.session().in_transaction()
+            paged.append(entry)
+        assert paged == expected
+        assert len(paged) == len(FILES)
+
+def test_download_folder_zip(client):
+    upload(client, FILES)
+    response = client.get('/download_folder?folder_path=d')
+    names = zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()
+    assert sorted(names) == sorted(name[len('d/'):] for name in FILES)
+
+def test_admin_folder_download_uses_zip_job(app, client):
+    upload(client, FILES)
+    app.config['ZIP_JOB_MIN_SIZE'] = 1
+    with app.app_context():
+        user_id = User.query.filter_by(username='alice').one().id
+    response = client.get(f'/admin/download/{user_id}/d')
+    assert b'jobs' in response.get_data() and b'admin/uploads' in response.get_data()
+    with app.app_context():
+        job = Job.query.one()
+        assert (job.kind, job.status) == ('zip', 'done')
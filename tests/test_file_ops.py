@@ -0,0 +1,18 @@
+import io
+from app import vfs
+from app.models import File, User
+
+
+def test_delete_folder_rejects_blank_name(app, client):
+    client.post('/upload', data={'current_path': '', 'files': [(io.BytesIO(b'x'), 'd/keep.txt')]},
+                headers={'Accept': 'application/json'})
+    for name in ('', '  ', '/', '..'):
+        response = client.post('/delete/1_folder', data={'current_path': 'd', 'folder_name': name})
+        assert b'alert' in response.get_data()
+    with app.app_context():
+        user_id = User.query.filter_by(username='alice').one().id
+        assert vfs.get_entry(user_id, 'd/keep.txt')
+
+    client.post('/delete/1_folder', data={'current_path': '', 'folder_name': 'd'})
+    with app.app_context():
+        assert File.query.count() == 0
@@ -0,0 +1,36 @@
+import os
+import time
+import signal
+import multiprocessing
+from app import create_app, jobs
+from app.init_db import sqlite
+from app.models import Job
+from conftest import make_config, add_user
+
+
+def wait_for(app, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app.app_context():
+            job = sqlite.session.get(Job, job_id)
+            if job.status in ('done', 'failed'):
+                return job.status
+        time.sleep(0.2)
+    return None
+
+def test_dispatcher_replaces_a_broken_pool(tmp_path):
+    app = create_app(make_config(tmp_path, JOB_WORKERS=1, JOB_POLL_INTERVAL=0.1), background=False)
+    user_id = add_user(app, 'alice', is_admin=True)
+    jobs.start_dispatcher(app)
+    with app.test_request_context():
+        first = jobs.enqueue(user_id, 'gc')
+    assert wait_for(app, first) == 'done'
+
+    # 杀掉进程池的子进程，进程池随之损坏
+    for child in multiprocessing.active_children():
+        os.kill(child.pid, signal.SIGKILL)
+    time.sleep(1)
+
+    with app.test_request_context():
+        second = jobs.enqueue(user_id, 'gc')
+    assert wait_for(app, second) == 'done'
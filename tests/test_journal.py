@@ -0,0 +1,56 @@
+from datetime import datetime
+from app import journal
+from app.init_db import sqlite
+from app.models import Change
+from conftest import add_user, login
+
+
+def mkdir(client, name):
+    client.post('/create_folder', data={'folder_name': name, 'current_path': ''})
+
+def age_and_prune(app):
+    """把已有记录都改成很久以前的，再按保留时间清理"""
+    with app.app_context():
+        Change.query.update({'created_at': datetime(2000, 1, 1)})
+        pruned = journal.prune(3600)
+        sqlite.session.commit()
+        return pruned
+
+
+def test_changes_since_cursor(app, client):
+    cursor = client.get('/api/changes/cursor').json['cursor']
+    mkdir(client, 'docs')
+    body = client.get(f'/api/changes?cursor={cursor}').json
+    assert [(c['op'], c['path']) for c in body['changes']] == [('put', 'docs')]
+    assert body['cursor'] > cursor and not body['has_more']
+
+def test_new_user_can_sync_after_prune(app, client):
+    old = client.get('/api/changes/cursor').json['cursor']
+    for name in ('a', 'b', 'c'):
+        mkdir(client, name)
+    assert age_and_prune(app) == 2  # 全局最新的一条保留
+
+    # 从未被清理过记录的新用户：/cursor 和 0 都是有效游标
+    add_user(app, 'bob')
+    bob = login(app, 'bob')
+    cursor = bob.get('/api/changes/cursor').json['cursor']
+    assert bob.get(f'/api/changes?cursor={cursor}').status_code == 200
+    assert bob.get('/api/changes?cursor=0').status_code == 200
+    mkdir(bob, 'inbox')
+    body = bob.get(f'/api/changes?cursor={cursor}').json
+    assert [(c['op'], c['path']) for c in body['changes']] == [('put', 'inbox')]
+
+    # 记录被清理过的用户：旧游标过期，重新取的游标可以继续同步
+    assert client.get(f'/api/changes?cursor={old}').status_code == 410
+    cursor = client.get('/api/changes/cursor').json['cursor']
+    assert client.get(f'/api/changes?cursor={cursor}').status_code == 200
+
+def test_user_with_all_rows_pruned_can_restart(app, client):
+    mkdir(client, 'a')
+    add_user(app, 'bob')
+    bob = login(app, 'bob')
+    mkdir(bob, 'b')  # 全局最新的一条属于 bob，alice 的记录全部被清理
+    age_and_prune(app)
+    cursor = client.get('/api/changes/cursor').json['cursor']
+    assert client.get(f'/api/changes?cursor={cursor}').status_code == 200
+    assert client.get('/api/changes?cursor=0').status_code == 410
@@ -0,0 +1,38 @@
+import io
+from datetime import timedelta
+from werkzeug.http import http_date, parse_date
+from app.models import File
+
+CONTENT = bytes(range(256)) * 40
+
+
+def uploaded(app, client):
+    client.post('/upload', data={'current_path': '', 'files': [(io.BytesIO(CONTENT), 'data.bin')]},
+                headers={'Accept': 'application/json'})
+    with app.app_context():
+        return File.query.filter_by(filename='data.bin').one().id
+
+
+def test_if_range_date_must_match_exactly(app, client):
+    file_id = uploaded(app, client)
+    full = client.get(f'/download/{file_id}')
+    last_modified = full.headers['Last-Modified']
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': last_modified})
+    assert response.status_code == 206
+    assert response.get_data() == CONTENT[:10]
+
+    # 晚于 Last-Modified 的日期不是强校验匹配，返回完整内容
+    later = http_date(parse_date(last_modified) + timedelta(hours=1))
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': later})
+    assert response.status_code == 200
+    assert response.get_data() == CONTENT
+
+def test_if_range_etag(app, client):
+    file_id = uploaded(app, client)
+    etag = client.get(f'/download/{file_id}').headers['ETag']
+
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    response = client.get(f'/download/{file_id}', headers={'Range': 'bytes=0-9', 'If-Range': 'W/' + etag})
+    assert response.status_code == 200
@@ -0,0 +1,70 @@
+import time
+import threading
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app import metrics, vfs
+from app.usage import reconcile_usage
+from app.init_db import sqlite
+from app.models import File, User
+from conftest import add_user
+
+
+@pytest.fixture
+def user_id(app):
+    return add_user(app, 'alice')
+
+
+def test_concurrent_renames_to_the_same_name(app, user_id, monkeypatch):
+    with app.app_context():
+        vfs.ensure_folders(user_id, 'a')
+        vfs.ensure_folders(user_id, 'b')
+        sqlite.session.commit()
+
+    # 检查通过之后停一下，让两个重命名的“检查-修改”交错
+    mark_dirty = vfs.tree_cache.mark_dirty
+    monkeypatch.setattr(vfs.tree_cache, 'mark_dirty', lambda *args: (time.sleep(0.2), mark_dirty(*args)))
+    results = {}
+
+    def rename(old):
+        with app.app_context():
+            try:
+                vfs.move_path(user_id, old, 'c')
+                sqlite.session.commit()
+                results[old] = 'ok'
+            except FileExistsError:
+                sqlite.session.rollback()
+                results[old] = 'exists'
+
+    threads = [threading.Thread(target=rename, args=(name,)) for name in ('a', 'b')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results.values()) == ['exists', 'ok']
+    with app.app_context():
+        assert File.query.filter_by(user_id=user_id, filename='c').count() == 1
+
+def test_paths_are_unique(app, user_id):
+    with app.app_context():
+        sqlite.session.add(File(user_id=user_id, filename='dup', is_folder=True))
+        sqlite.session.add(File(user_id=user_id, filename='dup', is_folder=True))
+        with pytest.raises(IntegrityError):
+            sqlite.session.commit()
+
+def test_file_count_follows_writes(app, user_id):
+    with app.app_context():
+        vfs.put_file(user_id, 'a/x.txt', None, 1)
+        vfs.put_files(user_id, [('a/y.txt', None, 2), ('b/z.txt', None, 3), ('a/x.txt', None, 4)])
+        vfs.move_path(user_id, 'b', 'a/b')
+        sqlite.session.commit()
+        assert sqlite.session.get(User, user_id).file_count == 3
+        vfs.delete_path(user_id, 'a/b')
+        sqlite.session.commit()
+        assert sqlite.session.get(User, user_id).file_count == 2
+        assert metrics.inventory(ttl=0)['files'] == 2
+
+        # 对账按文件行修正漂移
+        User.query.filter_by(id=user_id).update({'file_count': 7})
+        sqlite.session.commit()
+        reconcile_usage(user_id)
+        assert sqlite.session.get(User, user_id).file_count == 2